@@ -0,0 +1,28 @@
+import trial_cache
+
+#bump this whenever what incremental runs keep between runs changes
+STATE_VERSION = 4
+
+def get_state_filename(name, cache_dir=None):
+    #None if caching is off (see trial_cache.get_cache_path())
+    return trial_cache.get_cache_path(name + "_state.pkl", cache_dir)
+
+def load_state(name, cache_dir=None):
+    '''
+    Returns the state an earlier incremental run saved under name (e.g.
+    "phase2"), or an empty {"sessions": {}, "bins": {}} if there's none (or
+    it's unreadable or out of date), which makes the run start from scratch.
+    '''
+    empty = {"sessions": {}, "bins": {}}
+    state = trial_cache.load_pickle(get_state_filename(name, cache_dir))
+    if state is None or state.get("version") != STATE_VERSION:
+        return empty
+    return state
+
+def save_state(name, state, cache_dir=None):
+    '''
+    Writes the state for the next incremental run (see
+    trial_cache.save_pickle()).
+    '''
+    trial_cache.save_pickle(get_state_filename(name, cache_dir),
+        dict(state, version=STATE_VERSION))
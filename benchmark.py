@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import subprocess
+import synthetic_cohort
+
+#times every phase script end to end and per stage (see instrumentation.py)
+#on a synthetic cohort (see synthetic_cohort.py), first with an empty trial
+#cache ("cold") and then again with it filled ("warm"), and appends the
+#results, with the commit they were measured at, to RESULTS_FILE. --compare
+#shows how the latest results changed since earlier ones, e.g.
+#    python benchmark.py --cohort small
+#    (change something, commit)
+#    python benchmark.py --cohort small --compare
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+#synthetic cohorts are written to BENCHMARK_DIR/cohorts/<name>/input
+BENCHMARK_DIR = os.path.join(REPO_DIR, "benchmarks")
+
+#one JSON result per line, appended to by every run
+RESULTS_FILE = os.path.join(BENCHMARK_DIR, "results.jsonl")
+
+#cohort name -> (animals, sessions per animal in each phase, trials per session)
+COHORTS = {
+    "small": (7, 10, 300),
+    "medium": (30, 100, 300),
+    "large": (200, 2000, 300)
+}
+
+#extra arguments each phase script is run with
+PHASE_ARGUMENTS = {
+    "phase1": [],
+    "phase2": ["--seed", "0"],
+    "phase3": [],
+    "phase4": []
+}
+
+def run_benchmarks(cohort, phases=synthetic_cohort.PHASES, iterations=None,
+    processes=None):
+    '''
+    Writes the cohort (if it isn't there yet), runs every phase on it cold
+    and warm and returns the result, e.g.
+        {"commit": "4296596", "cohort": {"name": "small", ...},
+         "phases": {"phase2": {"cold": {"wall_seconds": 12.1,
+                                        "max_rss_kb": 80212,
+                                        "stages": {"decode": 4.2, ...},
+                                        "counters": {...}},
+                               "warm": {...}}, ...}}
+
+    :param cohort: name of a cohort in COHORTS
+    :param iterations: phase 2 bootstrap iterations, None for its default
+    :param processes: phase 2 worker processes, None for one per CPU core
+    '''
+    animals, sessions, trials = COHORTS[cohort]
+    cohort_dir = os.path.join(BENCHMARK_DIR, "cohorts", cohort)
+    written = synthetic_cohort.write_cohort(os.path.join(cohort_dir, "input"),
+        animals, sessions, trials, phases=phases, processes=processes)
+    if written:
+        print "Wrote %d sessions to %s" % (written, cohort_dir)
+
+    result = {
+        "commit": get_commit(),
+        "date": datetime.datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "cohort": {"name": cohort, "animals": animals, "sessions": sessions,
+            "trials": trials},
+        "phases": {}
+    }
+    for phase in phases:
+        arguments = list(PHASE_ARGUMENTS[phase])
+        if phase == "phase2" and iterations is not None:
+            arguments += ["--iterations", str(iterations)]
+        if phase == "phase2" and processes is not None:
+            arguments += ["--processes", str(processes)]
+        shutil.rmtree(os.path.join(cohort_dir, ".trial_cache"),
+            ignore_errors=True)
+        result["phases"][phase] = {}
+        for mode in ["cold", "warm"]:
+            timing = run_phase(phase, cohort_dir, arguments)
+            result["phases"][phase][mode] = timing
+            print "%s %s: %.2f s" % (phase, mode, timing["wall_seconds"])
+    return result
+
+def run_phase(phase, cohort_dir, arguments):
+    '''
+    Runs one phase script in cohort_dir, saving its figures as png, and
+    returns its wall time (including starting Python) and its --report.
+    '''
+    report_file = os.path.join(cohort_dir, "report.json")
+    shutil.rmtree(os.path.join(cohort_dir, "output"), ignore_errors=True)
+    command = [sys.executable, os.path.join(REPO_DIR, phase + "_analysis.py"),
+        "--save-figures", "png", "--report", report_file] + arguments
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call(command, cwd=cohort_dir, stdout=devnull)
+    wall_seconds = time.time() - start
+    with open(report_file) as f:
+        report = json.load(f)
+    os.remove(report_file)
+    return {
+        "wall_seconds": wall_seconds,
+        "max_rss_kb": report["max_rss_kb"],
+        "stages": dict((name, totals["seconds"]) for name, totals in
+            report["stages"].iteritems()),
+        "counters": report["counters"]
+    }
+
+def get_commit():
+    #the commit being benchmarked, with a + if there are uncommitted changes
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short",
+            "HEAD"], cwd=REPO_DIR).strip()
+        changes = subprocess.check_output(["git", "status", "--porcelain",
+            "--untracked-files=no"], cwd=REPO_DIR).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+" if changes else "")
+
+def save_result(result, results_file=RESULTS_FILE):
+    results_dir = os.path.dirname(results_file)
+    if results_dir and not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    with open(results_file, "a") as f:
+        f.write(json.dumps(result, sort_keys=True) + "\n")
+
+def load_results(results_file=RESULTS_FILE):
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def find_result(results, commit):
+    #the latest of results measured at commit
+    results_at_commit = [result for result in results if
+        result["commit"] == commit]
+    if not results_at_commit:
+        sys.exit("No results for commit %s" % commit)
+    return results_at_commit[-1]
+
+def print_comparison(old, new):
+    '''
+    Prints wall time, peak RSS and every stage's seconds of two results side
+    by side, e.g.
+        phase2 cold  wall_seconds  12.10  9.80  -19.0%
+    '''
+    print "%s (%s) -> %s (%s)" % (old["commit"], old["date"], new["commit"],
+        new["date"])
+    for phase in sorted(new["phases"]):
+        for mode in ["cold", "warm"]:
+            if phase not in old["phases"]:
+                continue
+            old_timing = old["phases"][phase][mode]
+            new_timing = new["phases"][phase][mode]
+            rows = [("wall_seconds", old_timing["wall_seconds"],
+                new_timing["wall_seconds"]), ("max_rss_kb",
+                old_timing["max_rss_kb"], new_timing["max_rss_kb"])]
+            for name in sorted(set(old_timing["stages"]) |
+            set(new_timing["stages"])):
+                rows.append((name, old_timing["stages"].get(name),
+                    new_timing["stages"].get(name)))
+            for name, old_value, new_value in rows:
+                print "%-7s %-5s %-13s %10s %10s %8s" % (phase, mode, name,
+                    format_value(old_value), format_value(new_value),
+                    format_change(old_value, new_value))
+
+def format_value(value):
+    if value is None:
+        return "-"
+    return "%.2f" % value if isinstance(value, float) else str(value)
+
+def format_change(old_value, new_value):
+    if not old_value or new_value is None:
+        return ""
+    return "%+.1f%%" % (100.0 * (new_value - old_value) / old_value)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time every phase on a synthetic cohort")
+    parser.add_argument("--cohort", choices=sorted(COHORTS), default="small",
+        help="cohort to run on (default: %(default)s): " + ", ".join(
+        "%s %d animals x %d sessions" % (name, COHORTS[name][0],
+        COHORTS[name][1]) for name in sorted(COHORTS)))
+    parser.add_argument("--phases", nargs="+",
+        choices=synthetic_cohort.PHASES, default=synthetic_cohort.PHASES,
+        help="phases to time (default: all)")
+    parser.add_argument("--iterations", type=int, default=None,
+        help="phase 2 bootstrap iterations (default: the script's)")
+    parser.add_argument("--processes", type=int, default=None,
+        help="number of worker processes (default: one per CPU core)")
+    parser.add_argument("--compare", nargs="*", metavar="COMMIT",
+        help="don't run anything, compare the latest results on the cohort "
+        "with the ones before them, or with the ones for COMMIT, or the "
+        "results for two COMMITs")
+    args = parser.parse_args()
+
+    if args.compare is None:
+        save_result(run_benchmarks(args.cohort, args.phases, args.iterations,
+            args.processes))
+    else:
+        results = [result for result in load_results() if
+            result["cohort"]["name"] == args.cohort]
+        if len(args.compare) == 2:
+            old = find_result(results, args.compare[0])
+            new = find_result(results, args.compare[1])
+        elif len(args.compare) == 1:
+            old, new = find_result(results, args.compare[0]), results[-1]
+        elif len(results) >= 2:
+            old, new = results[-2], results[-1]
+        else:
+            sys.exit("Need two %s results to compare" % args.cohort)
+        print_comparison(old, new)
@@ -0,0 +1,389 @@
+import math
+import hashlib
+import numpy as np
+import bootstrap_memo
+import instrumentation
+
+#column order of the count arrays everything in here works with
+OUTCOMES = ["success", "failure", "ignore"]
+
+def resample_outcome_counts(counts, iterations, random_state=np.random):
+    '''
+    Returns an iterations x 3 array of (success, failure, ignore) counts, one
+    row per bootstrap iteration. Drawing len(trials) trials with replacement
+    from the observed outcomes only depends on how many trials had each
+    outcome, so each iteration is a single multinomial draw instead of
+    len(trials) random.choice() calls.
+
+    :param counts: (successes, failures, ignores) observed in a cell
+    :param iterations: number of bootstrap iterations
+    :param random_state: np.random or a np.random.RandomState to draw from
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    total = counts.sum()
+    if total == 0:
+        return np.zeros((iterations, len(OUTCOMES)), dtype=np.int64)
+    return random_state.multinomial(total, counts / float(total),
+        size=iterations)
+
+def get_d_primes(counts):
+    '''
+    Returns d' (p(success) - p(failure) over non-ignore trials) for each row
+    of an n x 3 array of (success, failure, ignore) counts, or None if any
+    row has no successes or failures (d' is undefined for that row).
+    '''
+    successes = counts[:, 0]
+    failures = counts[:, 1]
+    total = (successes + failures).astype(np.float64)
+    if (total == 0).any():
+        return None
+    return successes/total - failures/total
+
+def get_pcts(counts, column):
+    '''
+    Returns the percentage of trials in each row of an n x 3 count array that
+    had the outcome in column, or None if any row has no trials.
+    '''
+    total = counts.sum(axis=1).astype(np.float64)
+    if (total == 0).any():
+        return None
+    return (counts[:, column]/total) * 100.0
+
+def get_pct_corrects(counts):
+    return get_pcts(counts, 0)
+
+def get_pct_failures(counts):
+    return get_pcts(counts, 1)
+
+def get_pct_ignores(counts):
+    return get_pcts(counts, 2)
+
+#statistics that can be computed from the same bootstrap draws
+STATISTICS = {
+    "d_prime": get_d_primes,
+    "pct_correct": get_pct_corrects,
+    "pct_failure": get_pct_failures,
+    "pct_ignore": get_pct_ignores
+}
+
+def get_observed_stats(counts, statistics=STATISTICS.keys()):
+    '''
+    Returns a dict with statistic names as keys and their value for the
+    observed (success, failure, ignore) counts of a cell as values (None if
+    the statistic is undefined for the cell).
+    '''
+    counts = np.asarray(counts, dtype=np.int64).reshape(1, len(OUTCOMES))
+    result = {}
+    for name in statistics:
+        values = STATISTICS[name](counts)
+        result[name] = None if values is None else float(values[0])
+    return result
+
+def get_bootstrapped_std_devs(counts, iterations,
+    statistics=STATISTICS.keys(), random_state=np.random):
+    '''
+    Returns a dict with statistic names as keys and their bootstrapped std dev
+    as values. All statistics come from the same draws, so one resample per
+    cell covers d', percent correct, etc. and they stay consistent with each
+    other. A std dev is None if the statistic was undefined for any draw, or
+    if there were fewer than 2 draws.
+
+    :param counts: (successes, failures, ignores) observed in a cell
+    :param iterations: number of bootstrap iterations
+    :param statistics: names of statistics in STATISTICS to compute
+    :param random_state: np.random or a np.random.RandomState to draw from
+    '''
+    draws = resample_outcome_counts(counts, iterations, random_state)
+    result = {}
+    for name in statistics:
+        values = STATISTICS[name](draws)
+        if values is None or len(values) < 2:
+            result[name] = None
+        else:
+            result[name] = std_dev(values)
+    return result
+
+def std_dev(values):
+    #sample std dev, same as the old math.fsum version in phase2_analysis.py
+    return float(np.std(values, ddof=1))
+
+#draws in the first batch in adaptive mode (see get_adaptive_std_devs()).
+#Bump bootstrap_memo.MEMO_VERSION if this changes.
+ADAPTIVE_BATCH_SIZE = 1000
+
+def get_adaptive_std_devs(counts, max_iterations, tolerance,
+    statistics=STATISTICS.keys(), random_state=np.random,
+    batch_size=ADAPTIVE_BATCH_SIZE):
+    '''
+    Like get_bootstrapped_std_devs(), but draws in batches and stops as soon
+    as no std dev changed by more than tolerance (relative) over two batches
+    in a row, or after max_iterations. Each batch is as big as everything drawn
+    before it, so the change between batches tracks how noisy the estimate
+    still is rather than just shrinking as batches pile up. A cell with 3
+    trials settles after a couple of batches while a noisier cell gets as
+    many as it needs. Returns (std devs dict, number of iterations drawn).
+
+    :param counts: (successes, failures, ignores) observed in a cell
+    :param max_iterations: most bootstrap iterations to draw
+    :param tolerance: relative change between batches to stop at, e.g. 0.01
+    :param statistics: names of statistics in STATISTICS to compute
+    :param random_state: np.random or a np.random.RandomState to draw from
+    :param batch_size: iterations in the first batch
+    '''
+    sums = dict((name, 0.0) for name in statistics)
+    sums_of_squares = dict((name, 0.0) for name in statistics)
+    undefined = set() #statistics undefined for a draw, std dev None
+    current = dict((name, None) for name in statistics)
+    previous = None
+    checks_passed = 0
+    iterations = 0
+    while iterations < max_iterations:
+        size = min(max(batch_size, iterations), max_iterations - iterations)
+        draws = resample_outcome_counts(counts, size, random_state)
+        iterations += size
+        for name in statistics:
+            if name in undefined:
+                continue
+            values = STATISTICS[name](draws)
+            if values is None:
+                undefined.add(name)
+                continue
+            sums[name] += float(values.sum())
+            sums_of_squares[name] += float(np.dot(values, values))
+
+        current = {}
+        for name in statistics:
+            if name in undefined:
+                current[name] = None
+            else:
+                current[name] = running_std_dev(sums[name],
+                    sums_of_squares[name], iterations)
+        if len(undefined) == len(statistics):
+            break
+        if previous is not None and has_converged(previous, current,
+        tolerance):
+            checks_passed += 1
+            if checks_passed == 2: #once could just be luck
+                break
+        else:
+            checks_passed = 0
+        previous = current
+    return current, iterations
+
+def running_std_dev(total, total_of_squares, n):
+    #sample std dev from running sums, so batches don't have to be kept.
+    #None with fewer than 2 draws, like get_bootstrapped_std_devs()
+    if n < 2:
+        return None
+    variance = (total_of_squares - total * total / n) / (n - 1)
+    return math.sqrt(max(variance, 0.0))
+
+def has_converged(previous, current, tolerance):
+    '''
+    Returns True if every defined std dev in current is within tolerance
+    (relative) of its value in previous.
+    '''
+    for name, value in current.iteritems():
+        if value is None or previous[name] is None:
+            continue
+        if previous[name] == 0.0:
+            if value != 0.0:
+                return False
+        elif abs(value - previous[name]) / previous[name] > tolerance:
+            return False
+    return True
+
+def get_random_state(seed, counts, iterations):
+    '''
+    Returns the RandomState one cell is resampled with. With a master seed the
+    stream is derived from (seed, counts, iterations) alone, so a cell gets the
+    same draws whichever process resamples it and in whatever order; a run
+    with the same seed gives bit-identical std devs for any number of workers.
+    Without a seed every cell gets a fresh stream seeded by the OS, which
+    keeps forked workers from all starting out with the same global state.
+
+    :param seed: master seed (int) or None
+    :param counts: (successes, failures, ignores) observed in the cell
+    :param iterations: number of bootstrap iterations
+    '''
+    if seed is None:
+        return np.random.RandomState()
+    key = "%d:%d:%s" % (seed, iterations,
+        ",".join(str(int(count)) for count in counts))
+    return np.random.RandomState(int(hashlib.md5(key).hexdigest()[:8], 16))
+
+@instrumentation.timed("bootstrap")
+def bootstrap_cell(task):
+    '''
+    Resamples one cell. task is (counts, iterations, statistics, seed,
+    tolerance), packed into one tuple so this can be handed straight to
+    Pool.map(). With tolerance None the cell gets exactly iterations draws,
+    otherwise it's resampled adaptively (see get_adaptive_std_devs()) with
+    iterations as the maximum. Returns (the result of
+    get_bootstrapped_std_devs() for the cell, number of iterations drawn).
+    '''
+    counts, iterations, statistics, seed, tolerance = task
+    random_state = get_random_state(seed, counts, iterations)
+    if tolerance is None:
+        std_devs = get_bootstrapped_std_devs(counts, iterations, statistics,
+            random_state)
+        drawn = iterations
+    else:
+        std_devs, drawn = get_adaptive_std_devs(counts, iterations, tolerance,
+            statistics, random_state)
+    instrumentation.count("bootstrap_iterations", drawn)
+    return std_devs, drawn
+
+def bootstrap_cells(cells, iterations, statistics=STATISTICS.keys(),
+    seed=None, pool=None, tolerance=None):
+    '''
+    Resamples every cell (e.g. every bin x stim size of every animal) as its
+    own task and returns a dict with (successes, failures, ignores) tuples as
+    keys and the result of bootstrap_cell(), (std devs dict, iterations
+    drawn), as values. Cells with
+    the same counts are only resampled once, and seeded cells already in the
+    memo (see bootstrap_memo.py) aren't resampled at all.
+
+    :param cells: list of (successes, failures, ignores) counts
+    :param iterations: number of bootstrap iterations per cell
+    :param statistics: names of statistics in STATISTICS to compute
+    :param seed: master seed (see get_random_state()), None for a random run
+    :param pool: a multiprocessing.Pool to spread the cells over, or None to
+        resample them in this process
+    :param tolerance: None for a fixed number of iterations per cell, or the
+        relative change to stop at in adaptive mode (iterations is then the
+        maximum, see get_adaptive_std_devs())
+    '''
+    unique_cells = sorted(set(tuple(int(count) for count in counts) for
+        counts in cells))
+    result = {}
+    to_resample = []
+    for counts in unique_cells:
+        memoized = bootstrap_memo.lookup(counts, iterations, statistics, seed,
+            tolerance)
+        if memoized is None:
+            to_resample.append(counts)
+        else:
+            result[counts] = memoized
+
+    tasks = [(counts, iterations, list(statistics), seed, tolerance) for
+        counts in to_resample]
+    if pool is None or not tasks:
+        results = map(bootstrap_cell, tasks)
+    else:
+        results = pool.map(bootstrap_cell, tasks)
+    for counts, (std_devs, drawn) in zip(to_resample, results):
+        bootstrap_memo.store(counts, iterations, std_devs, drawn, seed,
+            tolerance)
+        result[counts] = std_devs, drawn
+    return result
+
+def get_analytic_d_prime_std_devs(counts):
+    '''
+    Returns the std dev of d' over bootstrap resamples of each row of an n x 3
+    count array, in closed form. Given s + f non-ignore trials, d' is
+    2 * s/(s + f) - 1 and s is binomial, so its std dev is
+    2 * sqrt(q * (1 - q) / (s + f)) with q = s/(s + f) (to first order, the
+    bootstrap also lets s + f itself vary). NaN where s + f is 0.
+    '''
+    successes = counts[:, 0].astype(np.float64)
+    non_ignores = successes + counts[:, 1]
+    result = np.empty(len(counts))
+    result.fill(np.nan)
+    defined = non_ignores > 0
+    q = successes[defined] / non_ignores[defined]
+    result[defined] = 2.0 * np.sqrt(q * (1.0 - q) / non_ignores[defined])
+    return result
+
+def get_analytic_pct_std_devs(counts, column):
+    '''
+    Returns the std dev of the percentage of trials with the outcome in column
+    over bootstrap resamples of each row of an n x 3 count array, in closed
+    form: 100 * sqrt(p * (1 - p) / n) for a multinomial draw of n trials. NaN
+    where a row has no trials.
+    '''
+    totals = counts.sum(axis=1).astype(np.float64)
+    result = np.empty(len(counts))
+    result.fill(np.nan)
+    defined = totals > 0
+    p = counts[defined, column] / totals[defined]
+    result[defined] = 100.0 * np.sqrt(p * (1.0 - p) / totals[defined])
+    return result
+
+#closed form std devs for the statistics in STATISTICS
+ANALYTIC_STATISTICS = {
+    "d_prime": get_analytic_d_prime_std_devs,
+    "pct_correct": lambda counts: get_analytic_pct_std_devs(counts, 0),
+    "pct_failure": lambda counts: get_analytic_pct_std_devs(counts, 1),
+    "pct_ignore": lambda counts: get_analytic_pct_std_devs(counts, 2)
+}
+
+@instrumentation.timed("bootstrap")
+def analytic_cells(cells, statistics=STATISTICS.keys()):
+    '''
+    Like bootstrap_cells(), but every cell's std devs come from the closed
+    form (see ANALYTIC_STATISTICS), all cells in one vectorized pass. Nothing
+    is resampled, so every cell has 0 iterations drawn.
+    '''
+    unique_cells = sorted(set(tuple(int(count) for count in counts) for
+        counts in cells))
+    result = dict((counts, ({}, 0)) for counts in unique_cells)
+    if not unique_cells:
+        return result
+    counts_array = np.array(unique_cells, dtype=np.int64)
+    for name in statistics:
+        std_devs = ANALYTIC_STATISTICS[name](counts_array).tolist()
+        for counts, value in zip(unique_cells, std_devs):
+            result[counts][0][name] = None if math.isnan(value) else value
+    return result
+
+#ways get_std_devs() can get error bars:
+#   "bootstrap": resample every cell (see bootstrap_cells())
+#   "analytic": closed form, costs next to nothing (see analytic_cells())
+#   "validate": bootstrap, and print how far the closed form is from it
+ERROR_MODELS = ["bootstrap", "analytic", "validate"]
+
+def get_std_devs(cells, error_model, iterations, statistics=STATISTICS.keys(),
+    seed=None, pool=None, tolerance=None):
+    '''
+    Returns a dict with (successes, failures, ignores) tuples as keys and
+    (dict of std devs by statistic name, iterations drawn) as values, for
+    every cell, computed the way error_model (one of ERROR_MODELS) says. The
+    other arguments are passed on to bootstrap_cells().
+    '''
+    if error_model == "analytic":
+        return analytic_cells(cells, statistics)
+    elif error_model in ("bootstrap", "validate"):
+        result = bootstrap_cells(cells, iterations, statistics, seed, pool,
+            tolerance)
+        if error_model == "validate":
+            print_std_dev_comparison(result, analytic_cells(cells, statistics),
+                statistics)
+        return result
+    raise ValueError("unknown error model: %s" % error_model)
+
+def print_std_dev_comparison(bootstrapped, analytic, statistics):
+    '''
+    Prints how far closed form std devs are from bootstrapped ones for each
+    statistic: median and largest relative difference over cells where both
+    are defined, and how many cells only one of them is defined for.
+    '''
+    for name in sorted(statistics):
+        differences = []
+        mismatched = 0
+        for counts, (std_devs, drawn) in bootstrapped.iteritems():
+            value = std_devs[name]
+            expected = analytic[counts][0][name]
+            if value is None or expected is None:
+                if (value is None) != (expected is None):
+                    mismatched += 1
+            elif value > 0:
+                differences.append(abs(expected - value) / value)
+        if differences:
+            print "%s: analytic vs bootstrap over %d cells, median %.2f%%, " \
+                "max %.2f%%, %d cells defined in only one" % (name,
+                len(differences), np.median(differences) * 100.0,
+                max(differences) * 100.0, mismatched)
+        else:
+            print "%s: no cells to compare, %d cells defined in only one" % (
+                name, mismatched)
@@ -0,0 +1,102 @@
+import collections
+import trial_cache
+
+#bump this whenever what's stored for a key changes (e.g. how streams are
+#seeded in bootstrap.get_random_state()) so old entries aren't reused
+MEMO_VERSION = 3
+
+#most (cell, statistic) std devs kept; least recently used ones go first
+MEMO_SIZE = 100000
+
+#file in trial_cache.CACHE_DIR the memo is kept in between runs. Set to None
+#(or turn off the trial cache) to only memoize within a run.
+MEMO_FILE = "bootstrap_memo.pkl"
+
+#(counts, iterations, tolerance, statistic, seed) -> (std dev, number of
+#iterations it was drawn from), least recently used first
+_memo = collections.OrderedDict()
+_loaded = False
+
+def get_key(counts, iterations, statistic, seed, tolerance=None):
+    return (tuple(int(count) for count in counts), iterations, tolerance,
+        statistic, seed)
+
+def lookup(counts, iterations, statistics, seed, tolerance=None):
+    '''
+    Returns (dict with statistic names as keys and memoized bootstrapped std
+    devs as values, iterations drawn), like bootstrap.bootstrap_cell(), or
+    None unless every statistic has been memoized for the cell from the same
+    number of draws. A bootstrapped std dev only depends on the cell's (successes,
+    failures, ignores) counts, the iteration count (and tolerance in adaptive
+    mode) and the seed its stream was derived from, so the same small-count
+    cells showing up across animals, bins and reruns only get resampled once.
+
+    Unseeded runs are supposed to be a fresh resample every time, so nothing
+    is looked up when seed is None.
+    '''
+    if seed is None:
+        return None
+    load()
+    std_devs = {}
+    drawn = set()
+    for statistic in statistics:
+        key = get_key(counts, iterations, statistic, seed, tolerance)
+        if key not in _memo:
+            return None
+        entry = _memo.pop(key)
+        _memo[key] = entry #most recently used now
+        std_devs[statistic], statistic_drawn = entry
+        drawn.add(statistic_drawn)
+    #adaptive runs for other statistics can stop after a different number of
+    #draws, those get resampled together
+    if len(drawn) > 1:
+        return None
+    return std_devs, drawn.pop() if drawn else iterations
+
+def store(counts, iterations, std_devs, drawn, seed, tolerance=None):
+    '''
+    Memoizes the result of bootstrap.bootstrap_cell() for a cell, its std
+    devs and the number of iterations drawn, evicting the least recently used
+    entries past MEMO_SIZE.
+    '''
+    if seed is None:
+        return
+    load()
+    for statistic, std_dev in std_devs.iteritems():
+        key = get_key(counts, iterations, statistic, seed, tolerance)
+        _memo.pop(key, None)
+        _memo[key] = std_dev, drawn
+    while len(_memo) > MEMO_SIZE:
+        _memo.popitem(last=False)
+
+def load(memo_file=None):
+    '''
+    Reads the memo saved by an earlier run (once per process). Missing,
+    unreadable or out of date memo files are ignored.
+    '''
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    if memo_file is None:
+        memo_file = trial_cache.get_cache_path(MEMO_FILE)
+    saved = trial_cache.load_pickle(memo_file)
+    if saved is None or saved.get("version") != MEMO_VERSION:
+        return
+    for key, std_dev in saved["entries"]:
+        _memo.setdefault(key, std_dev)
+    while len(_memo) > MEMO_SIZE:
+        _memo.popitem(last=False)
+
+def save(memo_file=None):
+    '''
+    Writes the memo to disk for the next run, least recently used entries
+    first so they're still the first to go after it's loaded again (see
+    trial_cache.save_pickle()).
+    '''
+    if memo_file is None:
+        memo_file = trial_cache.get_cache_path(MEMO_FILE)
+    if not _memo:
+        return
+    trial_cache.save_pickle(memo_file,
+        {"version": MEMO_VERSION, "entries": _memo.items()})
@@ -0,0 +1,549 @@
+import os
+import sys
+import time
+import math
+import shutil
+import cPickle
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import bootstrap
+import mwk_reader
+import session_events
+import synthetic_cohort
+import benchmark
+import trial_store
+
+#checks that faster implementations still give what the reference ones give,
+#on the same sessions, and how much faster they are. Engines come in two
+#kinds:
+#   side by side: the reference implementation still exists next to the
+#       optimized one (pymworks next to mwk_reader, streamed segmentation next
+#       to columnar, ...) and both are run here
+#   golden: the phase scripts' stats functions, whose reference versions
+#       are the ones at REFERENCE_COMMIT. --freeze checks that commit out in a
+#       git worktree, runs them there on the same sessions and saves their
+#       outputs (and timings) as the golden ones every later run of the
+#       current code is compared against
+#Exact engines have to agree to TOLERANCE; bootstrap engines only have to
+#give std devs within BOOTSTRAP_Z standard errors of the reference
+#bootstrap's, as two independent resamples would.
+#    python equivalence.py --cohort small --freeze (once per input)
+#    (make stats faster)
+#    python equivalence.py --cohort small
+
+#relative and absolute tolerance for numbers that should come out the same
+TOLERANCE = (1e-9, 1e-12)
+
+#most standard errors a bootstrap std dev may be off by
+BOOTSTRAP_Z = 4.0
+
+#least fraction of (cell, statistic) std devs that has to be within
+#BOOTSTRAP_Z of the reference; about 1 in 16000 is further by chance
+BOOTSTRAP_MIN_AGREEMENT = 0.99
+
+#iterations per cell of the reference bootstrap
+BOOTSTRAP_ITERATIONS = 2000
+
+#seed for every bootstrap run here
+SEED = 1
+
+#frozen outputs of the golden engine, one file per input and reference
+#commit
+GOLDEN_DIR = os.path.join(benchmark.BENCHMARK_DIR, "golden")
+
+#commit the golden outputs are computed at: the stats functions as they were
+#before trial tables became structured arrays and the counting in them was
+#vectorized. --reference overrides it.
+REFERENCE_COMMIT = "c9dbe45"
+
+#runs get_stats_outputs() of this file with every other module imported from
+#a checkout of the reference commit (argv: checkout, this file, output file)
+REFERENCE_SCRIPT = """
+import sys, imp, cPickle
+sys.dont_write_bytecode = True
+sys.path.insert(0, sys.argv[1])
+equivalence = imp.load_source("reference_equivalence", sys.argv[2])
+outputs, seconds = equivalence.get_stats_outputs()
+with open(sys.argv[3], "wb") as f:
+    cPickle.dump({"outputs": outputs, "seconds": seconds}, f,
+        cPickle.HIGHEST_PROTOCOL)
+"""
+
+ENGINES = ["reader", "segmentation", "stats", "bootstrap"]
+
+def run_engines(engines=ENGINES, freeze=False, golden_file=None,
+    reference_commit=REFERENCE_COMMIT):
+    '''
+    Runs engines on the sessions in ./input and returns a list of results,
+    one per comparison: {"engine": name, "cases": number of inputs compared,
+    "mismatches": list of differences, "reference_seconds": s,
+    "optimized_seconds": s, "passed": bool}.
+    '''
+    results = []
+    if "reader" in engines:
+        results.append(check_reader())
+    if "segmentation" in engines:
+        results.extend(check_segmentation())
+    if "stats" in engines:
+        results.append(check_stats(golden_file, freeze, reference_commit))
+    if "bootstrap" in engines:
+        results.extend(check_bootstrap())
+    return results
+
+def get_phases():
+    #(phase, module) for every phase with sessions in ./input
+    phases = []
+    for phase in synthetic_cohort.PHASES:
+        if os.path.isdir(os.path.join("input", phase)):
+            module_name = trial_store.PHASE_MODULES[phase][0]
+            phases.append((phase, __import__(module_name)))
+    return phases
+
+def get_session_paths(module, phase):
+    animals_and_sessions = module.get_animals_and_their_session_filenames(
+        os.path.join("input", phase))
+    return [module.get_session_path(animal, session) for animal, sessions in
+        sorted(animals_and_sessions.iteritems()) for session in sessions]
+
+def check_reader():
+    #pymworks (reference) vs mwk_reader for every session of every phase
+    paths = [path for phase, module in get_phases() for path in
+        get_session_paths(module, phase)]
+    names = session_events.ANALYSIS_EVENT_NAMES
+    reference, reference_seconds = timed_map(lambda path:
+        session_events.read_columns_with_pymworks(path, names), paths)
+    optimized, optimized_seconds = timed_map(lambda path:
+        mwk_reader.read_columns(path, names), paths)
+    return get_result("reader (pymworks -> mwk_reader)", paths, reference,
+        optimized, reference_seconds, optimized_seconds)
+
+def check_segmentation():
+    '''
+    Trials built one event at a time from streamed events (the reference)
+    vs columnar segmentation of decoded columns, for every session of every
+    phase. The columnar side starts with an empty cache, so it includes
+    decoding and caching each session's events like a first run does.
+    '''
+    results = []
+    stream_above_bytes = session_events.STREAM_ABOVE_BYTES
+    try:
+        for phase, module in get_phases():
+            paths = get_session_paths(module, phase)
+            session_events.STREAM_ABOVE_BYTES = 0
+            reference, reference_seconds = timed_map(lambda path:
+                module.extract_session_trials(path, module.EVENT_NAMES), paths)
+            session_events.STREAM_ABOVE_BYTES = None
+            if session_events.trial_cache.CACHE_DIR is not None:
+                shutil.rmtree(session_events.trial_cache.CACHE_DIR,
+                    ignore_errors=True)
+            optimized, optimized_seconds = timed_map(lambda path:
+                module.extract_session_trials(path, module.EVENT_NAMES), paths)
+            results.append(get_result("segmentation %s (streamed -> columnar)"
+                % phase, paths, reference, optimized, reference_seconds,
+                optimized_seconds))
+    finally:
+        session_events.STREAM_ABOVE_BYTES = stream_above_bytes
+    return results
+
+def get_stats_outputs():
+    '''
+    Returns ({output name: output}, {output name: seconds}) for every stats
+    function the golden engine covers, on every animal of every phase, e.g.
+    "phase2/AB1/get_stats_for_each_session". Error bars are the analytic ones
+    so outputs don't depend on a resample (see check_bootstrap() for those).
+    '''
+    outputs = {}
+    seconds = {}
+    for phase, module in get_phases():
+        trials_func = getattr(module, trial_store.PHASE_MODULES[phase][1])
+        animals_and_sessions = module.get_animals_and_their_session_filenames(
+            os.path.join("input", phase))
+        for animal, sessions in sorted(animals_and_sessions.iteritems()):
+            trials = [trials_func(animal, session) for session in sessions]
+            for name, func in get_stats_funcs(phase, module, animal, sessions,
+            trials):
+                key = "%s/%s/%s" % (phase, animal, name)
+                start = time.time()
+                outputs[key] = call_quietly(func)
+                seconds[key] = time.time() - start
+    return outputs, seconds
+
+def get_stats_funcs(phase, module, animal, sessions, trials):
+    #(name, function of no arguments) for each output of a phase's stats
+    if phase == "phase1":
+        return [("get_stats_for_each_session", lambda:
+            module.get_stats_for_each_session(animal, sessions, trials))]
+    if phase == "phase2":
+        def get_data_for_figure():
+            stats = module.get_stats_for_each_session(animal, sessions, trials)
+            std_devs_by_counts = module.get_error_bars([stats],
+                error_model="analytic")
+            return module.get_data_for_figure(animal, sessions,
+                list_of_session_stats=stats,
+                std_devs_by_counts=std_devs_by_counts)
+        return [("get_stats_for_each_session", lambda:
+            module.get_stats_for_each_session(animal, sessions, trials)),
+            ("get_data_for_figure", get_data_for_figure)]
+    all_trials = lambda: module.get_trials_from_all_sessions(animal,
+        sessions, trials)
+    if phase == "phase3":
+        return [("get_stats_for_each_rotation", lambda:
+            module.get_stats_for_each_rotation(
+                module.get_size_30_trial_results(all_trials()))),
+            ("get_data_for_figure", lambda: module.get_data_for_figure(
+                animal, sessions, trials, error_model="analytic"))]
+    return [("get_pct_correct_for_animal", lambda:
+        module.get_pct_correct_for_animal(
+            module.make_list_of_behavior_outcomes_for_size_rot_grid(
+                all_trials()))),
+        ("get_data_for_figure", lambda: module.get_data_for_figure(
+            animal, sessions, trials, error_model="analytic"))]
+
+def call_quietly(func):
+    #calls func with what it prints (e.g. "Starting analysis for AB1") dropped
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        return func()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def check_stats(golden_file, freeze=False,
+    reference_commit=REFERENCE_COMMIT):
+    '''
+    Compares the stats functions' outputs with the golden ones in
+    golden_file, which --freeze (freeze True) computes at reference_commit
+    first (see freeze_reference_outputs()). Outputs the reference didn't have
+    yet (e.g. a key added to a dict since) can't be checked, they're counted
+    as unchecked instead of as differences.
+    '''
+    if freeze:
+        freeze_reference_outputs(golden_file, reference_commit)
+    with open(golden_file, "rb") as f:
+        golden = cPickle.load(f)
+    outputs, seconds = get_stats_outputs()
+
+    mismatches = []
+    unchecked = []
+    for key in sorted(set(golden["outputs"]) | set(outputs)):
+        if key not in outputs or key not in golden["outputs"]:
+            mismatches.append("%s: only in %s" % (key, "the golden outputs" if
+                key in golden["outputs"] else "this run"))
+            continue
+        mismatches.extend(diff(golden["outputs"][key], outputs[key], key,
+            unchecked))
+    return {
+        "engine": "stats (%s -> current)" % golden["commit"],
+        "cases": len(outputs),
+        "mismatches": mismatches,
+        "unchecked": unchecked,
+        "reference_seconds": sum(golden["seconds"].values()),
+        "optimized_seconds": sum(seconds.values()),
+        "passed": not mismatches
+    }
+
+def freeze_reference_outputs(golden_file, reference_commit):
+    '''
+    Checks reference_commit out in a git worktree, runs get_stats_outputs()
+    with the phase scripts from there on the sessions in ./input (in a
+    scratch folder of its own, so nothing it caches is reused by the current
+    code) and saves the outputs, timings and commit in golden_file.
+    '''
+    checkout = tempfile.mkdtemp(prefix="reference")
+    scratch = tempfile.mkdtemp(prefix="reference")
+    os.symlink(os.path.realpath("input"), os.path.join(scratch, "input"))
+    output_file = os.path.join(scratch, "outputs.pkl")
+    try:
+        subprocess.check_call(["git", "worktree", "add", "--detach", "--quiet",
+            checkout, reference_commit], cwd=benchmark.REPO_DIR)
+        print "Computing golden outputs at %s" % reference_commit
+        subprocess.check_call([sys.executable, "-c", REFERENCE_SCRIPT,
+            checkout, os.path.join(benchmark.REPO_DIR, "equivalence.py"),
+            output_file], cwd=scratch)
+        with open(output_file, "rb") as f:
+            golden = cPickle.load(f)
+    finally:
+        shutil.rmtree(checkout, ignore_errors=True)
+        shutil.rmtree(scratch, ignore_errors=True)
+        subprocess.call(["git", "worktree", "prune"], cwd=benchmark.REPO_DIR)
+    golden["commit"] = reference_commit
+    golden_dir = os.path.dirname(golden_file)
+    if golden_dir and not os.path.isdir(golden_dir):
+        os.makedirs(golden_dir)
+    with open(golden_file, "wb") as f:
+        cPickle.dump(golden, f, cPickle.HIGHEST_PROTOCOL)
+
+def check_bootstrap():
+    '''
+    Resamples every phase 2 (bin, stim size) cell with the reference
+    bootstrap (fixed iterations, one process) and compares it with the same
+    bootstrap spread over a pool (has to be identical, see
+    bootstrap.get_random_state()), with adaptive resampling and with the
+    closed form (both distributional).
+    '''
+    phases = dict(get_phases())
+    if "phase2" not in phases:
+        return []
+    module = phases["phase2"]
+    animals_and_sessions = module.get_animals_and_their_session_filenames(
+        os.path.join("input", "phase2"))
+    cells = []
+    for animal, sessions in sorted(animals_and_sessions.iteritems()):
+        trials = [module.get_session_trials(animal, session) for session in
+            sessions]
+        cells.extend(module.get_cells_to_resample(call_quietly(lambda:
+            module.get_stats_for_each_session(animal, sessions, trials))))
+    cells = sorted(set(tuple(int(count) for count in counts) for counts in
+        cells))
+    statistics = sorted(bootstrap.STATISTICS)
+
+    #bootstrap_cell() directly, bootstrap_cells() would reuse the memo
+    tasks = [(counts, BOOTSTRAP_ITERATIONS, statistics, SEED, None) for
+        counts in cells]
+    start = time.time()
+    reference = map(bootstrap.bootstrap_cell, tasks)
+    reference_seconds = time.time() - start
+
+    results = []
+    pool = multiprocessing.Pool()
+    try:
+        start = time.time()
+        pooled = pool.map(bootstrap.bootstrap_cell, tasks)
+        results.append(get_result("bootstrap (1 process -> pool)", cells,
+            reference, pooled, reference_seconds, time.time() - start))
+    finally:
+        pool.close()
+        pool.join()
+
+    start = time.time()
+    adaptive = map(bootstrap.bootstrap_cell, [(counts, BOOTSTRAP_ITERATIONS,
+        statistics, SEED, 0.01) for counts in cells])
+    results.append(get_bootstrap_result("bootstrap (fixed -> adaptive)",
+        cells, reference, adaptive, statistics, reference_seconds,
+        time.time() - start))
+
+    start = time.time()
+    analytic = bootstrap.analytic_cells(cells, statistics)
+    results.append(get_bootstrap_result("bootstrap (resampled -> analytic)",
+        cells, reference, [analytic[counts] for counts in cells], statistics,
+        reference_seconds, time.time() - start))
+    return results
+
+def get_bootstrap_result(engine, cells, reference, optimized, statistics,
+    reference_seconds, optimized_seconds):
+    '''
+    Compares std devs that are estimates (see check_bootstrap()): each one
+    has to be within BOOTSTRAP_Z standard errors of the reference's, a std
+    dev of n resamples having a standard error of about std/sqrt(2(n - 1)),
+    for at least BOOTSTRAP_MIN_AGREEMENT of them. The closed form (0
+    iterations) has no error of its own.
+    '''
+    agreeing = 0
+    compared = 0
+    mismatches = []
+    for counts, expected, actual in zip(cells, reference, optimized):
+        for statistic in statistics:
+            z = get_z(expected[0][statistic], expected[1],
+                actual[0][statistic], actual[1])
+            compared += 1
+            if z <= BOOTSTRAP_Z:
+                agreeing += 1
+            else:
+                mismatches.append("%s %s: %r vs %r (z = %.1f)" % (counts,
+                    statistic, expected[0][statistic], actual[0][statistic],
+                    z))
+    agreement = float(agreeing) / compared if compared else 1.0
+    return {
+        "engine": engine,
+        "cases": len(cells),
+        "mismatches": mismatches,
+        "reference_seconds": reference_seconds,
+        "optimized_seconds": optimized_seconds,
+        "passed": agreement >= BOOTSTRAP_MIN_AGREEMENT,
+        "agreement": agreement
+    }
+
+def get_z(expected, expected_iterations, actual, actual_iterations):
+    #how many standard errors two bootstrapped std devs are apart
+    if expected is None or actual is None or is_nan(expected) or \
+    is_nan(actual):
+        return 0.0 if (expected is None or is_nan(expected)) == \
+            (actual is None or is_nan(actual)) else float("inf")
+    variance = 0.0
+    for std_dev, iterations in [(expected, expected_iterations),
+    (actual, actual_iterations)]:
+        if iterations > 1:
+            variance += std_dev ** 2 / (2.0 * (iterations - 1))
+    if variance == 0.0:
+        return 0.0 if close(expected, actual) else float("inf")
+    return abs(expected - actual) / math.sqrt(variance)
+
+def is_nan(value):
+    return isinstance(value, float) and math.isnan(value)
+
+def close(expected, actual):
+    rtol, atol = TOLERANCE
+    return abs(expected - actual) <= atol + rtol * abs(expected)
+
+def diff(expected, actual, path, unchecked=None):
+    '''
+    Returns a list of differences between two outputs (nested dicts, lists,
+    tuples, NumPy arrays, numbers, strings), e.g.
+        ["phase2/AB1/get_data_for_figure[x_vals][3]: 4 vs 5"]
+    Numbers only have to agree to TOLERANCE and NaN equals NaN.
+
+    :param unchecked: None, or a list the paths of dict keys that are only in
+        actual get appended to instead of being reported as differences
+    '''
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        result = []
+        for key in sorted(set(expected) | set(actual)):
+            if key not in expected and unchecked is not None:
+                unchecked.append("%s[%r]" % (path, key))
+            elif key not in expected or key not in actual:
+                result.append("%s[%r]: missing in %s" % (path, key,
+                    "this run" if key in expected else "the reference"))
+            else:
+                result.extend(diff(expected[key], actual[key],
+                    "%s[%r]" % (path, key), unchecked))
+        return result
+    if isinstance(expected, np.ndarray) or isinstance(actual, np.ndarray):
+        expected = np.asarray(expected)
+        actual = np.asarray(actual)
+        if expected.shape != actual.shape:
+            return ["%s: shape %s vs %s" % (path, expected.shape,
+                actual.shape)]
+        if expected.dtype.names or actual.dtype.names: #e.g. trial tables
+            if expected.dtype.names != actual.dtype.names:
+                return ["%s: fields %s vs %s" % (path, expected.dtype.names,
+                    actual.dtype.names)]
+            return [difference for name in expected.dtype.names for
+                difference in diff(expected[name], actual[name],
+                "%s[%r]" % (path, name), unchecked)]
+        if expected.dtype.kind in "fiub" and actual.dtype.kind in "fiub":
+            rtol, atol = TOLERANCE
+            equal = np.isclose(expected, actual, rtol, atol, equal_nan=True)
+        else:
+            equal = expected == actual
+        if np.all(equal):
+            return []
+        first = np.flatnonzero(~np.asarray(equal))[0]
+        return ["%s: %d differences, first at %d: %r vs %r" % (path,
+            np.size(equal) - np.count_nonzero(equal), first,
+            expected.flat[first], actual.flat[first])]
+    if isinstance(expected, (list, tuple)) and isinstance(actual, (list,
+    tuple)):
+        if len(expected) != len(actual):
+            return ["%s: length %d vs %d" % (path, len(expected),
+                len(actual))]
+        result = []
+        for i, (expected_item, actual_item) in enumerate(zip(expected,
+        actual)):
+            result.extend(diff(expected_item, actual_item, "%s[%d]" % (path,
+                i), unchecked))
+        return result
+    if is_number(expected) and is_number(actual):
+        if (is_nan(float(expected)) and is_nan(float(actual))) or \
+        close(float(expected), float(actual)):
+            return []
+    elif expected == actual:
+        return []
+    return ["%s: %r vs %r" % (path, expected, actual)]
+
+def is_number(value):
+    return isinstance(value, (int, long, float, np.number)) and \
+        not isinstance(value, bool)
+
+def timed_map(func, items):
+    #[func(item) for item in items] and how long that took
+    start = time.time()
+    result = [func(item) for item in items]
+    return result, time.time() - start
+
+def get_result(engine, cases, reference, optimized, reference_seconds,
+    optimized_seconds):
+    #result of an engine whose outputs have to agree exactly (see diff())
+    mismatches = []
+    for case, expected, actual in zip(cases, reference, optimized):
+        mismatches.extend(diff(expected, actual, str(case)))
+    return {
+        "engine": engine,
+        "cases": len(cases),
+        "mismatches": mismatches,
+        "reference_seconds": reference_seconds,
+        "optimized_seconds": optimized_seconds,
+        "passed": not mismatches
+    }
+
+def print_results(results, max_mismatches=5):
+    print "%-44s %6s %10s %10s %8s  %s" % ("engine", "cases", "reference",
+        "optimized", "speedup", "result")
+    for result in results:
+        speedup = (result["reference_seconds"] / result["optimized_seconds"] if
+            result["optimized_seconds"] > 0 else float("inf"))
+        outcome = "ok" if result["passed"] else "DIFFERENT"
+        if "agreement" in result:
+            outcome += " (%.2f%% within %g standard errors)" % (
+                100.0 * result["agreement"], BOOTSTRAP_Z)
+        elif result["mismatches"]:
+            outcome += " (%d differences)" % len(result["mismatches"])
+        if result.get("unchecked"):
+            outcome += " (%d outputs not in the reference)" % len(
+                result["unchecked"])
+        print "%-44s %6d %9.2fs %9.2fs %7.1fx  %s" % (result["engine"],
+            result["cases"], result["reference_seconds"],
+            result["optimized_seconds"], speedup, outcome)
+        for mismatch in result["mismatches"][:max_mismatches]:
+            print "    " + mismatch
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that optimized "
+        "implementations give the same results as the reference ones")
+    parser.add_argument("--cohort", choices=sorted(benchmark.COHORTS),
+        default="small", help="synthetic cohort to check on (default: "
+        "%(default)s, see benchmark.py)")
+    parser.add_argument("--input", metavar="DIR",
+        help="check on the phaseN folders in DIR instead, e.g. input")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES,
+        default=ENGINES, help="what to check (default: all)")
+    parser.add_argument("--freeze", action="store_true",
+        help="compute the stats functions' outputs at the reference commit "
+        "and save them as the golden ones to check later runs against")
+    parser.add_argument("--reference", metavar="COMMIT",
+        default=REFERENCE_COMMIT, help="commit the golden outputs are "
+        "computed at (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.input is None:
+        animals, sessions, trials = benchmark.COHORTS[args.cohort]
+        input_dir = os.path.join(benchmark.BENCHMARK_DIR, "cohorts",
+            args.cohort, "input")
+        synthetic_cohort.write_cohort(input_dir, animals, sessions, trials)
+        name = args.cohort
+    else:
+        input_dir = args.input
+        name = os.path.basename(os.path.abspath(args.input))
+    golden_file = os.path.join(GOLDEN_DIR, "%s-%s.pkl" % (name,
+        args.reference))
+    if "stats" in args.engines and not args.freeze and \
+    not os.path.exists(golden_file):
+        sys.exit("No golden outputs in %s, run with --freeze to compute them "
+            "at %s" % (golden_file, args.reference))
+
+    #the phase scripts read input/phaseN and cache in .trial_cache, so run in
+    #a scratch folder with input pointing at the sessions and nothing cached
+    work_dir = tempfile.mkdtemp(prefix="equivalence")
+    os.symlink(os.path.abspath(input_dir), os.path.join(work_dir, "input"))
+    os.chdir(work_dir)
+    try:
+        results = run_engines(args.engines, args.freeze, golden_file,
+            args.reference)
+    finally:
+        os.chdir(benchmark.REPO_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print_results(results)
+    sys.exit(0 if all(result["passed"] for result in results) else 1)
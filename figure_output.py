@@ -0,0 +1,100 @@
+import os
+import sys
+import instrumentation
+
+#matplotlib.pyplot takes longer to import (and set up a GUI backend for) than
+#anything else the phase scripts use, so it's only imported by the functions
+#that draw: --help, reading sessions and the pool's workers never pay for it.
+
+#figures go in OUTPUT_DIR/<phase>/<animal>/<figure name>.<format>, figures
+#for all animals in OUTPUT_DIR/<phase>/
+OUTPUT_DIR = "output"
+
+#formats figures can be saved in
+FORMATS = ["png", "pdf", "svg"]
+
+#(directory, formats) figures are saved to instead of shown, in processes
+#drawing figures for start_figure()
+_destination = None
+
+def show(name):
+    '''
+    Shows the current figure (plt.show()), or when figures are being saved
+    (see start_figure()) saves it as <name>.<format> in every format and
+    closes it. The phase scripts call this wherever they used to call
+    plt.show().
+
+    :param name: filename for the figure, without extension
+    '''
+    import matplotlib.pyplot as plt
+    if _destination is None:
+        plt.show()
+        return
+    directory, formats = _destination
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError: #another process made it first
+            pass
+    for output_format in formats:
+        plt.savefig(os.path.join(directory, name + "." + output_format),
+            format=output_format)
+        instrumentation.count("figures_saved")
+    plt.close("all")
+
+def get_figure_dir(phase, animal_name=None, output_dir=OUTPUT_DIR):
+    #where an animal's figures (or the figures for all animals) are saved
+    if animal_name is None:
+        return os.path.join(output_dir, phase)
+    return os.path.join(output_dir, phase, animal_name)
+
+def draw_figure(figure_func, args, directory, formats):
+    '''
+    Calls figure_func(*args) with its figures saved to directory in formats,
+    without a display (Agg backend). Runs in a worker process of
+    start_figure(), so figure_func has to be a module level function.
+    '''
+    global _destination
+    use_agg()
+    _destination = (directory, formats)
+    try:
+        with instrumentation.stage("rendering"):
+            figure_func(*args)
+    finally:
+        _destination = None
+    return directory
+
+def use_agg():
+    #draw without a display from now on
+    if "matplotlib.pyplot" in sys.modules:
+        sys.modules["matplotlib.pyplot"].switch_backend("Agg")
+    else: #pyplot will start out with Agg, no GUI backend gets set up at all
+        import matplotlib
+        matplotlib.use("Agg")
+
+def start_figure(figure_func, args, phase, animal_name=None, formats=None,
+    pool=None):
+    '''
+    Draws one figure_func(*args) as soon as its data is ready. With formats
+    None it's drawn (and shown) right here, as always. Otherwise it's rendered
+    without a display (see draw_figure()) in pool and saved under
+    get_figure_dir(), e.g. output/phase2/AB1/binned_d_prime.png, so an
+    unattended run never waits on a window; the multiprocessing.AsyncResult
+    is returned, pass those to wait_for_figures() before joining the pool.
+
+    :param phase: name of the phase, e.g. "phase2"
+    :param animal_name: whose figure it is, None for figures of all animals
+    :param formats: None to show figures, or a list of FORMATS to save them in
+    '''
+    if formats is None:
+        with instrumentation.stage("rendering"): #including time on screen
+            figure_func(*args)
+        return None
+    return pool.apply_async(draw_figure, args=(figure_func, args,
+        get_figure_dir(phase, animal_name), formats))
+
+def wait_for_figures(results):
+    #waits for the figures start_figure() is saving in worker processes
+    for result in results:
+        if result is not None:
+            print "Saved figures to " + result.get()
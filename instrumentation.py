@@ -0,0 +1,271 @@
+import os
+import csv
+import json
+import time
+import glob
+import shutil
+import tempfile
+import cProfile
+import pstats
+import functools
+import contextlib
+import multiprocessing.util
+
+try:
+    import resource
+except ImportError: #not on Windows, peak RSS is left out there
+    resource = None
+
+#timers and counters for the stages of an analysis (discovery, decode,
+#segmentation, aggregation, bootstrap, rendering), kept in every process
+#that runs one. Each pool worker saves its own when it exits (see
+#start_worker()) and write_report() puts them together with the main
+#process' into one report, e.g. with --report report.json:
+#    {"wall_seconds": 41.2, "max_rss_kb": 183220,
+#     "stages": {"decode": {"calls": 51, "seconds": 12.9}, ...},
+#     "counters": {"files_decoded": 51, ...},
+#     "processes": [{"pid": 4242, "role": "main", "max_rss_kb": 92312,
+#                    "stages": {...}, "counters": {...}}, ...]}
+#Stage seconds are added up over processes, so with a pool they can be more
+#than wall_seconds. Within a process stages are exclusive: a stage run from
+#inside another (e.g. bootstrap from aggregation) pauses the outer one, so no
+#second is counted twice. Timing a stage is a few time.time() calls, so it's
+#always on; stages are never timed per event or per trial.
+
+#stage name -> {"calls": n, "seconds": s} in this process
+_stages = {}
+
+#counter name -> value in this process
+_counters = {}
+
+#stage name -> cProfile.Profile collecting it in this process
+_profiles = {}
+
+#stages running right now in this process, innermost last, as dicts with
+#their "name", "start" time and "profiler" (None without a profile_dir).
+#Only the innermost one is timed and profiled.
+_active = []
+
+#what configure() was asked for, handed to pool workers (see start_worker())
+_settings = {
+    "report_file": None,
+    "profile_dir": None,
+    "worker_dir": None, #where workers save their stats for write_report()
+    "start_time": None
+}
+
+def add_arguments(parser):
+    #the --report and --profile options of every phase script
+    parser.add_argument("--report", metavar="FILE",
+        help="write how long each stage took, counters and peak memory of "
+        "every process to FILE, as CSV if it ends in .csv, JSON otherwise")
+    parser.add_argument("--profile", metavar="DIR",
+        help="also run every stage under cProfile and save its profile as "
+        "DIR/<stage>.prof (see python -m pstats)")
+
+def configure(report_file=None, profile_dir=None):
+    '''
+    Starts collecting a report for write_report() (report_file None for no
+    report) and cProfile dumps of each stage in profile_dir (None for no
+    profiling). Call before the pool is started so its workers get the same
+    settings.
+    '''
+    _settings["report_file"] = report_file
+    _settings["profile_dir"] = profile_dir
+    _settings["start_time"] = time.time()
+    if report_file is not None or profile_dir is not None:
+        _settings["worker_dir"] = tempfile.mkdtemp(prefix="instrumentation")
+    if profile_dir is not None and not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+
+def get_settings():
+    return dict(_settings)
+
+def start_worker(settings):
+    '''
+    Runs in every new pool worker (see session_pool.warm_up()): starts it off
+    with no stats of its own (a forked worker has a copy of its parent's) and
+    saves them when the worker exits.
+    '''
+    _settings.update(settings)
+    _stages.clear()
+    _counters.clear()
+    _profiles.clear()
+    del _active[:]
+    if _settings["worker_dir"] is not None:
+        multiprocessing.util.Finalize(None, save_worker_stats,
+            exitpriority=10)
+
+@contextlib.contextmanager
+def stage(name):
+    '''
+    Times everything in the with block as one call of stage name, and
+    profiles it if a profile_dir was configured, e.g.
+        with instrumentation.stage("decode"):
+            columns = read_columns(path, event_names)
+    The stage this one runs inside of, if any, is paused until it's done
+    (timer and profiler), so nested stages don't count the same time twice.
+    '''
+    if _active:
+        stop_timing(_active[-1])
+    entry = {"name": name, "start": None, "profiler": None}
+    if _settings["profile_dir"] is not None:
+        entry["profiler"] = _profiles.setdefault(name, cProfile.Profile())
+    _active.append(entry)
+    start_timing(entry)
+    try:
+        yield
+    finally:
+        stop_timing(_active.pop())
+        _stages[name]["calls"] += 1
+        if _active:
+            start_timing(_active[-1])
+
+def start_timing(entry):
+    #starts (or resumes) timing and profiling an entry of _active
+    entry["start"] = time.time()
+    if entry["profiler"] is not None:
+        entry["profiler"].enable()
+
+def stop_timing(entry):
+    #adds the time since start_timing() to the entry's stage
+    if entry["profiler"] is not None:
+        entry["profiler"].disable()
+    totals = _stages.setdefault(entry["name"], {"calls": 0, "seconds": 0.0})
+    totals["seconds"] += time.time() - entry["start"]
+
+def timed(name):
+    '''
+    Decorator running a whole function as stage name (see stage()). The
+    function keeps its name, so it can still be handed to a pool.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    #adds n to counter name
+    _counters[name] = _counters.get(name, 0) + n
+
+def get_max_rss():
+    #peak resident set size of this process (kilobytes on Linux), or None
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def get_process_stats(role):
+    return {
+        "pid": os.getpid(),
+        "role": role,
+        "max_rss_kb": get_max_rss(),
+        "stages": dict((name, dict(totals)) for name, totals in
+            _stages.iteritems()),
+        "counters": dict(_counters)
+    }
+
+def dump_profiles():
+    #saves this process' profiles as profile_dir/<stage>.<pid>.prof
+    for name, profiler in _profiles.iteritems():
+        profiler.dump_stats(os.path.join(_settings["profile_dir"],
+            "%s.%d.prof" % (name, os.getpid())))
+
+def save_worker_stats():
+    #runs as a pool worker exits, see start_worker()
+    filename = os.path.join(_settings["worker_dir"],
+        "%d.json" % os.getpid())
+    with open(filename, "w") as f:
+        json.dump(get_process_stats("worker"), f)
+    if _settings["profile_dir"] is not None:
+        dump_profiles()
+
+def write_report():
+    '''
+    Writes the report configure() was asked for, with the main process' stats
+    and those of every pool worker that has exited (call it after the pool is
+    joined), and merges each stage's profiles into profile_dir/<stage>.prof.
+    Does nothing if configure() wasn't called with either.
+    '''
+    if _settings["worker_dir"] is None:
+        return
+    processes = [get_process_stats("main")]
+    for filename in sorted(glob.glob(os.path.join(_settings["worker_dir"],
+    "*.json"))):
+        with open(filename) as f:
+            processes.append(json.load(f))
+    shutil.rmtree(_settings["worker_dir"], ignore_errors=True)
+    _settings["worker_dir"] = None
+
+    if _settings["profile_dir"] is not None:
+        merge_profiles(_settings["profile_dir"])
+    if _settings["report_file"] is None:
+        return
+    report = get_report(processes, time.time() - _settings["start_time"])
+    if _settings["report_file"].endswith(".csv"):
+        write_csv(report, _settings["report_file"])
+    else:
+        with open(_settings["report_file"], "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    print "Wrote timing report to " + _settings["report_file"]
+
+def merge_profiles(profile_dir):
+    #every process' profile of a stage -> one profile_dir/<stage>.prof
+    dump_profiles()
+    by_stage = {}
+    for filename in glob.glob(os.path.join(profile_dir, "*.*.prof")):
+        name = os.path.basename(filename).rsplit(".", 2)[0]
+        by_stage.setdefault(name, []).append(filename)
+    for name, filenames in by_stage.iteritems():
+        stats = pstats.Stats(*filenames)
+        stats.dump_stats(os.path.join(profile_dir, name + ".prof"))
+        for filename in filenames:
+            os.remove(filename)
+
+def get_report(processes, wall_seconds):
+    '''
+    Returns the report for a list of get_process_stats() results: their
+    stages and counters added up, and the biggest peak RSS of any of them.
+    '''
+    stages = {}
+    counters = {}
+    for process in processes:
+        for name, totals in process["stages"].iteritems():
+            total = stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+            total["calls"] += totals["calls"]
+            total["seconds"] += totals["seconds"]
+        for name, value in process["counters"].iteritems():
+            counters[name] = counters.get(name, 0) + value
+    max_rss = [process["max_rss_kb"] for process in processes if
+        process["max_rss_kb"] is not None]
+    return {
+        "wall_seconds": wall_seconds,
+        "max_rss_kb": max(max_rss) if max_rss else None,
+        "stages": stages,
+        "counters": counters,
+        "processes": processes
+    }
+
+def write_csv(report, filename):
+    '''
+    Writes a report as one row per stage or counter of each process, plus
+    rows with pid "all" for the totals:
+        pid,role,max_rss_kb,kind,name,calls,seconds
+        all,all,183220,stage,decode,51,12.9
+        4242,main,92312,counter,files_decoded,51,
+    '''
+    with open(filename, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(["pid", "role", "max_rss_kb", "kind", "name", "calls",
+            "seconds"])
+        for process in [dict(report, pid="all", role="all")] + \
+        report["processes"]:
+            for name, totals in sorted(process["stages"].iteritems()):
+                writer.writerow([process["pid"], process["role"],
+                    process["max_rss_kb"], "stage", name, totals["calls"],
+                    "%.6f" % totals["seconds"]])
+            for name, value in sorted(process["counters"].iteritems()):
+                writer.writerow([process["pid"], process["role"],
+                    process["max_rss_kb"], "counter", name, value, ""])
@@ -0,0 +1,276 @@
+import sys
+import array
+import struct
+import numpy as np
+import trial_segmentation
+
+#a columnar reader for MWorks .mwk (LDO binary) session files. pymworks
+#decodes every event in a file into a Python object (reading it a byte at a
+#time) before anything gets filtered; this reads the file into memory once,
+#walks it for each event's code and only decodes the time and value of the
+#events that were asked for, straight into NumPy columns.
+#pymworks (pymworks/io/raw/LDOBinary.py) stays the reference: run this
+#module on some .mwk files to check both agree on them.
+
+MAGIC = "\x89CBF"
+
+INTEGER_N = 0x02
+INTEGER_P = 0x03
+FLOAT_NN = 0x04
+FLOAT_NP = 0x05
+FLOAT_PN = 0x06
+FLOAT_PP = 0x07
+FLOAT_INF = 0x08
+FLOAT_NAN = 0x09
+OPAQUE = 0x0A
+NULL = 0x0B
+LIST = 0x0C
+DICTIONARY = 0x0D
+DEFINE_REFERENCE = 0x0E
+REFERENCE = 0x0F
+ATTRIBUTES = 0x10
+FLOAT_OPAQUE = 0x11
+
+#codes MWorks keeps for itself (#codec, #systemEvent, #components and
+##termination); pymworks names them that whatever a codec says
+RESERVED_CODES = set([0, 1, 2, 3])
+
+class UnsupportedFileError(ValueError):
+    '''
+    Raised for anything in a file this reader doesn't handle (a bad header,
+    a type tag it doesn't know, references...); pymworks can still be asked
+    to read those.
+    '''
+    pass
+
+def read_columns(path, event_names):
+    '''
+    Returns the events called event_names in a session as columns, exactly
+    like trial_segmentation.events_to_columns(df.get_events(event_names))
+    with pymworks: events in file order, names looked up in the session's
+    last codec and names that aren't in it getting no events.
+
+    :param path: path to the .mwk session file (string)
+    :param event_names: list of event names to read
+    '''
+    with open(path, "rb") as f:
+        data = f.read()
+    buf = bytearray(data)
+    codes, positions, codec = scan_events(buf, data)
+
+    name_index = dict((name, i) for i, name in enumerate(event_names))
+    lookup = {} #MWorks event code -> index in event_names
+    for code, variable in codec.iteritems():
+        if code in RESERVED_CODES or not isinstance(variable, dict):
+            continue
+        if variable.get("tagname") in name_index:
+            lookup[code] = name_index[variable["tagname"]]
+
+    codes = np.array(codes, dtype=np.int64)
+    positions = np.array(positions, dtype=np.int64)
+    wanted = np.in1d(codes, np.array(sorted(lookup), dtype=np.int64))
+    codes = codes[wanted]
+    positions = positions[wanted]
+
+    num_events = len(codes)
+    result_codes = np.empty(num_events, dtype=np.int16)
+    times = np.empty(num_events, dtype=np.int64)
+    values = np.empty(num_events, dtype=np.float64)
+    for i in xrange(num_events):
+        result_codes[i] = lookup[int(codes[i])]
+        time, pos = decode_item(buf, data, int(positions[i]))
+        times[i] = time
+        values[i] = decode_float(buf, data, pos)
+    return {"codes": result_codes, "times": times, "values": values}
+
+def scan_events(buf, data):
+    '''
+    Walks every event in a file without decoding any times or values but the
+    codec's. Returns (codes, positions, codec): array('l')s with each event's
+    code and where its time starts in the file, and the last codec logged
+    ({code: {"tagname": name, ...}}, empty if there's none).
+
+    Reading stops at the first record that isn't a [code, time, value] list
+    or that's cut off by the end of the file, where pymworks stops too.
+    '''
+    pos = read_header(buf, data)
+    end = len(buf)
+    codes = array.array("l")
+    positions = array.array("l")
+    codec = {}
+    try:
+        while pos < end:
+            if buf[pos] != LIST:
+                break
+            length, pos = decode_ber(buf, pos + 1)
+            if length != 3:
+                break
+            tag = buf[pos]
+            if tag == INTEGER_P: #almost every code, small enough to inline
+                code, pos = decode_ber(buf, pos + 1)
+            else:
+                code, pos = decode_item(buf, data, pos)
+            time_pos = pos
+            pos = skip_item(buf, pos)
+            if code == 0: #codec, maps event codes to variable names
+                value, pos = decode_item(buf, data, pos)
+                codec = value if isinstance(value, dict) else {}
+            else:
+                pos = skip_item(buf, pos)
+            if pos > end:
+                break
+            codes.append(code)
+            positions.append(time_pos)
+    except IndexError: #file ends partway through an event, e.g. still open
+        pass
+    return codes, positions, codec
+
+def read_header(buf, data):
+    #returns where the first event starts
+    if data[:4] != MAGIC:
+        raise UnsupportedFileError("not an LDO binary file")
+    pos = 5 #magic and version byte
+    major, pos = decode_ber(buf, pos)
+    minor, pos = decode_ber(buf, pos)
+    return pos
+
+def decode_ber(buf, pos):
+    #BER compressed integer: 7 bits per byte, high bit set on all but the last
+    value = 0
+    byte = buf[pos]
+    while byte & 0x80:
+        value = (value << 7) | (byte & 0x7F)
+        pos += 1
+        byte = buf[pos]
+    return (value << 7) | byte, pos + 1
+
+def skip_item(buf, pos):
+    '''
+    Returns where the item starting at pos ends, without building it.
+    '''
+    tag = buf[pos]
+    pos += 1
+    if tag == INTEGER_P or tag == INTEGER_N:
+        while buf[pos] & 0x80:
+            pos += 1
+        return pos + 1
+    if tag == FLOAT_OPAQUE or tag == OPAQUE:
+        length, pos = decode_ber(buf, pos)
+        return pos + length
+    if FLOAT_NN <= tag <= FLOAT_PP:
+        pos = skip_ber(buf, pos)
+        return skip_ber(buf, pos)
+    if tag == FLOAT_INF or tag == FLOAT_NAN or tag == NULL:
+        return pos
+    if tag == LIST:
+        length, pos = decode_ber(buf, pos)
+        for i in xrange(length):
+            pos = skip_item(buf, pos)
+        return pos
+    if tag == DICTIONARY:
+        length, pos = decode_ber(buf, pos)
+        for i in xrange(2 * length):
+            pos = skip_item(buf, pos)
+        return pos
+    if tag == ATTRIBUTES:
+        return skip_item(buf, skip_item(buf, pos))
+    raise UnsupportedFileError("unsupported type tag %#x" % tag)
+
+def skip_ber(buf, pos):
+    while buf[pos] & 0x80:
+        pos += 1
+    return pos + 1
+
+def decode_item(buf, data, pos):
+    '''
+    Returns (value, end position) for the item starting at pos, decoded the
+    way pymworks decodes it.
+    '''
+    tag = buf[pos]
+    pos += 1
+    if tag == INTEGER_P:
+        return decode_ber(buf, pos)
+    if tag == INTEGER_N:
+        value, pos = decode_ber(buf, pos)
+        return -value, pos
+    if tag == FLOAT_OPAQUE:
+        length, pos = decode_ber(buf, pos)
+        if length == 4:
+            return struct.unpack_from("f", data, pos)[0], pos + 4
+        if length == 8:
+            return struct.unpack_from("d", data, pos)[0], pos + 8
+        raise UnsupportedFileError("%d byte float" % length)
+    if FLOAT_NN <= tag <= FLOAT_PP:
+        mantissa, pos = decode_ber(buf, pos)
+        exponent, pos = decode_ber(buf, pos)
+        if tag in (FLOAT_NN, FLOAT_NP):
+            mantissa = -mantissa
+        if tag in (FLOAT_NN, FLOAT_PN):
+            exponent = -exponent
+        return float("%dE%d" % (mantissa, exponent)), pos
+    if tag == FLOAT_INF:
+        return float("inf"), pos
+    if tag == FLOAT_NAN:
+        return float("nan"), pos
+    if tag == OPAQUE:
+        length, pos = decode_ber(buf, pos)
+        return data[pos:pos + length].strip("\x00"), pos + length
+    if tag == NULL:
+        return None, pos
+    if tag == LIST:
+        length, pos = decode_ber(buf, pos)
+        items = []
+        for i in xrange(length):
+            item, pos = decode_item(buf, data, pos)
+            items.append(item)
+        return items, pos
+    if tag == DICTIONARY:
+        length, pos = decode_ber(buf, pos)
+        items = {}
+        for i in xrange(length):
+            key, pos = decode_item(buf, data, pos)
+            value, pos = decode_item(buf, data, pos)
+            items[key] = value
+        return items, pos
+    if tag == ATTRIBUTES:
+        return decode_item(buf, data, skip_item(buf, pos))
+    raise UnsupportedFileError("unsupported type tag %#x" % tag)
+
+def decode_float(buf, data, pos):
+    '''
+    Returns the item starting at pos as trial_segmentation.to_float() would
+    (NaN if it isn't a number). Numbers are decoded directly, anything else
+    goes through decode_item().
+    '''
+    tag = buf[pos]
+    if tag == FLOAT_OPAQUE and buf[pos + 1] == 8:
+        return struct.unpack_from("d", data, pos + 2)[0]
+    if tag == INTEGER_P:
+        return float(decode_ber(buf, pos + 1)[0])
+    value, pos = decode_item(buf, data, pos)
+    return trial_segmentation.to_float(value)
+
+def compare_with_pymworks(path, event_names):
+    '''
+    Returns whether this reader and pymworks decode the same columns from a
+    session (NaN values counting as equal).
+    '''
+    import session_events
+    expected = session_events.read_columns_with_pymworks(path, event_names)
+    actual = read_columns(path, event_names)
+    if len(expected["codes"]) != len(actual["codes"]):
+        return False
+    values_equal = ((expected["values"] == actual["values"]) |
+        (np.isnan(expected["values"]) & np.isnan(actual["values"])))
+    return (np.array_equal(expected["codes"], actual["codes"]) and
+        np.array_equal(expected["times"], actual["times"]) and
+        bool(values_equal.all()))
+
+if __name__ == "__main__":
+    import session_events
+    all_agree = True
+    for path in sys.argv[1:]:
+        agree = compare_with_pymworks(path, session_events.ANALYSIS_EVENT_NAMES)
+        all_agree = all_agree and agree
+        print path, "ok" if agree else "DIFFERENT"
+    sys.exit(0 if all_agree else 1)
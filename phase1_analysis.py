@@ -1,59 +1,67 @@
-import os
-import multiprocessing
+import argparse
 import datetime
-import pymworks
-import matplotlib.pyplot as plt
+import trial_cache
+import trial_segmentation
+import session_events
+import session_pool
+import session_discovery
+import figure_output
+import instrumentation
+
+#events needed to build phase 1 trials
+EVENT_NAMES = ["Announce_TrialStart", "Announce_TrialEnd", "success",
+    "failure", "ignore", "stm_pos_x"]
+
+#event names read into each trial and the trial table column each goes in
+TRIAL_VARIABLES = {"stm_pos_x": "stm_pos_x"}
 
 def get_animals_and_their_session_filenames(path):
     '''
     Returns a dict with animal names as keys (it gets their names from the
         folder names in 'input' folder--each animal should have its own
         folder with .mwk session files) and a list of .mwk filename strings as
-        values.
+        values, oldest session first (see session_discovery.py).
             e.g. {'V1': ['V1_140501.mwk', 'V1_140502.mwk']}
 
     :param path: a string of the directory name containing animals' folders
     '''
-    #TODO maybe make this better, it's slow as hell and ugly
-    result = {}
-    dirs_list = [each for each in os.walk(path)]
-    for each in dirs_list[1:]:
-        files_list = each[2]
-        animal_name = each[0].split("/")[len(each[0].split("/")) - 1]
-        result[animal_name] = [] #list of filenames
-        for filename in files_list:
-            if not filename.startswith('.'): #dont want hidden files
-                result[animal_name].append(filename)
+    result = session_discovery.get_animals_and_their_session_filenames(path)
     print("Starting analysis for animals:")
     for each in result.keys():
         print(each)
     return result
 
-def analyze_sessions(animals_and_sessions, graph_as_group=False):
+def analyze_sessions(animals_and_sessions, graph_as_group=False,
+    figure_formats=None):
     '''
-    Starts analysis for each animals' sessions in a new process to use cores.
+    Reads each session, then analyzes each animals' sessions as soon as
+        they're read, in a new process to use all CPU cores.
         We don't want to wait all day for this, y'all.
 
     :param animals_and_sessions: a dict with animal names as keys and
         a list of their session filenames as values.
+    :param figure_formats: None to show figures, or a list of formats (see
+        figure_output.FORMATS) to save them in under output/phase1 instead
     '''
     #use all CPU cores to process data
-    pool = multiprocessing.Pool(None)
+    pool = session_pool.start_pool()
 
-    results = [] #list of multiprocessing.AsyncResult objects
-    for animal, sessions in animals_and_sessions.iteritems():
-        result = pool.apply_async(analyze_animal_sessions,
-            args=(animal, sessions))
-        results.append(result)
-    pool.close()
-    pool.join() #block until all the data has been processed
     if graph_as_group:
         raise NotImplementedError, "Group graphing coming soon..."
-    #
+    #read every session as its own task so an animal with lots of sessions
+    #doesn't keep one core busy while the rest sit idle, analyze each animal
+    #as soon as its sessions are read and graph it as soon as that's done
+    #instead of waiting for the slowest one (see session_pool.map_animals())
     print("Graphing session data...")
-    for each in results:
-        data_for_animal = each.get() #returns analyze_animal_sessions result
-        make_a_figure(data_for_animal)
+    figures = [] #multiprocessing.AsyncResult objects for saved figures
+    for animal, data_for_animal in session_pool.map_animals(pool,
+    animals_and_sessions, get_session_statistics, analyze_animal_sessions,
+    get_session_path):
+        figures.append(figure_output.start_figure(make_a_figure,
+            (data_for_animal,), "phase1", animal, figure_formats, pool))
+    pool.close()
+    figure_output.wait_for_figures(figures)
+    pool.join()
 
     print("Finished")
 
@@ -64,6 +72,7 @@ def make_a_figure(data):
     :param data: a dict with x and y value lists returned by
         analyze_animal_sessions()
     '''
+    import matplotlib.pyplot as plt #only when drawing, see figure_output.py
 
     f, ax_arr = plt.subplots(2, 2) #make 4 subplots for figure
     f.suptitle(data["animal_name"]) #set figure title to animal's name
@@ -96,7 +105,7 @@ def make_a_figure(data):
         #stim in center
     ax_arr[1, 1].set_xlabel("Session number")
 
-    plt.show() #show each figure, user can save if he/she wants
+    figure_output.show("performance") #show (or save) each figure
 
     #make plot of the % of trials in center
     plt.close("all")
@@ -104,9 +113,10 @@ def make_a_figure(data):
     plt.axis([0, len(data["x_vals"]), 0.0, 100.0])
     plt.title("% trials with stim in center " + data["animal_name"])
     plt.xlabel("Session number")
-    plt.show()
+    figure_output.show("pct_trials_stim_in_center")
 
-def analyze_animal_sessions(animal_name, sessions):
+@instrumentation.timed("aggregation")
+def analyze_animal_sessions(animal_name, sessions, session_trials=None):
     '''
     Analyzes one animals' sessions and outputs dict with x and y value lists
     for different types of graphs, e.g. percent correct, total trials, etc.
@@ -116,9 +126,12 @@ def analyze_animal_sessions(animal_name, sessions):
 
     :param animal_name: name of the animal (string)
     :param sessions: the animal's session filenames (list of strings)
+    :param session_trials: optional list with the result of
+        get_session_statistics() for each session, if it was already read
     '''
 
-    list_of_session_stats = get_stats_for_each_session(animal_name, sessions)
+    list_of_session_stats = get_stats_for_each_session(animal_name, sessions,
+        session_trials)
 
     x_vals = [each["session_number"] for each in list_of_session_stats]
     pct_corr_whole_session_y = [each["pct_correct_whole_session"] for each in \
@@ -140,7 +153,7 @@ def analyze_animal_sessions(animal_name, sessions):
             "pct_trials_stim_in_center": pct_trials_stim_in_center,
             "animal_name": animal_name}
 
-def get_stats_for_each_session(animal_name, sessions):
+def get_stats_for_each_session(animal_name, sessions, session_trials=None):
     '''
     Returns a list of dicts with statistics about each session for an
     animal. e.g.
@@ -172,42 +185,37 @@ def get_stats_for_each_session(animal_name, sessions):
         (e.g. pct_correct_stim_in_center), the key's value is set to None.
         Behavior outcomes (e.g. ignores, successes, etc.) with no occurances
         are left with value = 0.
+
+    session_trials is an optional list with the result of
+    get_session_statistics() for each session, so sessions that were already
+    read (e.g. by analyze_sessions()) don't have to be read again. Each one
+    can also be an iterator over the session's trials (see
+    iter_session_trials()), which is packed into a trial table as it's
+    consumed.
     '''
+    if session_trials is None:
+        session_trials = [get_session_statistics(animal_name, session) for
+            session in sessions]
 
     result = []
     session_num = 1
-    for session in sessions:
-        all_trials = get_session_statistics(animal_name, session)
+    for session, all_trials in zip(sessions, session_trials):
 
         #make dict to store session data
         session_result = {"session_number": session_num,
-                          "total_trials": len(all_trials),
                           "filename": session}
-        #go through each trial to get stats
-        all_success = 0
-        all_failure = 0
-        all_ignore = 0
-        success_in_center = 0
-        failure_in_center = 0
-        ignore_in_center = 0
-        for trial in all_trials:
-            if trial["behavior_outcome"] == "success":
-                if trial["stm_pos_x"] == 0.0:
-                    success_in_center += 1
-                all_success += 1
-            elif trial["behavior_outcome"] == "failure":
-                if trial["stm_pos_x"] == 0.0:
-                    failure_in_center += 1
-                all_failure += 1
-            elif trial["behavior_outcome"] == "ignore":
-                if trial["stm_pos_x"] == 0.0:
-                    ignore_in_center += 1
-                all_ignore += 1
-            else:
-                print "No behavior_outcome for %s %s\
-                , trial number %s" % (animal_name, session, trial["trial_num"])
+        #count each outcome over all trials and with the stim in the center
+        trials = trial_segmentation.as_table(all_trials,
+            TRIAL_VARIABLES.values())
+        total_trials = len(trials)
+        all_success, all_failure, all_ignore = \
+            trial_segmentation.count_outcomes(trials["outcome"])
+        success_in_center, failure_in_center, ignore_in_center = \
+            trial_segmentation.count_outcomes(
+                trials["outcome"][trials["stm_pos_x"] == 0.0])
 
         #add session data to session result dict
+        session_result["total_trials"] = total_trials
         session_result["successes"] = all_success
         session_result["failures"] = all_failure
         session_result["ignores"] = all_ignore
@@ -228,7 +236,7 @@ def get_stats_for_each_session(animal_name, sessions):
         try:
             session_result["pct_trials_stim_in_center"] = \
                 (float(session_result["trials_with_stim_in_center"])/\
-                (float(len(all_trials)))) * 100.0
+                (float(session_result["total_trials"]))) * 100.0
         except ZeroDivisionError:
             session_result["pct_trials_stim_in_center"] = None
 
@@ -240,65 +248,64 @@ def get_stats_for_each_session(animal_name, sessions):
 
 def get_session_statistics(animal_name, session_filename):
     '''
-    Returns a time-ordered list of dicts, where each dict is info about a trial.
-    e.g. [{"trial_num": 1,
-           "behavior_outcome": "failure",
-           "stm_pos_x": 7.5,
-           },
-          {"trial_num": 2,
-           "behavior_outcome": "success",
-           "stm_pos_x": -7.5
-           }]
+    Returns a time-ordered trial table, a NumPy structured array with one
+    record per trial (see trial_segmentation.make_trial_table()).
+    e.g. trials["trial_num"]: [1, 2]
+         trials["outcome"]: [FAILURE, SUCCESS]
+         trials["stm_pos_x"]: [7.5, -7.5]
+         trials["start_time"]: [...]
     NOTE: trial_num: 1 corresponds to the FIRST trial in the session,
     and trials occur when Announce_TrialStart and Announce_TrialEnd
     events have success, failure, or ignore events between them with
-    value=1.
+    value=1. stm_pos_x is NaN for trials where it wasn't set.
+
+    Trials come from the on-disk cache (see trial_cache.py) unless the session
+    file changed since it was last extracted.
 
     :param animal_name: name of the animal string
     :param session_filename: filename for the session (string)
     '''
 
+    path = get_session_path(animal_name, session_filename)
+    return trial_cache.get_cached_trials(path, EVENT_NAMES, "phase1",
+        extract_session_trials)
+
+def get_session_path(animal_name, session_filename):
     #TODO: unfuck this: hard coded paths not ideal for code reuse
-    path = 'input/' + 'phase1/' + animal_name + '/' + session_filename
+    return 'input/' + 'phase1/' + animal_name + '/' + session_filename
+
+def iter_session_trials(animal_name, session_filename):
+    '''
+    Returns an iterator over a session's trials as dicts (like
+    trial_segmentation.iter_trials() yields), read straight from the .mwk file
+    without holding its events in memory or touching the cache.
+    get_stats_for_each_session() takes these in place of trial tables, e.g.
+        get_stats_for_each_session(animal_name, sessions,
+            [iter_session_trials(animal_name, s) for s in sessions])
+    '''
+    return stream_session_trials(get_session_path(animal_name,
+        session_filename), EVENT_NAMES)
 
-    df = pymworks.open_file(path)
-    events = df.get_events(["Announce_TrialStart", "Announce_TrialEnd",
-                            "success", "failure", "ignore", "stm_pos_x"])
+def stream_session_trials(path, event_names):
+    #same trials as extract_session_trials(), one at a time
+    events = session_events.iter_session_events(path, event_names)
+    return trial_segmentation.iter_trials_by_window(events, event_names,
+        TRIAL_VARIABLES)
 
-    result = []
-    index = 0
-    temp_events = []
-    last_announce = None
-    trial_num = 0
-    while index < len(events):
-        if events[index].name == "Announce_TrialStart":
-            temp_events = []
-            last_announce = "Announce_TrialStart"
-
-        elif events[index].name == "Announce_TrialEnd":
-            if last_announce == "Announce_TrialStart":
-                trial_result = {}
-                for ev in temp_events:
-                    if ev.name == "success" and ev.value == 1:
-                        trial_result["behavior_outcome"] = "success"
-                    elif ev.name == "failure" and ev.value == 1:
-                        trial_result["behavior_outcome"] = "failure"
-                    elif ev.name == "ignore" and ev.value == 1:
-                        trial_result["behavior_outcome"] = "ignore"
-                    elif ev.name == "stm_pos_x":
-                        trial_result["stm_pos_x"] = ev.value
-                    else:
-                        pass
-                if "behavior_outcome" in trial_result:
-                    trial_num += 1
-                    trial_result["trial_num"] = trial_num
-                    result.append(trial_result)
-
-            last_announce = "Announce_TrialEnd"
-
-        else:
-            temp_events.append(events[index])
-        index += 1
+def extract_session_trials(path, event_names):
+    '''
+    Reads a session's events (see session_events.py) and returns its trials
+    (see get_session_statistics() for the format). get_session_statistics()
+    only calls this when there are no cached trials for the session.
+
+    :param path: path to the .mwk session file (string)
+    :param event_names: list of event names to read from the session
+    '''
+    if session_events.should_stream(path):
+        #too big to hold all of its events at once
+        return trial_segmentation.trials_to_table(
+            stream_session_trials(path, event_names), TRIAL_VARIABLES.values())
+    columns = session_events.get_session_columns(path, event_names)
     #FYI, testing showed some good filtering of weird events here...
     #blah = df.get_events(["success", "failure", "ignore"])
     #print "EVENTS EQUAL? ", len(result) == len(blah) - 6, session_filename
@@ -308,8 +315,20 @@ def get_session_statistics(animal_name, session_filename):
     #lines above unequal in 6/77 sessions for AB3&7 because of random behavior
     #outcome events firing in rapid succession. They happens within a couple
     #microseconds of one another so filtering these out is probably good
-    return result
+    return trial_segmentation.segment_trials_by_window(columns, event_names,
+        TRIAL_VARIABLES)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Analyze phase 1 sessions in input/phase1")
+    parser.add_argument("--save-figures", nargs="+", metavar="FORMAT",
+        choices=figure_output.FORMATS,
+        help="save figures in these formats (%s) under output/phase1 "
+        "instead of showing them" % ", ".join(figure_output.FORMATS))
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args.report, args.profile)
+
     animals_and_sessions = get_animals_and_their_session_filenames('input/phase1')
-    analyze_sessions(animals_and_sessions)
+    analyze_sessions(animals_and_sessions, figure_formats=args.save_figures)
+    instrumentation.write_report()
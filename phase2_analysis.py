@@ -1,61 +1,275 @@
-import os
-import multiprocessing
+import argparse
 import datetime
-import random
 import math
-import pymworks
-import matplotlib.pyplot as plt
+import numpy as np
+import trial_cache
+import trial_segmentation
+import session_events
+import session_pool
+import session_discovery
+import figure_output
+import instrumentation
+import bootstrap
+import bootstrap_memo
+import analysis_state
+
+#events needed to build phase 2 trials
+EVENT_NAMES = [
+    "Announce_TrialStart",
+    "Announce_TrialEnd",
+    "success",
+    "failure",
+    "ignore",
+    "stm_size"
+]
+
+#event names read into each trial and the trial table column each goes in
+TRIAL_VARIABLES = {"stm_size": "stm_size"}
+
+#how stm_size is matched to trial starts, "asof" or "neighbors" (see
+#trial_segmentation.segment_trials_at_starts())
+STIMULUS_JOIN = "asof"
+
+#bootstrap iterations per (bin, stim size) cell, --iterations overrides it
+BOOTSTRAP_ITERATIONS = 10000
+
+#None to draw BOOTSTRAP_ITERATIONS for every cell, or the relative change in
+#the std devs between batches at which a cell stops being resampled (with
+#BOOTSTRAP_ITERATIONS as the maximum, see bootstrap.get_adaptive_std_devs())
+BOOTSTRAP_TOLERANCE = None
+
+#how error bars are computed, one of bootstrap.ERROR_MODELS: "bootstrap",
+#"analytic" (closed form, for quick looks) or "validate" (bootstrap, and
+#print how far the closed form is from it)
+ERROR_MODEL = "bootstrap"
+
+#what get_data_for_summary_statistics_graph() uses of each animal's
+#get_data_for_figure() result, kept for every animal while the rest is let go
+#once it's plotted
+SUMMARY_KEYS = ["bootstrap_bins_in_order", "pct_correct_bootstraph_graph_data"]
 
 def get_animals_and_their_session_filenames(path):
     '''
     Returns a dict with animal names as keys (it gets their names from the
         folder names in 'input' folder--each animal should have its own
         folder with .mwk session files) and a list of .mwk filename strings as
-        values.
+        values, oldest session first (see session_discovery.py).
             e.g. {'V1': ['V1_140501.mwk', 'V1_140502.mwk']}
 
     :param path: a string of the directory name containing animals' folders
     '''
-    #TODO maybe make this better, it's slow as hell and ugly
-    result = {}
-    dirs_list = [each for each in os.walk(path)]
-    for each in dirs_list[1:]:
-        files_list = each[2]
-        animal_name = each[0].split("/")[len(each[0].split("/")) - 1]
-        result[animal_name] = [] #list of filenames
-        for filename in files_list:
-            if not filename.startswith('.'): #dont want hidden files
-                result[animal_name].append(filename)
+    result = session_discovery.get_animals_and_their_session_filenames(path)
     return result
 
-def analyze_sessions(animals_and_sessions, graph_summary_stats=False):
+def analyze_sessions(animals_and_sessions, graph_summary_stats=False,
+    seed=None, iterations=BOOTSTRAP_ITERATIONS, processes=None,
+    tolerance=BOOTSTRAP_TOLERANCE, error_model=ERROR_MODEL,
+    incremental=False, figure_formats=None):
     '''
-    Starts analysis for each animals' sessions in a new process to use all CPU cores.
+    Reads each session, then analyzes each animals' sessions as soon as
+        they're read, in a new process to use all CPU cores.
         We don't want to wait all day for this, y'all.
 
     :param animals_and_sessions: a dict with animal names as keys and
         a list of their session filenames as values.
+    :param seed: master seed for the bootstrap (int). Runs with the same seed
+        give identical error bars no matter how many processes are used.
+        None for a different resample every run.
+    :param iterations: bootstrap iterations per (bin, stim size) cell (the
+        maximum in adaptive mode)
+    :param processes: number of worker processes, None for one per CPU core
+    :param tolerance: None, or the relative change to stop resampling a cell
+        at (adaptive mode, see bootstrap.get_adaptive_std_devs())
+    :param error_model: how error bars are computed (see ERROR_MODEL)
+    :param incremental: only compute stats for sessions that were added or
+        changed since the last incremental run, and error bars for the bins
+        they're in; everything else is reused from that run (see
+        analysis_state.py)
+    :param figure_formats: None to show figures, or a list of formats (see
+        figure_output.FORMATS) to save them in under output/phase2 instead
     '''
-    #use all CPU cores to process data
-    pool = multiprocessing.Pool(None)
+    pool = session_pool.start_pool(processes)
+
+    if incremental:
+        state = analysis_state.load_state("phase2")
+        stats_by_animal = get_stats_incrementally(pool, animals_and_sessions,
+            state)
+        std_devs_by_counts = get_error_bars_incrementally(stats_by_animal,
+            state, pool, seed, iterations, tolerance, error_model)
+        analysis_state.save_state("phase2", state)
+        stats_in_order = stats_by_animal.iteritems()
+    else:
+        #filled in with each animal's error bars as it comes up
+        std_devs_by_counts = {}
+        stats_in_order = get_stats_and_error_bars(pool, animals_and_sessions,
+            std_devs_by_counts, seed, iterations, tolerance, error_model,
+            processes)
+
+    #hand each animal's figure to the pool as soon as its stats and error
+    #bars are done and its data is put together, and only keep what the
+    #summary needs
+    summary_data = {} #animal name -> SUMMARY_KEYS of its data
+    figures = [] #multiprocessing.AsyncResult objects for saved figures
+    for animal, list_of_session_stats in stats_in_order:
+        data_for_animal = get_data_for_figure(animal,
+            animals_and_sessions[animal],
+            list_of_session_stats=list_of_session_stats,
+            std_devs_by_counts=std_devs_by_counts)
+        figures.append(figure_output.start_figure(make_a_figure,
+            (data_for_animal,), "phase2", animal, figure_formats, pool))
+        if error_model != "analytic": #nothing was resampled otherwise
+            print_bootstrap_iterations([data_for_animal])
+        summary_data[animal] = dict((key, data_for_animal[key]) for key in
+            SUMMARY_KEYS)
+    bootstrap_memo.save() #so the next run with this seed skips these cells
 
-    results = [] #list of multiprocessing.AsyncResult objects
-    for animal, sessions in animals_and_sessions.iteritems():
-        result = pool.apply_async(get_data_for_figure,
-            args=(animal, sessions))
-        results.append(result)
+    if graph_summary_stats:
+        #same animal order as always
+        data, bins_in_order = get_data_for_summary_statistics_graph(
+            [summary_data[animal] for animal in animals_and_sessions])
+        figures.append(figure_output.start_figure(make_summary_stats_figure,
+            (data, bins_in_order), "phase2", None, figure_formats, pool))
     pool.close()
-    pool.join() #block until all the data has been processed
+    figure_output.wait_for_figures(figures)
+    pool.join()
 
-    all_data = []
-    for each in results:
-        data_for_animal = each.get() #returns get_data_for_figure result
-        all_data.append(data_for_animal)
-        tmp = make_a_figure(data_for_animal)
+def get_stats_and_error_bars(pool, animals_and_sessions, std_devs_by_counts,
+    seed, iterations, tolerance, error_model, processes=None):
+    '''
+    Yields (animal name, result of get_stats_for_each_session()) for every
+    animal, computed from scratch in pool, in the order animals' sessions
+    finish being read (see session_pool.map_animals()). Before an animal
+    comes up, error bars for its (bin, stim size) cells are added to
+    std_devs_by_counts (a dict like the result of get_error_bars()); cells an
+    earlier animal already had aren't resampled again. With a seed, every
+    cell's error bars are the same whichever animal they're computed for.
+
+    :param processes: number of worker processes in pool, None for one per
+        CPU core
+    '''
+    #read every session as its own task so an animal with lots of sessions
+    #doesn't keep one core busy while the rest sit idle, and get each
+    #animal's stats as soon as its sessions are read
+    for animal, list_of_session_stats in session_pool.map_animals(pool,
+    animals_and_sessions, get_session_trials, get_stats_for_each_session,
+    get_session_path, processes=processes):
+        #resample every cell of the animal as its own task instead of one
+        #animal per process, so the bootstrap is spread over all cores
+        cells = [cell for cell in get_cells_to_resample(list_of_session_stats)
+            if cell not in std_devs_by_counts]
+        std_devs_by_counts.update(bootstrap.get_std_devs(cells, error_model,
+            iterations, BIN_STAT_KEYS.keys(), seed, pool, tolerance))
+        yield animal, list_of_session_stats
+
+def get_stats_incrementally(pool, animals_and_sessions, state):
+    '''
+    Returns the result of get_stats_for_each_session() for every animal (a
+    dict by animal name), only reading sessions whose file isn't in state
+    with the same signature (see trial_cache.get_file_signature()) and
+    extraction (see get_extraction()), i.e. new or changed ones, or all of
+    them after the way trials are extracted changed. state["sessions"] is
+    updated to the current sessions, so removed ones are dropped from it.
+
+    :param state: the state of the last incremental run, from
+        analysis_state.load_state()
+    '''
+    extraction = get_extraction()
+    signatures = {}
+    session_states = {}
+    sessions_to_read = {}
+    for animal, sessions in animals_and_sessions.iteritems():
+        for session in sessions:
+            path = get_session_path(animal, session)
+            signatures[path] = trial_cache.get_file_signature(path)
+            saved = state["sessions"].get(path)
+            if (saved is not None and saved["signature"] == signatures[path]
+            and saved["extraction"] == extraction):
+                session_states[path] = saved
+            else:
+                sessions_to_read.setdefault(animal, []).append(session)
+    print "%d of %d sessions are new or changed" % (
+        sum(len(sessions) for sessions in sessions_to_read.values()),
+        len(signatures))
+
+    stats_read = session_pool.map_sessions(pool, sessions_to_read,
+        get_session_stats_for_file, get_session_path)
+    for animal, sessions in sessions_to_read.iteritems():
+        for session, stats in zip(sessions, stats_read[animal]):
+            path = get_session_path(animal, session)
+            session_states[path] = {
+                "signature": signatures[path],
+                "extraction": extraction,
+                "stats": stats
+            }
+    state["sessions"] = session_states
 
-    if graph_summary_stats:
-        data, bins_in_order = get_data_for_summary_statistics_graph(all_data)
-        make_summary_stats_figure(data, bins_in_order)
+    stats_by_animal = {}
+    for animal, sessions in animals_and_sessions.iteritems():
+        stats_by_animal[animal] = []
+        for session_num, session in enumerate(sessions, 1):
+            stats = session_states[get_session_path(animal, session)]["stats"]
+            stats_by_animal[animal].append(dict(stats,
+                session_number=session_num))
+    return stats_by_animal
+
+def get_extraction():
+    '''
+    Returns what a session's trials depend on besides its file: how stimulus
+    sizes are joined to trials and the versions of the trial and event caches
+    (which get bumped when segmentation or decoding changes). Stats saved by
+    an incremental run with a different one are read again.
+    '''
+    return (STIMULUS_JOIN, trial_cache.CACHE_VERSION,
+        session_events.EVENTS_VERSION)
+
+def get_session_stats_for_file(animal_name, session_filename):
+    #one session's stats, read in a worker process for incremental runs.
+    #session_number is set when the animal's stats list is put together.
+    return get_session_stats(animal_name, session_filename,
+        get_session_trials(animal_name, session_filename))
+
+def get_error_bars_incrementally(stats_by_animal, state, pool=None, seed=None,
+    iterations=BOOTSTRAP_ITERATIONS, tolerance=BOOTSTRAP_TOLERANCE,
+    error_model=ERROR_MODEL, sessions_per_bin=8, bin_step=None):
+    '''
+    Returns the same as get_error_bars() for every animal, only computing
+    error bars for bins with a session that's new or changed (or that moved
+    to another bin) since the last incremental run with the same settings.
+    The rest come from state["bins"], which is updated to the current bins.
+    Bins are keyed by the extraction too (see get_extraction()), since their
+    counts change with it.
+
+    :param stats_by_animal: result of get_stats_incrementally(), whose state
+        (with signatures for every current session) is passed as state
+    '''
+    settings = (error_model, iterations, tolerance, seed, get_extraction())
+    bin_cells = {} #bin key -> (successes, failures, ignores) of its cells
+    for animal, session_stats_list in stats_by_animal.iteritems():
+        sizes, bin_ranges, bin_counts = get_bin_counts(session_stats_list,
+            sessions_per_bin, bin_step)
+        for (first, last), counts in zip(bin_ranges, bin_counts):
+            bin = session_stats_list[first - 1:last]
+            key = (settings, animal, tuple((session["filename"],
+                state["sessions"][get_session_path(animal,
+                session["filename"])]["signature"]) for session in bin))
+            bin_cells[key] = get_cells(counts)
+
+    new_cells = []
+    for key, cells in bin_cells.iteritems():
+        if key not in state["bins"]:
+            new_cells.extend(cells)
+    print "%d of %d bins need error bars" % (len(set(bin_cells) -
+        set(state["bins"])), len(bin_cells))
+
+    std_devs_by_counts = {}
+    for key in bin_cells:
+        if key in state["bins"]:
+            std_devs_by_counts.update(state["bins"][key])
+    std_devs_by_counts.update(bootstrap.get_std_devs(new_cells, error_model,
+        iterations, BIN_STAT_KEYS.keys(), seed, pool, tolerance))
+    state["bins"] = dict((key, dict((counts, std_devs_by_counts[counts]) for
+        counts in cells)) for key, cells in bin_cells.iteritems())
+    return std_devs_by_counts
 
 def make_summary_stats_figure(data, bins_in_order, colors=[
         "tomato",
@@ -80,6 +294,7 @@ def make_summary_stats_figure(data, bins_in_order, colors=[
     '''
     Makes a figure with data from all animals (ie averages, std dev, etc)
     '''
+    import matplotlib.pyplot as plt #only when drawing, see figure_output.py
 
     plt.close('all')
 
@@ -107,7 +322,7 @@ def make_summary_stats_figure(data, bins_in_order, colors=[
     plt.title("All animals percent correct")
     plt.legend(loc="lower right", title="Sessions")
 
-    plt.show()
+    figure_output.show("summary_pct_correct")
 
 def get_data_for_summary_statistics_graph(animal_data_list):
     all_bins = get_bins_in_common_for_all_animals(animal_data_list)
@@ -200,6 +415,7 @@ def make_a_figure(data, colors=["tomato", "turquoise", "violet", "springgreen",\
     :param data: a dict with x and y value lists returned by
         get_data_for_figure()
     '''
+    import matplotlib.pyplot as plt #only when drawing, see figure_output.py
     plt.close('all')
 
     f, ax_arr = plt.subplots(2, 1) #make 2 subplots for figure
@@ -229,7 +445,7 @@ def make_a_figure(data, colors=["tomato", "turquoise", "violet", "springgreen",\
     ax_arr[0].set_ylabel("Discriminability index (d')")
     ax_arr[1].set_ylabel("Number of trials")
 
-    plt.show()
+    figure_output.show("d_prime_and_trials_by_session")
     plt.close('all')
 
     bs_data = data["bootstrap_graph_data"]
@@ -250,7 +466,7 @@ def make_a_figure(data, colors=["tomato", "turquoise", "violet", "springgreen",\
     (bootstrapped std_dev)")
     plt.legend(loc="lower right", title="Sessions")
 
-    plt.show()
+    figure_output.show("binned_d_prime")
     plt.close('all')
 
     bs_pct_correct_data = data["pct_correct_bootstraph_graph_data"]
@@ -271,7 +487,7 @@ def make_a_figure(data, colors=["tomato", "turquoise", "violet", "springgreen",\
     std_dev")
     plt.legend(loc="lower right", title="Sessions")
 
-    plt.show()
+    figure_output.show("binned_pct_correct")
     plt.close('all')
 
     num_trials_data = data["binned_graph_trial_nums"]
@@ -289,7 +505,7 @@ def make_a_figure(data, colors=["tomato", "turquoise", "violet", "springgreen",\
     plt.title(data["animal_name"] + " sample size for all stimuli")
     plt.legend(loc="upper right", title="Sessions")
 
-    plt.show()
+    figure_output.show("binned_sample_size")
 
 def sort_by_size_from_size_strings(list_of_size_strings):
     '''
@@ -304,7 +520,9 @@ def sort_by_size_from_size_strings(list_of_size_strings):
     tmp.sort(reverse=True)
     return map(str, tmp)
 
-def get_data_for_figure(animal_name, sessions):
+@instrumentation.timed("aggregation")
+def get_data_for_figure(animal_name, sessions, session_trials=None,
+    list_of_session_stats=None, std_devs_by_counts=None):
     '''
     Analyzes one animals' sessions and outputs dict with x and y value lists
     for different types of graphs, e.g. percent correct, total trials, etc.
@@ -341,42 +559,55 @@ def get_data_for_figure(animal_name, sessions):
 
     :param animal_name: name of the animal (string)
     :param sessions: the animal's session filenames (list of strings)
+    :param session_trials: optional list with the result of
+        get_session_trials() for each session, if it was already read
+    :param list_of_session_stats: optional result of
+        get_stats_for_each_session(), if it was already computed
+    :param std_devs_by_counts: optional result of get_error_bars() covering
+        this animal's cells, if they were already resampled (e.g. across a
+        pool with a seed), otherwise they're resampled here
     '''
 
-    list_of_session_stats = get_stats_for_each_session(animal_name, sessions)
-    all_sizes_for_all_sessions = get_sizes_in_stats_list(list_of_session_stats)
-    bs, bins_in_order = \
-        get_bootstrapped_d_prime_and_std_dev(list_of_session_stats)
-    bs = make_lists_for_binned_bootstrap_graph(bs, all_sizes_for_all_sessions)
-
-    bs_pct_correct, ordered_bins = \
-        get_bootstrapped_pct_correct_and_std_dev(list_of_session_stats)
+    if list_of_session_stats is None:
+        list_of_session_stats = get_stats_for_each_session(animal_name,
+            sessions, session_trials)
+    #sizes (floats) and every session's outcome counts for each of them,
+    #and their running totals bins are counted from
+    sizes, counts_by_session = \
+        get_outcome_counts_by_session(list_of_session_stats)
+    cumulative_counts = get_cumulative_counts(list_of_session_stats,
+        (sizes, counts_by_session))
+    all_sizes_for_all_sessions = get_size_strings(sizes)
+    bin_stats, bins_in_order = \
+        get_bootstrapped_bin_stats(list_of_session_stats,
+            std_devs_by_counts=std_devs_by_counts,
+            cumulative_counts=cumulative_counts)
+    bs = make_lists_for_binned_bootstrap_graph(bin_stats,
+        all_sizes_for_all_sessions)
     bs_pct_correct = \
-        make_lists_for_binned_bootstrap_pct_correct_graph(bs_pct_correct,
+        make_lists_for_binned_bootstrap_pct_correct_graph(bin_stats,
             all_sizes_for_all_sessions)
 
     x_vals = [each["session_number"] for each in list_of_session_stats]
+    #sessions x sizes arrays of trials and d' (None without a success or
+    #failure, like a size the session didn't have)
+    num_trials = counts_by_session.sum(axis=2)
+    successes = counts_by_session[:, :, trial_segmentation.SUCCESS]
+    failures = counts_by_session[:, :, trial_segmentation.FAILURE]
+    answered = (successes + failures).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d_primes = successes/answered - failures/answered
     y_vals_d_prime = {}
     y_vals_num_trials = {}
-    for stim_size in all_sizes_for_all_sessions:
-        y_vals_d_prime[stim_size] = []
-        y_vals_num_trials[stim_size] = []
-        for session in list_of_session_stats:
-            if stim_size in session["d_prime_by_size"]:
-                y_vals_d_prime[stim_size].append(session["d_prime_by_size"]\
-                    [stim_size])
-            else:
-                y_vals_d_prime[stim_size].append(None)
-
-            if stim_size in session["total_trials_by_size"]:
-                y_vals_num_trials[stim_size].append(session[\
-                    "total_trials_by_size"][stim_size])
-            else:
-                y_vals_num_trials[stim_size].append(0)
+    for i, stim_size in enumerate(get_size_strings(sizes, descending=False)):
+        y_vals_d_prime[stim_size] = [d_prime if total > 0 else None for
+            d_prime, total in zip(d_primes[:, i].tolist(),
+            answered[:, i].tolist())]
+        y_vals_num_trials[stim_size] = num_trials[:, i].tolist()
 
     binned_graph_trial_nums = get_trial_nums_for_binned_graph(
-        y_vals_num_trials,
-        bins_in_order)
+        cumulative_counts,
+        get_bin_ranges(len(list_of_session_stats)))
 
     print "Finished analysis for " + animal_name
 
@@ -388,84 +619,39 @@ def get_data_for_figure(animal_name, sessions):
         "animal_name": animal_name,
         "bootstrap_graph_data": bs,
         "bootstrap_bins_in_order": bins_in_order,
-        "bootstrap_ordered_bins": ordered_bins, #dont really need this...
+        "bootstrap_ordered_bins": bins_in_order, #dont really need this...
+        "bootstrap_bin_stats": bin_stats,
         "pct_correct_bootstraph_graph_data": bs_pct_correct,
         "binned_graph_trial_nums": binned_graph_trial_nums
     }
 
 def get_trial_nums_for_binned_graph(
-    y_vals_total_trials_by_size,
-    bins_in_order,
-    sessions_per_bin=8):
+    cumulative_counts,
+    bin_ranges):
     '''
     returns dict like this:
     {
         "1-10": {
-            "x_vals_sizes": [40.0, 35.0, 37.0, 15.0, 20.0, etc],
+            "x_vals_sizes": [15.0, 20.0, 35.0, 37.0, 40.0, etc],
             "y_vals_total_trials": [...]
         }
         "11-20": etc etc
     }
+
+    :param cumulative_counts: result of get_cumulative_counts()
+    :param bin_ranges: (first, last) session numbers of each bin, e.g. from
+        get_bin_ranges()
     '''
+    sizes, cumulative = cumulative_counts
     result = {}
-    lower, upper = 0, sessions_per_bin
-    for bin in bins_in_order:
-        result[bin] = {
-            "x_vals_sizes": [],
-            "y_vals_total_trials": []
+    for first, last in bin_ranges:
+        result[get_bin_name(first, last)] = {
+            "x_vals_sizes": sizes.tolist(), #sorted, like matplotlib needs
+            "y_vals_total_trials": get_counts_for_sessions(cumulative, first,
+                last).sum(axis=1).tolist()
         }
-        for size, list_of_trials in y_vals_total_trials_by_size.iteritems():
-            result[bin]["x_vals_sizes"].append(float(size))
-            total_trials_for_size = sum(list_of_trials[lower:upper])
-            result[bin]["y_vals_total_trials"].append(total_trials_for_size)
-
-        lower, upper = upper, upper + sessions_per_bin
-    #data added to result but not in order yet
-    #x, y vals have to be sorted for matplotlib
-    for bin in bins_in_order:
-        result[bin]["x_vals_sizes"], result[bin]["y_vals_total_trials"] = \
-            sort_x_y_pairs_by_x_val(
-                result[bin]["x_vals_sizes"],
-                result[bin]["y_vals_total_trials"]
-            )
     return result
 
-def sort_x_y_pairs_by_x_val(x_vals_list, y_vals_list):
-    '''
-    x_vals_list should be either ints or floats
-    '''
-    xy = zip(x_vals_list, y_vals_list)
-    xy.sort()
-    new_x = []
-    new_y = []
-    for x, y in xy:
-        new_x.append(x)
-        new_y.append(y)
-    return new_x, new_y
-
-def get_bootstrapped_pct_correct_and_std_dev(
-    session_stats_list,
-    sessions_per_bin=8):
-    '''
-    Gets stats for one animal. Standard deviations come from bootstrap resample.
-    '''
-    stats_in_bins = split_list_into_sublists(
-        session_stats_list,
-        sessions_per_bin)
-    bin_stats = {}
-    bins_in_order = []
-    low, up = 1, sessions_per_bin
-    for bin in stats_in_bins:
-        bin_str = str(low) + "-" + str(up)
-        observed_pct_correct, bootstrapped_std_dev = calc_pct_correct(bin)
-        bin_stats[bin_str] = {
-            "observed_pct_correct": observed_pct_correct,
-            "bootstrapped_pct_correct_std_dev": bootstrapped_std_dev
-        }
-        bins_in_order.append(bin_str)
-        low, up = up + 1, up + sessions_per_bin
-    return bin_stats, bins_in_order
-
 def make_lists_for_binned_bootstrap_pct_correct_graph(bin_stats, all_sizes):
     result = {}
     for bin in bin_stats:
@@ -509,72 +695,89 @@ def removeNoneTypesPctCorrect(result):
         }
     return final_result
 
-def calc_pct_correct(bin):
-    bin_data = get_bin_data_for_each_stim_size(bin)
-    observed_pct_correct_by_size = calc_real_pct_correct(bin_data)
-    std_dev_by_size = run_bootstrap_resample_pct_correct(bin_data)
-    return observed_pct_correct_by_size, std_dev_by_size
-
-def calc_real_pct_correct(bin_data):
-    real_pct_correct_by_size = {}
-    for stim_size in bin_data:
-        total = float(bin_data[stim_size]["success"] + \
-            bin_data[stim_size]["failure"] + bin_data[stim_size]["ignore"])
-        try:
-            pct_correct = (float(bin_data[stim_size]["success"])/total) * 100.0
-        except ZeroDivisionError:
-            pct_correct = None
-        real_pct_correct_by_size[stim_size] = pct_correct
-    return real_pct_correct_by_size
-
-def run_bootstrap_resample_pct_correct(bin_data, iterations=10000):
-    behavior_lists_by_size = make_lists_for_resampling(bin_data)
-    bootstrapped_pct_correct_list_by_size = {}
-    for stim_size in behavior_lists_by_size.keys():
-        bootstrapped_pct_correct_list_by_size[stim_size] = []
-
-    for i in xrange(iterations):
-        for size, real_outcomes in behavior_lists_by_size.iteritems():
-            successes, failures, ignores = 0, 0, 0
-            for e in xrange(len(real_outcomes)):
-                chosen = random.choice(real_outcomes)
-                if chosen == "success":
-                    successes += 1
-                elif chosen == "failure":
-                    failures += 1
-                elif chosen == "ignore":
-                    ignores += 1
-                else:
-                    print "wut"
-            total = float(successes + failures + ignores)
-            try:
-                bs_pct_correct = (float(successes)/total) * 100.0
-            except ZeroDivisionError:
-                bs_pct_correct = None
-            bootstrapped_pct_correct_list_by_size[size].append(bs_pct_correct)
-    std_dev_by_size = calc_std_devs(bootstrapped_pct_correct_list_by_size)
-    return std_dev_by_size
-
-def get_bootstrapped_d_prime_and_std_dev(
+def get_bootstrapped_bin_stats(
     session_stats_list,
-    sessions_per_bin=8):
-    stats_in_bins = split_list_into_sublists(
-        session_stats_list,
-        sessions_per_bin)
+    sessions_per_bin=8,
+    std_devs_by_counts=None,
+    cumulative_counts=None,
+    bin_step=None):
+    '''
+    Gets binned stats for one animal. Sessions are split into bins once and
+    each bin is resampled once; observed values and bootstrapped std devs for
+    d', percent correct, percent failure and percent ignore all come out of
+    that one pass (see calc_bin_stats()).
+
+    Returns a dict with bin strings (e.g. "1-8") as keys and the result of
+    calc_bin_stats() for that bin as values, and a list of bin strings in
+    order.
+
+    std_devs_by_counts is the result of get_error_bars() for the animal's
+    cells; they're resampled here (unseeded, with the defaults at the top of
+    this file) if it's None. cumulative_counts is the result of
+    get_cumulative_counts(), if it was already computed. See get_bin_ranges()
+    for bin_step.
+    '''
+    if std_devs_by_counts is None:
+        std_devs_by_counts = get_error_bars([session_stats_list],
+            sessions_per_bin=sessions_per_bin, bin_step=bin_step)
+    sizes, bin_ranges, bin_counts = get_bin_counts(session_stats_list,
+        sessions_per_bin, bin_step, cumulative_counts)
     bin_stats = {}
     bins_in_order = []
-    low, up = 1, sessions_per_bin
-    for bin in stats_in_bins:
-        bin_str = str(low) + "-" + str(up)
-        observed_d_prime, bootstrapped_std_dev = calculate_d_prime(bin)
-        bin_stats[bin_str] = {
-            "observed_d_prime": observed_d_prime,
-            "bootstrapped_std_dev": bootstrapped_std_dev
-        }
+    for (first, last), counts in zip(bin_ranges, bin_counts):
+        bin_str = get_bin_name(first, last)
+        bin_stats[bin_str] = calc_bin_stats(sizes, counts, std_devs_by_counts)
         bins_in_order.append(bin_str)
-        low, up = up + 1, up + sessions_per_bin
     return bin_stats, bins_in_order
 
+def get_cells_to_resample(session_stats_list, sessions_per_bin=8,
+    bin_step=None):
+    '''
+    Returns a list with the (successes, failures, ignores) counts of every
+    (bin, stim size) cell get_bootstrapped_bin_stats() resamples for one
+    animal, so their error bars can all be computed up front.
+    '''
+    cells = []
+    for counts in get_bin_counts(session_stats_list, sessions_per_bin,
+    bin_step)[2]:
+        cells.extend(get_cells(counts))
+    return cells
+
+def get_cells(counts):
+    '''
+    Returns the (successes, failures, ignores) tuple of each size with trials
+    in a bin, from its len(sizes) x 3 array in get_bin_counts().
+    '''
+    return [tuple(size_counts) for size_counts in counts.tolist() if
+        sum(size_counts) > 0]
+
+def get_error_bars(session_stats_lists, pool=None, seed=None,
+    iterations=BOOTSTRAP_ITERATIONS, tolerance=BOOTSTRAP_TOLERANCE,
+    error_model=ERROR_MODEL, sessions_per_bin=8, bin_step=None):
+    '''
+    Returns std devs for every (bin, stim size) cell of every animal, as a
+    dict with (successes, failures, ignores) tuples as keys and (dict of std
+    devs by statistic name (the keys of BIN_STAT_KEYS), iterations drawn) as
+    values, see bootstrap.get_std_devs().
+
+    :param session_stats_lists: list with the result of
+        get_stats_for_each_session() for each animal
+    :param pool: a multiprocessing.Pool to resample cells in, or None
+    :param seed: master seed for the bootstrap (see bootstrap.py)
+    :param iterations: bootstrap iterations per cell (the maximum in adaptive
+        mode)
+    :param tolerance: None, or the tolerance for adaptive mode
+    :param error_model: one of bootstrap.ERROR_MODELS (see ERROR_MODEL)
+    :param sessions_per_bin: sessions in each bin
+    :param bin_step: see get_bin_ranges()
+    '''
+    cells = []
+    for session_stats_list in session_stats_lists:
+        cells.extend(get_cells_to_resample(session_stats_list,
+            sessions_per_bin, bin_step))
+    return bootstrap.get_std_devs(cells, error_model, iterations,
+        BIN_STAT_KEYS.keys(), seed, pool, tolerance)
+
 def make_lists_for_binned_bootstrap_graph(bin_stats, all_sizes):
     result = {}
     for bin in bin_stats:
@@ -619,114 +822,194 @@ def removeNoneTypes(result):
         }
     return final_result
 
-def split_list_into_sublists(session_stats_list, sessions_per_bin):
-    new_list = []
-    while len(session_stats_list) >= sessions_per_bin:
-        new_list.append(session_stats_list[:sessions_per_bin])
-        session_stats_list = session_stats_list[sessions_per_bin:]
-    return new_list
-
-def calculate_d_prime(bin):
-    bin_data = get_bin_data_for_each_stim_size(bin)
-    observed_d_prime_by_size = calc_real_d_prime(bin_data)
-    std_dev_by_size = run_bootstrap_resample(bin_data)
-    return observed_d_prime_by_size, std_dev_by_size
-
-def run_bootstrap_resample(bin_data, iterations=10000):
-    behavior_lists_by_size = make_lists_for_resampling(bin_data)
-    bootstrapped_d_prime_list_by_size = {}
-    for stim_size in behavior_lists_by_size.keys():
-        bootstrapped_d_prime_list_by_size[stim_size] = []
-
-    for i in xrange(iterations):
-        for size, real_outcomes in behavior_lists_by_size.iteritems():
-            successes = 0
-            failures = 0
-            for e in xrange(len(real_outcomes)):
-                chosen = random.choice(real_outcomes)
-                if chosen == "success":
-                    successes += 1
-                elif chosen == "failure":
-                    failures += 1
-                else:
-                    pass
-            total = float(successes + failures)
-            try:
-                bs_d_prime = float(successes)/total - \
-                    float(failures)/total
-            except ZeroDivisionError:
-                bs_d_prime = None
-
-            bootstrapped_d_prime_list_by_size[size].append(bs_d_prime)
-    std_dev_by_size = calc_std_devs(bootstrapped_d_prime_list_by_size)
-    return std_dev_by_size
-
-def calc_std_devs(bootstrapped_d_prime_list_by_size):
-    std_dev_by_size = {}
-    for size, bs_d_primes in bootstrapped_d_prime_list_by_size.iteritems():
-        try:
-            mean = math.fsum(bs_d_primes)/len(bs_d_primes)
-            variance = (math.fsum([(prime - mean)**2.0 \
-                for prime in bs_d_primes]))/(len(bs_d_primes) - 1)
-            std_dev = math.sqrt(variance)
-            std_dev_by_size[size] = std_dev
-        except TypeError: #random samples with no success or failure
-        #this except clause happens when sample size is small and/or
-        #iterations kwarg is very very large
-            std_dev_by_size[size] = None
-    return std_dev_by_size
-
-def make_lists_for_resampling(bin_data):
-    behavior_lists = {}
-    for stim_size in bin_data:
-        behavior_lists[stim_size] = []
-        for each in ["success", "ignore", "failure"]:
-            for i in xrange(bin_data[stim_size][each]):
-                behavior_lists[stim_size].append(each)
-    return behavior_lists
-
-def get_bin_data_for_each_stim_size(bin):
-    bin_data = {}
-    #start success, failure, and ignore totals at 0
-    for session in bin:
-        for stim_size in session["total_trials_by_size"].keys():
-            bin_data[stim_size] = {
-                "success": 0,
-                "failure": 0,
-                "ignore": 0
-            }
-    #now add up behavior events from all sessions in the bin
-    for session in bin:
-        successes_by_size = \
-            session["num_behavior_outcomes_by_size"]["success"]
-        failures_by_size = \
-            session["num_behavior_outcomes_by_size"]["failure"]
-        ignores_by_size = \
-            session["num_behavior_outcomes_by_size"]["ignore"]
-
-        for stim_size in session["total_trials_by_size"].keys():
-            bin_data[stim_size]["success"] += \
-                successes_by_size[stim_size]
-
-            bin_data[stim_size]["failure"] += \
-                failures_by_size[stim_size]
-
-            bin_data[stim_size]["ignore"] += \
-                ignores_by_size[stim_size]
-    return bin_data
-
-def calc_real_d_prime(bin_data):
-    real_d_prime_by_size = {}
-    for stim_size in bin_data:
-        total = float(bin_data[stim_size]["success"] + \
-            bin_data[stim_size]["failure"])
-        try:
-            d_prime = float(bin_data[stim_size]["success"])/total - \
-                float(bin_data[stim_size]["failure"])/total
-        except ZeroDivisionError:
-            d_prime = None
-        real_d_prime_by_size[stim_size] = d_prime
-    return real_d_prime_by_size
+#keys for each statistic in the result of calc_bin_stats(), i.e.
+#name in bootstrap.STATISTICS: (observed key, bootstrapped std dev key)
+BIN_STAT_KEYS = {
+    "d_prime": ("observed_d_prime", "bootstrapped_std_dev"),
+    "pct_correct": ("observed_pct_correct", "bootstrapped_pct_correct_std_dev"),
+    "pct_failure": ("observed_pct_failure", "bootstrapped_pct_failure_std_dev"),
+    "pct_ignore": ("observed_pct_ignore", "bootstrapped_pct_ignore_std_dev")
+}
+
+def calc_bin_stats(sizes, counts, std_devs_by_counts):
+    '''
+    Returns a dict with observed values and bootstrapped std devs of every
+    statistic in BIN_STAT_KEYS for a bin of sessions (sizes and its
+    len(sizes) x 3 array of outcome counts from get_bin_counts()), keyed by
+    the string of each size with trials in the bin, e.g.
+    {
+        "observed_d_prime": {"40.0": 0.8, "35.0": 0.6},
+        "bootstrapped_std_dev": {"40.0": 0.05, "35.0": 0.07},
+        "observed_pct_correct": {"40.0": 85.0, "35.0": 75.0},
+        "bootstrapped_pct_correct_std_dev": {"40.0": 2.5, "35.0": 3.1},
+        ...same for pct_failure and pct_ignore
+        "bootstrap_iterations": {"40.0": 10000, "35.0": 10000}
+    }
+    Percentages go from 0 to 100. Values are None where a statistic is
+    undefined (e.g. d' for a size with only ignores).
+    '''
+    bin_data = dict((str(size), size_counts) for size, size_counts in
+        zip(sizes, counts.tolist()) if sum(size_counts) > 0)
+    std_devs_by_statistic, iterations_by_size = get_std_devs_by_statistic(
+        bin_data, std_devs_by_counts)
+
+    result = {}
+    for statistic, (observed_key, std_dev_key) in BIN_STAT_KEYS.iteritems():
+        result[observed_key] = {}
+        result[std_dev_key] = std_devs_by_statistic[statistic]
+    #iterations each size was resampled with, to see where the compute went
+    result["bootstrap_iterations"] = iterations_by_size
+    for stim_size, outcome_counts in bin_data.iteritems():
+        observed = bootstrap.get_observed_stats(outcome_counts,
+            BIN_STAT_KEYS.keys())
+        for statistic, (observed_key, std_dev_key) in BIN_STAT_KEYS.iteritems():
+            result[observed_key][stim_size] = observed[statistic]
+    return result
+
+def get_std_devs_by_statistic(bin_data, std_devs_by_counts):
+    '''
+    Returns a dict with statistic names (the keys of BIN_STAT_KEYS) as keys and
+    a dict of std devs by stim size string as values, and a dict with the
+    iterations drawn for each stim size string.
+
+    :param bin_data: dict with stim size strings as keys and the size's
+        (successes, failures, ignores) in a bin as values
+    :param std_devs_by_counts: result of get_error_bars() covering the bin
+    '''
+    std_devs_by_statistic = {}
+    iterations_by_size = {}
+    for statistic in BIN_STAT_KEYS.keys():
+        std_devs_by_statistic[statistic] = {}
+    for stim_size, outcome_counts in bin_data.iteritems():
+        std_devs, drawn = std_devs_by_counts[tuple(outcome_counts)]
+        for statistic, std_dev in std_devs.iteritems():
+            std_devs_by_statistic[statistic][stim_size] = std_dev
+        iterations_by_size[stim_size] = drawn
+    return std_devs_by_statistic, iterations_by_size
+
+def print_bootstrap_iterations(all_data):
+    '''
+    Prints how many bootstrap iterations each (bin, stim size) cell of each
+    animal got, and the total, e.g.
+        AB1 1-8: 40.0: 3000, 35.0: 12000
+        AB1 total: 15000 iterations
+
+    :param all_data: list of get_data_for_figure() results
+    '''
+    for data in all_data:
+        total = 0
+        for bin in data["bootstrap_bins_in_order"]:
+            by_size = data["bootstrap_bin_stats"][bin]["bootstrap_iterations"]
+            sizes = sort_by_size_from_size_strings(by_size.keys())
+            print "%s %s: %s" % (data["animal_name"], bin, ", ".join(
+                "%s: %d" % (size, by_size[size]) for size in sizes))
+            total += sum(by_size.values())
+        print "%s total: %d iterations" % (data["animal_name"], total)
+
+def get_size_index(list_of_session_stats):
+    '''
+    Returns a sorted array of the stim sizes (floats) in ANY of an animal's
+    sessions, not necessarily ALL of them. A size's position in it is its
+    index in the arrays of get_outcome_counts_by_session().
+    '''
+    return np.unique([size for session in list_of_session_stats for size in
+        session["sizes"]])
+
+def get_outcome_counts_by_session(list_of_session_stats):
+    '''
+    Returns the animal's sizes (see get_size_index()) and a sessions x sizes x
+    3 array with each session's (successes, failures, ignores) for each size,
+    0 for sizes a session didn't have.
+    '''
+    sizes = get_size_index(list_of_session_stats)
+    counts = np.zeros((len(list_of_session_stats), len(sizes),
+        len(trial_segmentation.OUTCOMES)), dtype=np.int64)
+    for i, session in enumerate(list_of_session_stats):
+        counts[i, np.searchsorted(sizes, session["sizes"])] = \
+            session["outcome_counts"]
+    return sizes, counts
+
+def get_cumulative_counts(list_of_session_stats, counts_by_session=None):
+    '''
+    Returns the animal's sizes and a (sessions + 1) x sizes x 3 array whose
+    row n holds each size's (successes, failures, ignores) summed over
+    sessions 1 to n (row 0 is all 0), so the counts of any range of sessions
+    take one subtraction (see get_counts_for_sessions()), however long the
+    animal's training went on.
+
+    :param counts_by_session: result of get_outcome_counts_by_session(), if
+        it was already computed
+    '''
+    if counts_by_session is None:
+        counts_by_session = get_outcome_counts_by_session(
+            list_of_session_stats)
+    sizes, counts = counts_by_session
+    cumulative = np.zeros((len(counts) + 1,) + counts.shape[1:],
+        dtype=np.int64)
+    np.cumsum(counts, axis=0, out=cumulative[1:])
+    return sizes, cumulative
+
+def get_counts_for_sessions(cumulative, first, last):
+    '''
+    Returns a sizes x 3 array with each size's (successes, failures, ignores)
+    in sessions first to last (session numbers from 1, last included), e.g.
+    sessions 3..12 of an animal:
+        sizes, cumulative = get_cumulative_counts(list_of_session_stats)
+        counts = get_counts_for_sessions(cumulative, 3, 12)
+    first and last can also be arrays of session numbers, for one sizes x 3
+    array per range.
+
+    :param cumulative: the array from get_cumulative_counts()
+    '''
+    return cumulative[last] - cumulative[first - 1]
+
+def get_bin_ranges(num_sessions, sessions_per_bin=8, bin_step=None):
+    '''
+    Returns (first, last) session numbers (from 1, last included) of every
+    full bin of sessions_per_bin sessions out of num_sessions, e.g.
+    [(1, 8), (9, 16)] for 20 sessions. A bin starts every bin_step sessions:
+    None for bins side by side, less than sessions_per_bin for a sliding
+    window.
+    '''
+    if bin_step is None:
+        bin_step = sessions_per_bin
+    return [(first, first + sessions_per_bin - 1) for first in xrange(1,
+        num_sessions - sessions_per_bin + 2, bin_step)]
+
+def get_bin_name(first, last):
+    #the bin strings figures are keyed by, e.g. "1-8"
+    return str(first) + "-" + str(last)
+
+def get_bin_counts(list_of_session_stats, sessions_per_bin=8, bin_step=None,
+    cumulative_counts=None):
+    '''
+    Returns the animal's sizes, its bins (see get_bin_ranges()) and a bins x
+    sizes x 3 array with the (successes, failures, ignores) of each size in
+    every bin, one subtraction of running totals per bin.
+
+    :param cumulative_counts: result of get_cumulative_counts(), if it was
+        already computed
+    '''
+    if cumulative_counts is None:
+        cumulative_counts = get_cumulative_counts(list_of_session_stats)
+    sizes, cumulative = cumulative_counts
+    bin_ranges = get_bin_ranges(len(cumulative) - 1, sessions_per_bin,
+        bin_step)
+    firsts = np.array([first for first, last in bin_ranges], dtype=np.intp)
+    lasts = np.array([last for first, last in bin_ranges], dtype=np.intp)
+    return sizes, bin_ranges, get_counts_for_sessions(cumulative, firsts,
+        lasts)
+
+def get_size_strings(sizes, descending=True):
+    '''
+    Returns the stim size strings the figures are keyed by, e.g. "40.0", for
+    an array of sizes (largest first, so each size always has the same color
+    across animals in make_a_figure()).
+    '''
+    sizes = sizes.tolist()
+    if descending:
+        sizes.reverse()
+    return map(str, sizes)
 
 def get_sizes_in_stats_list(list_of_session_stats):
     '''
@@ -736,16 +1019,9 @@ def get_sizes_in_stats_list(list_of_session_stats):
     :param list_of_session_stats: the list returned by
         get_stats_for_each_session()
     '''
-    sizes = []
-    for each in list_of_session_stats:
-        session_sizes = each["total_trials_by_size"].keys()
-        for size in session_sizes:
-            if not size in sizes:
-                sizes.append(size)
-    sizes = sort_by_size_from_size_strings(sizes)
-    return sizes
+    return get_size_strings(get_size_index(list_of_session_stats))
 
-def get_stats_for_each_session(animal_name, sessions):
+def get_stats_for_each_session(animal_name, sessions, session_trials=None):
     '''
     Returns a list of dicts with statistics about each session for an
     animal. e.g.
@@ -776,7 +1052,10 @@ def get_stats_for_each_session(animal_name, sessions):
         ...
         other keys in result:
         'pct_ignore_by_size',
-        'total_trials_by_size'
+        'total_trials_by_size',
+        'sizes': [35.0, 40.0, etc], #floats the by_size keys are made from
+        'outcome_counts': len(sizes) x 3 array with the (successes,
+            failures, ignores) of each size in sizes
 
     },
 
@@ -806,202 +1085,207 @@ def get_stats_for_each_session(animal_name, sessions):
         (e.g. pct_correct or d_prime), the key's value is set to None.
         Behavior outcomes (e.g. ignores, successes, etc.) with no occurances
         are left with value = 0.
+
+    session_trials is an optional list with the result of get_session_trials()
+    for each session, so sessions that were already read (e.g. by
+    analyze_sessions()) don't have to be read again. Each one can also be an
+    iterator over the session's trials (see iter_session_trials()), which is
+    packed into a trial table as it's consumed.
     '''
     #TODO break this down into more functions...it's a bit difficult to read
     print "Starting analysis for " + animal_name
+    if session_trials is None:
+        session_trials = [get_session_trials(animal_name, session) for
+            session in sessions]
+
     all_session_results = []
     session_num = 1
-    for session in sessions:
-        all_trials = get_session_trials(animal_name, session)
-
-        #make dict to store session data
-        session_result = {"session_number": session_num,
-                          "total_trials": len(all_trials),
-                          "filename": session}
-
-
-        total_trials_by_size = {}
-        successes = 0
-        failures = 0
-        ignores = 0
-        #keep track of total successes and failures for each size
-        num_failure_by_size = {}
-        num_success_by_size = {}
-        num_ignores_by_size = {}
-
-        for trial in all_trials:
-            #add trial to total trials for each size
-            try:
-                total_trials_by_size[str(trial["stm_size"])] += 1
-            except KeyError:
-                total_trials_by_size[str(trial["stm_size"])] = 1
-
-            #track successes and failures for each size, will use for d'
-            if trial["behavior_outcome"] == "success":
-                successes += 1
-                try:
-                    num_success_by_size[str(trial["stm_size"])] += 1
-                except KeyError:
-                    num_success_by_size[str(trial["stm_size"])] = 1
-
-            elif trial["behavior_outcome"] == "failure":
-                failures += 1
-                try:
-                    num_failure_by_size[str(trial["stm_size"])] += 1
-                except KeyError:
-                    num_failure_by_size[str(trial["stm_size"])] = 1
-            elif trial["behavior_outcome"] == "ignore":
-                ignores += 1
-                try:
-                    num_ignores_by_size[str(trial["stm_size"])] += 1
-                except KeyError:
-                    num_ignores_by_size[str(trial["stm_size"])] = 1
-            else:
-                #this really shouldnt happen, but just in case...
-                print "No behavior_outcome in trial ", trial["trial_num"], \
-                    "for animal ", animal_name, " session ", session
-                #dont include this trial in total trials
-                total_trials_by_size[str(trial["stm_size"])] -= 1
-
-        #done with for loop, now populate data for session_result
-        #first add data we already have...
-        session_result["successes"] = successes
-        session_result["failures"] = failures
-        session_result["ignores"] = ignores
-        try:
-            session_result["d_prime_overall"] = (float(successes)/float(\
-                successes + failures)) - (float(failures)/float(\
-                successes + failures))
-        except ZeroDivisionError:
-            session_result["d_prime_overall"] = None
-        session_result["total_trials_by_size"] = total_trials_by_size
-
-        #now get ready to add data from by_size dicts...
-        d_prime_by_size = {}
-        pct_correct_by_size = {}
-        pct_failure_by_size = {}
-        pct_ignore_by_size = {}
-
-        for stim_size in total_trials_by_size:
-            #add any missing size keys with 0 value to make life easier
-            num_success_by_size = addMissingKey(num_success_by_size, stim_size)
-            num_failure_by_size = addMissingKey(num_failure_by_size, stim_size)
-            num_ignores_by_size = addMissingKey(num_ignores_by_size, stim_size)
-
-            try:
-                d_prime_by_size[stim_size] = (float(num_success_by_size[\
-                    stim_size])/float(num_success_by_size[stim_size] + \
-                    num_failure_by_size[stim_size])) - (float(\
-                    num_failure_by_size[stim_size])/float(num_success_by_size[\
-                    stim_size] + num_failure_by_size[stim_size]))
-            except ZeroDivisionError:
-                d_prime_by_size[stim_size] = None
-
-            total_trials_for_size = float(num_success_by_size[stim_size] + \
-                num_ignores_by_size[stim_size] + num_failure_by_size[stim_size])
-
-            try:
-                pct_correct_by_size[stim_size] = (float(num_success_by_size[\
-                    stim_size]))/total_trials_for_size
-            except ZeroDivisionError:
-                pct_correct_by_size[stim_size] = None
-
-            try:
-                pct_failure_by_size[stim_size] = (float(num_failure_by_size[\
-                    stim_size]))/total_trials_for_size
-            except ZeroDivisionError:
-                pct_failure_by_size[stim_size] = None
-
-            try:
-                pct_ignore_by_size[stim_size] = (float(num_ignores_by_size[\
-                    stim_size]))/total_trials_for_size
-            except ZeroDivisionError:
-                pct_ignore_by_size[stim_size] = None
-
-        #finally, add results to the session's results dict
-        session_result["d_prime_by_size"] = d_prime_by_size
-        session_result["pct_correct_by_size"] = pct_correct_by_size
-        session_result["pct_failure_by_size"] = pct_failure_by_size
-        session_result["pct_ignore_by_size"] = pct_ignore_by_size
-        session_result["num_behavior_outcomes_by_size"] = {
-            "success": num_success_by_size,
-            "failure": num_failure_by_size,
-            "ignore": num_ignores_by_size
-        }
-
-        all_session_results.append(session_result)
+    for session, all_trials in zip(sessions, session_trials):
+        all_session_results.append(get_session_stats(animal_name, session,
+            all_trials, session_num))
         session_num += 1
     return all_session_results
 
-def addMissingKey(size_dict, key):
+@instrumentation.timed("aggregation")
+def get_session_stats(animal_name, session, all_trials, session_num=1):
+    '''
+    Returns the stats dict for one session (see get_stats_for_each_session()).
+
+    :param animal_name: name of the animal (string)
+    :param session: filename for the session (string)
+    :param all_trials: the session's trials, a trial table or an iterable of
+        trial dicts
+    :param session_num: the session's number among the animal's sessions
     '''
-    Helper func so you don't have to check whether a key exists before doing
-    math with its values. If a key doesn't exist in one of the by_size dicts,
-    addMissingKey will add the key with value 0 and return the dict.
+    #make dict to store session data
+    session_result = {"session_number": session_num,
+                      "filename": session}
+
+    #each stim size gets an index, then one 2-D bincount counts the outcomes
+    #of every size
+    trials = trial_segmentation.as_table(all_trials, TRIAL_VARIABLES.values())
+    sizes, size_index = np.unique(trials["stm_size"], return_inverse=True)
+    outcome_counts = trial_segmentation.count_outcomes_by_index(size_index,
+        trials["outcome"], len(sizes))
+    successes, failures, ignores = outcome_counts.sum(axis=0).tolist()
+
+    session_result["total_trials"] = len(trials)
+    session_result["successes"] = successes
+    session_result["failures"] = failures
+    session_result["ignores"] = ignores
+    try:
+        session_result["d_prime_overall"] = (float(successes)/float(\
+            successes + failures)) - (float(failures)/float(\
+            successes + failures))
+    except ZeroDivisionError:
+        session_result["d_prime_overall"] = None
+    #what everything after this session counts with (see
+    #get_outcome_counts_by_session())
+    session_result["sizes"] = sizes.tolist()
+    session_result["outcome_counts"] = outcome_counts
+    session_result.update(get_stats_by_size(sizes.tolist(), outcome_counts))
+    return session_result
+
+def get_stats_by_size(sizes, outcome_counts):
     '''
-    if not key in size_dict:
-        size_dict[key] = 0
-        return size_dict
-    return size_dict
+    Returns the by_size entries of a session's stats (see
+    get_stats_for_each_session()), dicts with stim size strings as keys.
+
+    :param sizes: list of the session's stim sizes (floats)
+    :param outcome_counts: len(sizes) x 3 array with the (successes,
+        failures, ignores) of each size
+    '''
+    result = {
+        "total_trials_by_size": {},
+        "d_prime_by_size": {},
+        "pct_correct_by_size": {},
+        "pct_failure_by_size": {},
+        "pct_ignore_by_size": {},
+        "num_behavior_outcomes_by_size": {
+            "success": {},
+            "failure": {},
+            "ignore": {}
+        }
+    }
+    for size, (success, failure, ignore) in zip(sizes,
+    outcome_counts.tolist()):
+        stim_size = str(size)
+        result["total_trials_by_size"][stim_size] = success + failure + ignore
+        result["num_behavior_outcomes_by_size"]["success"][stim_size] = success
+        result["num_behavior_outcomes_by_size"]["failure"][stim_size] = failure
+        result["num_behavior_outcomes_by_size"]["ignore"][stim_size] = ignore
+        try:
+            result["d_prime_by_size"][stim_size] = (float(success)/\
+                float(success + failure)) - (float(failure)/\
+                float(success + failure))
+        except ZeroDivisionError:
+            result["d_prime_by_size"][stim_size] = None
+        #every size in sizes had trials
+        total_trials_for_size = float(success + ignore + failure)
+        result["pct_correct_by_size"][stim_size] = \
+            float(success)/total_trials_for_size
+        result["pct_failure_by_size"][stim_size] = \
+            float(failure)/total_trials_for_size
+        result["pct_ignore_by_size"][stim_size] = \
+            float(ignore)/total_trials_for_size
+    return result
 
 def get_session_trials(animal_name, session_filename):
     '''
-    Returns a time-ordered list of dicts, where each dict is info about a trial.
-    e.g. [{"trial_num": 1,
-           "behavior_outcome": "failure",
-           "stm_size": 40.0,
-           },
-          {"trial_num": 2,
-           "behavior_outcome": "success",
-           "stm_size": 35.0
-           }]
+    Returns a time-ordered trial table, a NumPy structured array with one
+    record per trial (see trial_segmentation.make_trial_table()).
+    e.g. trials["trial_num"]: [1, 2]
+         trials["outcome"]: [FAILURE, SUCCESS]
+         trials["stm_size"]: [40.0, 35.0]
+         trials["start_time"]: [...]
+
+    Trials come from the on-disk cache (see trial_cache.py) unless the session
+    file changed since it was last extracted.
 
     :param animal_name: name of the animal string
     :param session_filename: filename for the session (string)
     '''
 
+    path = get_session_path(animal_name, session_filename)
+    return trial_cache.get_cached_trials(path, EVENT_NAMES,
+        "phase2-" + STIMULUS_JOIN, extract_session_trials)
+
+def get_session_path(animal_name, session_filename):
     #TODO: unfuck this: hard coded paths not ideal for code reuse
-    path = 'input/' + animal_name + '/' + session_filename
-
-    df = pymworks.open_file(path)
-    events = df.get_events([
-        "Announce_TrialStart",
-        "Announce_TrialEnd",
-        "success",
-        "failure",
-        "ignore",
-        "stm_size"]
-    )
-
-    trials = []
-    trial_num = 1
-    for index, event in enumerate(events):
-        if (event.name == "Announce_TrialStart" and
-        event.value == 1):
-            trial = {
-                "trial_num": trial_num,
-                "stm_size": None,
-                "behavior_outcome": None
-            }
+    return 'input/' + 'phase2/' + animal_name + '/' + session_filename
 
-            try:
-                if events[index - 1].name == "stm_size":
-                    trial["stm_size"] = events[index - 1].value
-            except IndexError:
-                print "stm_size out of range for session", session_filename, \
-                index
-            try:
-                if events[index + 1].name in ["success", "failure", "ignore"]:
-                    trial["behavior_outcome"] = events[index + 1].name
-            except IndexError:
-                print "beh_outcome out of range for session", session_filename,\
-                 index
-            if (trial["stm_size"] is not None and
-            trial["behavior_outcome"] is not None):
-                trials.append(trial)
-                trial_num += 1
-    return trials
+def iter_session_trials(animal_name, session_filename):
+    '''
+    Returns an iterator over a session's trials as dicts (like
+    trial_segmentation.iter_trials() yields), read straight from the .mwk file
+    without holding its events in memory or touching the cache.
+    get_stats_for_each_session() takes these in place of trial tables, e.g.
+        get_stats_for_each_session(animal_name, sessions,
+            [iter_session_trials(animal_name, s) for s in sessions])
+    '''
+    return stream_session_trials(get_session_path(animal_name,
+        session_filename), EVENT_NAMES)
+
+def stream_session_trials(path, event_names):
+    #same trials as extract_session_trials(), one at a time
+    events = session_events.iter_session_events(path, event_names)
+    return trial_segmentation.iter_trials_at_starts(events, event_names,
+        TRIAL_VARIABLES,
+        join=STIMULUS_JOIN, lookback=1)
+
+def extract_session_trials(path, event_names):
+    '''
+    Reads a session's events (see session_events.py) and returns its trials
+    (see get_session_trials() for the format). get_session_trials() only
+    calls this when there are no cached trials for the session.
+
+    :param path: path to the .mwk session file (string)
+    :param event_names: list of event names to read from the session
+    '''
+    if session_events.should_stream(path):
+        #too big to hold all of its events at once
+        return trial_segmentation.trials_to_table(
+            stream_session_trials(path, event_names), TRIAL_VARIABLES.values())
+    columns = session_events.get_session_columns(path, event_names)
+    return trial_segmentation.segment_trials_at_starts(columns, event_names,
+        TRIAL_VARIABLES, join=STIMULUS_JOIN, lookback=1)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Analyze phase 2 sessions in input/phase2")
+    parser.add_argument("--seed", type=int, default=None,
+        help="master seed for the bootstrap; the same seed gives identical "
+        "error bars whatever the number of processes")
+    parser.add_argument("--iterations", type=int,
+        default=BOOTSTRAP_ITERATIONS,
+        help="bootstrap iterations per bin and stim size, the maximum with "
+        "--tolerance (default: %(default)s)")
+    parser.add_argument("--tolerance", type=float,
+        default=BOOTSTRAP_TOLERANCE,
+        help="adaptive bootstrap: resample each cell in batches until its "
+        "std devs change by less than this fraction, e.g. 0.01")
+    parser.add_argument("--error-model", choices=bootstrap.ERROR_MODELS,
+        default=ERROR_MODEL,
+        help="bootstrap error bars, closed form (analytic) ones, or both "
+        "with a comparison printed (validate) (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=None,
+        help="number of worker processes (default: one per CPU core)")
+    parser.add_argument("--incremental", action="store_true",
+        help="only analyze sessions added or changed since the last "
+        "--incremental run and reuse everything else from it")
+    parser.add_argument("--save-figures", nargs="+", metavar="FORMAT",
+        choices=figure_output.FORMATS,
+        help="save figures in these formats (%s) under output/phase2 "
+        "instead of showing them" % ", ".join(figure_output.FORMATS))
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if args.iterations < 1:
+        parser.error("--iterations has to be at least 1")
+    instrumentation.configure(args.report, args.profile)
+
     animals_and_sessions = get_animals_and_their_session_filenames('input/phase2')
-    analyze_sessions(animals_and_sessions, graph_summary_stats=True)
\ No newline at end of file
+    analyze_sessions(animals_and_sessions, graph_summary_stats=True,
+        seed=args.seed, iterations=args.iterations, processes=args.processes,
+        tolerance=args.tolerance, error_model=args.error_model,
+        incremental=args.incremental, figure_formats=args.save_figures)
+    instrumentation.write_report()
\ No newline at end of file
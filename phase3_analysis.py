@@ -1,56 +1,101 @@
-import os
-import multiprocessing
+import argparse
 import math
-import pymworks
-import matplotlib.pyplot as plt
+import numpy as np
+import trial_cache
+import trial_segmentation
+import session_events
+import session_pool
+import session_discovery
+import figure_output
+import instrumentation
+import bootstrap
+
+#events needed to build phase 3 trials
+EVENT_NAMES = [
+    "Announce_TrialStart",
+    "Announce_TrialEnd",
+    "success",
+    "failure",
+    "ignore",
+    "stm_size",
+    "stm_rotation_in_depth"
+]
+
+#event names read into each trial and the trial table column each goes in
+TRIAL_VARIABLES = {
+    "stm_size": "stm_size",
+    "stm_rotation_in_depth": "stm_rotation"
+}
+
+#how stm_size and stm_rotation_in_depth are matched to trial starts, "asof" or
+#"neighbors" (see trial_segmentation.segment_trials_at_starts())
+STIMULUS_JOIN = "asof"
+
+#how error bars on percent correct are computed, one of
+#bootstrap.ERROR_MODELS (see phase2_analysis.py). The closed form by default
+#so exploring stays quick, --error-model bootstrap for final figures.
+ERROR_MODEL = "analytic"
+
+#bootstrap iterations per cell with error_model "bootstrap" or "validate"
+BOOTSTRAP_ITERATIONS = 10000
+
+#what get_summary_stats_data() uses of each animal's get_data_for_figure()
+#result, kept for every animal while the rest is let go once it's plotted
+SUMMARY_KEYS = ["rotations", "pct_corrects", "total_trials",
+    "size_40_pct_correct", "nth_time_seen_data"]
 
 def get_animals_and_their_session_filenames(path):
     '''
     Returns a dict with animal names as keys (it gets their names from the
         folder names in 'input' folder--each animal should have its own
         folder with .mwk session files) and a list of .mwk filename strings as
-        values.
+        values, oldest session first (see session_discovery.py).
             e.g. {'V1': ['V1_140501.mwk', 'V1_140502.mwk']}
 
     :param path: a string of the directory name containing animals' folders
     '''
-    #TODO maybe make this better, it's slow as hell and ugly
-    result = {}
-    dirs_list = [each for each in os.walk(path)]
-    for each in dirs_list[1:]:
-        files_list = each[2]
-        animal_name = each[0].split("/")[len(each[0].split("/")) - 1]
-        result[animal_name] = [] #list of filenames
-        for filename in files_list:
-            if not filename.startswith('.'): #dont want hidden files
-                result[animal_name].append(filename)
+    result = session_discovery.get_animals_and_their_session_filenames(path)
     return result
 
-def analyze_sessions(animals_and_sessions, graph_summary_stats=False):
+def analyze_sessions(animals_and_sessions, graph_summary_stats=False,
+    error_model=ERROR_MODEL, figure_formats=None):
     '''
     Use the multiprocessing module to analyze sessions from multiple animals in
     parallel. Add stats from each animal (a dict, the result of
     get_data_for_figure()) to the all_data list for further processing (i.e.
     get_summary_stats_data()).
-    '''
-    pool = multiprocessing.Pool(None)
-    results = []
-    for animal, sessions in animals_and_sessions.iteritems():
-        result = pool.apply_async(get_data_for_figure,
-            args=(animal, sessions))
-        results.append(result)
-    pool.close()
-    pool.join()
 
-    all_data = []
-    for each in results:
-        data_for_animal = each.get() #returns result of get_data_for_figure()
-        all_data.append(data_for_animal) #need this to stay around for summary statistics
-        make_a_figure(data_for_animal) #make a figure with data for this animal
+    @param error_model: how error bars on percent correct are computed (see
+        ERROR_MODEL)
+    @param figure_formats: None to show figures, or a list of formats (see
+        figure_output.FORMATS) to save them in under output/phase3 instead
+    '''
+    pool = session_pool.start_pool()
+    #read every session as its own task so an animal with lots of sessions
+    #doesn't keep one core busy while the rest sit idle, get each animal's
+    #data as soon as its sessions are read, make its figure as soon as that's
+    #ready (see session_pool.map_animals()) and only keep what the summary
+    #needs
+    summary_data = {} #animal name -> SUMMARY_KEYS of its data
+    figures = [] #multiprocessing.AsyncResult objects for saved figures
+    for animal, data_for_animal in session_pool.map_animals(pool,
+    animals_and_sessions, get_session_trials, get_data_for_figure,
+    get_session_path, (error_model,)):
+        figures.append(figure_output.start_figure(make_a_figure,
+            (data_for_animal,), "phase3", animal, figure_formats,
+            pool)) #a figure with data for this animal
+        summary_data[animal] = dict((key, data_for_animal[key]) for key in
+            SUMMARY_KEYS)
 
     if graph_summary_stats:
+        #same animal order as always
+        all_data = [summary_data[animal] for animal in animals_and_sessions]
         data = get_summary_stats_data(all_data) #process all animal data
-        make_summary_stats_figure(data) #make plots with processed summary stats
+        figures.append(figure_output.start_figure(make_summary_stats_figure,
+            (data,), "phase3", None, figure_formats, pool)) #plots with processed summary stats
+    pool.close()
+    figure_output.wait_for_figures(figures)
+    pool.join()
 
 def make_summary_stats_figure(data):
     '''
@@ -58,6 +103,7 @@ def make_summary_stats_figure(data):
 
     @param data: a dict with all our summary stats data, from get_summary_stats_data()
     '''
+    import matplotlib.pyplot as plt #only when drawing, see figure_output.py
 
     plt.close('all')
 
@@ -108,7 +154,7 @@ def make_summary_stats_figure(data):
     ax_arr[1].set_ylabel("Sample size (total trials) +/- SSD")
     ax_arr[1].set_xlabel("Stimulus rotation in depth (degrees)")
 
-    plt.show()
+    figure_output.show("summary_pct_correct_std_dev")
 
     std_errors_performance = [sd/math.sqrt(len(data["std_devs"])) for sd in data["std_devs"]]
     std_errors_samplesize = [sd/math.sqrt(len(data["sample_size_data"]["std_devs_num_trials"])) for sd in data["sample_size_data"]["std_devs_num_trials"]]
@@ -178,7 +224,7 @@ def make_summary_stats_figure(data):
     ax_arr[1].set_ylabel("Sample size (total trials) +/- SEM")
     ax_arr[1].set_xlabel("Stimulus rotation in depth (degrees)")
 
-    plt.show()
+    figure_output.show("summary_pct_correct_sem")
     plt.close('all')
 
     plt.plot(
@@ -200,7 +246,7 @@ def make_summary_stats_figure(data):
     plt.grid(axis="y")
     plt.ylabel("Performance (% correct)")
 
-    plt.show()
+    figure_output.show("summary_performance_by_novelty")
 
 def get_summary_stats_data(all_data):
     '''
@@ -320,6 +366,7 @@ def make_a_figure(data_for_animal):
     Makes graphs with data from each INDIVIDUAL animal. data_for_animal is a dict--
     the result from get_data_for_figure()--see that documentation for more info
     '''
+    import matplotlib.pyplot as plt #only when drawing, see figure_output.py
     plt.close('all')
 
     #this looks long and complicated, but it's basically just making
@@ -327,10 +374,11 @@ def make_a_figure(data_for_animal):
     f, ax_arr = plt.subplots(2, 1)
     f.suptitle(data_for_animal["animal_name"] + " phase 3 performance (all stimuli 30 deg. visual angle size)")
 
-    ax_arr[0].plot(
+    ax_arr[0].errorbar(
         data_for_animal["rotations"],
         data_for_animal["pct_corrects"],
-        "-o",
+        yerr=data_for_animal["pct_correct_std_devs"],
+        fmt="-o",
         color="turquoise",
         linewidth=3.0,
     )
@@ -368,7 +416,7 @@ def make_a_figure(data_for_animal):
     ax_arr[1].set_xlabel("Stimulus rotation in depth (degrees)")
     ax_arr[1].set_ylabel("Sample size (total trials)")
 
-    plt.show()
+    figure_output.show("pct_correct_by_rotation")
     plt.close('all')
 
     plt.fill_between(
@@ -387,7 +435,7 @@ def make_a_figure(data_for_animal):
     plt.ylabel("Range of rotations tested")
     plt.title(data_for_animal["animal_name"] + " rotation progress over time")
 
-    plt.show()
+    figure_output.show("rotation_progress")
     plt.close('all')
 
     plt.plot(
@@ -404,20 +452,29 @@ def make_a_figure(data_for_animal):
     plt.xlabel("nth time seen")
     plt.ylabel("Performance (% correct)")
 
-    plt.show()
+    figure_output.show("performance_by_novelty")
 
-def get_data_for_figure(animal_name, sessions):
+@instrumentation.timed("aggregation")
+def get_data_for_figure(animal_name, sessions, session_trials=None,
+    error_model=ERROR_MODEL):
     '''
     Returns a dict with data for one animal.
 
     @param animal_name: a string
     @param sessions: a list of filename strings
+    @param session_trials: optional list with the result of get_session_trials()
+        for each session, if they were already read
+    @param error_model: how error bars on percent correct are computed (see
+        ERROR_MODEL)
     '''
-    all_trials = get_trials_from_all_sessions(animal_name, sessions) #list of trial dicts
-    all_size_30 = get_size_30_trial_results(all_trials) #list of all trial dicts where stm_size was 30.0
+    all_trials = get_trials_from_all_sessions(animal_name, sessions,
+        session_trials) #trial table
+    all_size_30 = get_size_30_trial_results(all_trials) #outcome codes of the size 30 trials by rotation
     rotations, pct_corrects, totals = get_stats_for_each_rotation(all_size_30) #returns 3 lists with rotation floats, performance floats, and sample size ints
+    pct_correct_std_devs = get_pct_correct_std_devs(all_size_30, rotations,
+        error_model) #error bars for pct_corrects
     progress_data = get_progress_over_time(all_trials) #returns a dict with data about the range of rotations tested over time
-    all_size_40 = get_size_40_outcomes(all_trials) ##list of all trial dicts where stm_size was 40.0
+    all_size_40 = get_size_40_outcomes(all_trials) #outcome codes of the size 40 trials
     pct_correct_40 = get_pct_correct_at_size_40(all_size_40) #returns a float for percent correct at size 40.0
     nth_time_seen, nth_performance = get_performance_by_nth_time_seen(all_trials) #not finished, basically ignore this
 
@@ -426,6 +483,7 @@ def get_data_for_figure(animal_name, sessions):
         "animal_name": animal_name,
         "rotations": rotations,
         "pct_corrects": pct_corrects,
+        "pct_correct_std_devs": pct_correct_std_devs,
         "total_trials": totals,
         "progress_graph_data": progress_data,
         "size_40_pct_correct": pct_correct_40,
@@ -442,68 +500,37 @@ def get_performance_by_nth_time_seen(all_trials):
     as a function of the number of times each rotation has been presented (x axis).
     See Zoccolan 2009 Fig. 3B to get the idea.
     '''
-    tmp = {} #keys=rotation float values=list of behavior_outcome events in order of appearance
-    for trial in all_trials:
-        if trial["stm_size"] == 30.0:
-            try:
-                tmp[trial["stm_rotation"]].append(trial["behavior_outcome"])
-            except KeyError:
-                tmp[trial["stm_rotation"]] = [trial["behavior_outcome"]]
-    nth_outcomes = []
-    for rotation, outcomes in tmp.iteritems():
-        nth_outcomes.append(outcomes)
-    nth_outcomes = zip(*nth_outcomes)
-
-    nth_time_seen = []
-    nth_performance = []
-    for index, outcome_list in enumerate(nth_outcomes):
-        success = 0
-        failure = 0
-        ignore = 0
-        for outcome in outcome_list:
-            if outcome == "success":
-                success += 1
-            elif outcome == "failure":
-                failure += 1
-            elif outcome == "ignore":
-                ignore += 1
-            else:
-                print "get_performance_by_nth_time_seen() FAIL"
-        try:
-            pct = ((float(success))/(float(success + failure + ignore))) * 100
-        except ZeroDivisionError:
-            pct = None
-        nth_time_seen.append(index + 1)
-        nth_performance.append(pct)
-    return nth_time_seen, nth_performance
+    #outcome codes of each rotation's size 30 trials, in order of appearance
+    size_30 = all_trials[all_trials["stm_size"] == 30.0]
+    nth_outcomes = trial_segmentation.group_outcomes(size_30,
+        "stm_rotation").values()
+    if not nth_outcomes:
+        return [], []
+    #row n: the nth outcome of every rotation, as far as all of them got
+    num_seen = min(len(outcomes) for outcomes in nth_outcomes)
+    nth_outcomes = np.array([outcomes[:num_seen] for outcomes in
+        nth_outcomes]).T
+
+    nth_time_seen = range(1, num_seen + 1)
+    successes = (nth_outcomes == trial_segmentation.SUCCESS).sum(axis=1)
+    nth_performance = ((successes.astype(np.float64))/
+        (float(nth_outcomes.shape[1]))) * 100
+    return nth_time_seen, nth_performance.tolist()
 
 def get_size_40_outcomes(all_trials):
-    result = []
-    for trial in all_trials:
-        if trial["stm_size"] == 40.0:
-            result.append(trial["behavior_outcome"])
-    return result
+    #outcome codes of the size 40 trials
+    return all_trials["outcome"][all_trials["stm_size"] == 40.0]
 
 def get_pct_correct_at_size_40(behavior_outcome_list):
     '''
     Use this to get performance for size 40 (default) stimuli during presentation
     of stimuli in the "cross."
 
-    @param behavior_outcome_list: a list of dicts where the dicts look like those from
-        get_session_trials()
+    @param behavior_outcome_list: an array of outcome codes, e.g. from
+        get_size_40_outcomes()
     '''
-    success = 0
-    failure = 0
-    ignore = 0
-    for behavior in behavior_outcome_list:
-        if behavior == "success":
-            success += 1
-        elif behavior == "failure":
-            failure += 1
-        elif behavior == "ignore":
-            ignore += 1
-        else:
-            print "something's wrong, yo. check out get_pct_correct_at_size_40()"
+    success, failure, ignore = \
+        trial_segmentation.count_outcomes(behavior_outcome_list)
 
     total_trials = success + failure + ignore
     try:
@@ -519,29 +546,19 @@ def get_progress_over_time(all_trials, trials_per_bin=50):
     decide when to switch rotation in depth direction (i.e. change direction when the
     animal reaches max rotation to the right or left).
 
-    @param all_trials: a list of dicts where the dicts look like those from get_session_trials()
+    @param all_trials: a trial table like the ones from get_session_trials()
     '''
-    num_trials_range = []
-    max_rotation_right_in_range = []
-    max_rotation_left_in_range = []
-
-    num_trials = trials_per_bin
-    tmp_trials_list = []
-    for trial in all_trials:
-        if trial["stm_size"] == 30.0:
-            if len(tmp_trials_list) == trials_per_bin:
-                rots = [t["stm_rotation"] for t in tmp_trials_list]
-                max_right = max(rots)
-                max_left = min(rots)
-
-                num_trials_range.append(num_trials)
-                max_rotation_right_in_range.append(max_right)
-                max_rotation_left_in_range.append(max_left)
-
-                tmp_trials_list = [trial]
-                num_trials += trials_per_bin
-            else:
-                tmp_trials_list.append(trial)
+    #every full bin of trials_per_bin size 30 trials, except that the last
+    #one only counts once a trial after it came along
+    rotations = all_trials["stm_rotation"][all_trials["stm_size"] == 30.0]
+    num_bins = max(len(rotations) - 1, 0) // trials_per_bin
+    bins = rotations[:num_bins * trials_per_bin].reshape(num_bins,
+        trials_per_bin)
+
+    num_trials_range = range(trials_per_bin, (num_bins + 1) * trials_per_bin,
+        trials_per_bin)
+    max_rotation_right_in_range = bins.max(axis=1).tolist()
+    max_rotation_left_in_range = bins.min(axis=1).tolist()
 
     return {
         "x": num_trials_range,
@@ -555,25 +572,15 @@ def get_stats_for_each_rotation(all_size_30_trials):
     Returns 3 lists. A list of rotations, a list of performance at those rotations,
     and a list of the sample size at those rotations.
 
-    @param all_size_30_trials: a list of trial dicts (trials dicts look like the ones
-        in the documentation for get_session_trials())
+    @param all_size_30_trials: a dict with rotation keys and arrays of outcome
+        codes as values, from get_size_30_trial_results()
     '''
     rotations = []
     pct_corrects = []
     total_trials = []
     for rotation, behavior_list in all_size_30_trials.iteritems():
-        success = 0
-        failure = 0
-        ignore = 0
-        for behavior in behavior_list:
-            if behavior == "success":
-                success += 1
-            elif behavior == "failure":
-                failure += 1
-            elif behavior == "ignore":
-                ignore += 1
-            else:
-                print "unknown behavior"
+        success, failure, ignore = \
+            trial_segmentation.count_outcomes(behavior_list)
         try:
             pct_correct = ((float(success))/(float(success + failure + ignore))) * 100
             total = success + failure + ignore
@@ -587,107 +594,108 @@ def get_stats_for_each_rotation(all_size_30_trials):
     rotations, pct_corrects, total_trials = zip(*xyz)
     return rotations, pct_corrects, total_trials
 
+def get_pct_correct_std_devs(outcomes_by_rotation, rotations,
+    error_model=ERROR_MODEL):
+    '''
+    Returns a list with the std dev of percent correct at each rotation in
+    rotations, computed the way error_model says (see
+    bootstrap.get_std_devs()).
+
+    @param outcomes_by_rotation: result of get_size_30_trial_results()
+    @param rotations: list of rotations, e.g. from get_stats_for_each_rotation()
+    '''
+    counts = [trial_segmentation.count_outcomes(outcomes_by_rotation[rotation])
+        for rotation in rotations]
+    std_devs = bootstrap.get_std_devs(counts, error_model,
+        BOOTSTRAP_ITERATIONS, ["pct_correct"]) #(std devs, iterations drawn)
+    return [std_devs[each][0]["pct_correct"] for each in counts]
+
 def get_size_30_trial_results(all_trials):
     '''
-    Returns a dict with stim rotation keys and a list of behavior_outcome
+    Returns a dict with stim rotation keys and an array of outcome codes
     as values. Returns only size 30 results because only this size can
     rotate in phase 3.
     '''
-    result = {}
-    for trial in all_trials:
-        if trial["stm_size"] == 30.0:
-            try:
-                result[trial["stm_rotation"]].append(trial["behavior_outcome"])
-            except KeyError:
-                result[trial["stm_rotation"]] = [trial["behavior_outcome"]]
-    return result
+    return trial_segmentation.group_outcomes(
+        all_trials[all_trials["stm_size"] == 30.0], "stm_rotation")
 
-def get_trials_from_all_sessions(animal_name, sessions):
+def get_trials_from_all_sessions(animal_name, sessions, session_trials=None):
+    '''
+    Returns one trial table with the trials from all of an animal's sessions.
+
+    @param session_trials: optional list with the result of get_session_trials()
+        for each session, if they were already read (e.g. by analyze_sessions())
+    '''
     print "Starting analysis for ", animal_name
-    all_trials_all_sessions = []
-    for session in sessions:
-        trials = get_session_trials(animal_name, session)
-        all_trials_all_sessions += trials
-    return all_trials_all_sessions
+    if session_trials is None:
+        session_trials = [get_session_trials(animal_name, session) for
+            session in sessions]
+    return trial_segmentation.concatenate_tables(session_trials,
+        TRIAL_VARIABLES.values())
 
 def get_session_trials(animal_name, session_filename):
     '''
-    Returns a time-ordered list of dicts, where each dict is info about a trial.
-    e.g. [{"trial_num": 1,
-           "behavior_outcome": "failure",
-           "stm_size": 40.0,
-           "stm_rotation": 0.0
-           },
-          {"trial_num": 2,
-           "behavior_outcome": "success",
-           "stm_size": 30.0,
-           "stm_rotation": 15.0
-           }]
+    Returns a time-ordered trial table, a NumPy structured array with one
+    record per trial (see trial_segmentation.make_trial_table()).
+    e.g. trials["trial_num"]: [1, 2]
+         trials["outcome"]: [FAILURE, SUCCESS]
+         trials["stm_size"]: [40.0, 30.0]
+         trials["stm_rotation"]: [0.0, 15.0]
+         trials["start_time"]: [...]
+
+    Trials come from the on-disk cache (see trial_cache.py) unless the session
+    file changed since it was last extracted.
 
     :param animal_name: name of the animal string
     :param session_filename: filename for the session (string)
     '''
 
+    path = get_session_path(animal_name, session_filename)
+    return trial_cache.get_cached_trials(path, EVENT_NAMES,
+        "phase3-" + STIMULUS_JOIN, extract_session_trials)
+
+def get_session_path(animal_name, session_filename):
     #TODO: unfuck this: hard coded paths not ideal for code reuse
-    path = 'input/' + 'phase3/' + animal_name + '/' + session_filename
-
-    df = pymworks.open_file(path)
-    events = df.get_events([
-        "Announce_TrialStart",
-        "Announce_TrialEnd",
-        "success",
-        "failure",
-        "ignore",
-        "stm_size",
-        "stm_rotation_in_depth"]
-    )
+    return 'input/' + 'phase3/' + animal_name + '/' + session_filename
 
-    trials = []
-    trial_num = 1
-    for index, event in enumerate(events):
-        if (event.name == "Announce_TrialStart" and
-        event.value == 1):
-            trial = {
-                "trial_num": trial_num,
-                "stm_size": None,
-                "behavior_outcome": None,
-                "stm_rotation": None
-            }
+def extract_session_trials(path, event_names):
+    '''
+    Reads a session's events (see session_events.py) and returns its trials
+    (see get_session_trials() for the format). get_session_trials() only
+    calls this when there are no cached trials for the session.
 
-            try:
-                if events[index - 1].name == "stm_size":
-                    trial["stm_size"] = events[index - 1].value
-            except IndexError:
-                print "stm_size out of range for session", session_filename, \
-                index
-            try:
-                if events[index - 1].name == "stm_rotation_in_depth":
-                    trial["stm_rotation"] = float(events[index - 1].value)
-            except IndexError:
-                print "stm_rotation_in_depth out of range for session", session_filename, index
-            try:
-                if events[index - 2].name == "stm_size":
-                    trial["stm_size"] = events[index - 2].value
-            except IndexError:
-                print "stm_size out of range for session", session_filename, index
-            try:
-                if events[index - 2].name == "stm_rotation_in_depth":
-                    trial["stm_rotation"] = float(events[index - 2].value)
-            except IndexError:
-                print "stm_rotation_in_depth out of range for session", session_filename, index
-            try:
-                if events[index + 1].name in ["success", "failure", "ignore"]:
-                    trial["behavior_outcome"] = events[index + 1].name
-            except IndexError:
-                print "beh_outcome out of range for session", session_filename,\
-                 index
-            if (trial["stm_size"] is not None and
-            trial["behavior_outcome"] is not None and
-            trial["stm_rotation"] is not None):
-                trials.append(trial)
-                trial_num += 1
-    return trials
+    :param path: path to the .mwk session file (string)
+    :param event_names: list of event names to read from the session
+    '''
+    if session_events.should_stream(path):
+        #too big to hold all of its events at once, build the trials as the
+        #events go by
+        events = session_events.iter_session_events(path, event_names)
+        return trial_segmentation.trials_to_table(
+            trial_segmentation.iter_trials_at_starts(events, event_names,
+                TRIAL_VARIABLES, join=STIMULUS_JOIN, lookback=2),
+            TRIAL_VARIABLES.values())
+    columns = session_events.get_session_columns(path, event_names)
+    return trial_segmentation.segment_trials_at_starts(columns, event_names,
+        TRIAL_VARIABLES, join=STIMULUS_JOIN, lookback=2)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Analyze phase 3 sessions in input/phase3")
+    parser.add_argument("--error-model", choices=bootstrap.ERROR_MODELS,
+        default=ERROR_MODEL,
+        help="closed form (analytic) error bars, bootstrap ones (e.g. for "
+        "final figures), or both with a comparison printed (validate) "
+        "(default: %(default)s)")
+    parser.add_argument("--save-figures", nargs="+", metavar="FORMAT",
+        choices=figure_output.FORMATS,
+        help="save figures in these formats (%s) under output/phase3 "
+        "instead of showing them" % ", ".join(figure_output.FORMATS))
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args.report, args.profile)
+
     animals_and_sessions = get_animals_and_their_session_filenames("input/phase3")
-    analyze_sessions(animals_and_sessions, graph_summary_stats=True)
\ No newline at end of file
+    analyze_sessions(animals_and_sessions, graph_summary_stats=True,
+        error_model=args.error_model, figure_formats=args.save_figures)
+    instrumentation.write_report()
\ No newline at end of file
@@ -1,65 +1,103 @@
-import os
-import multiprocessing
+import argparse
 import math
-import pymworks
-import matplotlib.pyplot as plt
 import numpy as np
+import trial_cache
+import trial_segmentation
+import session_events
+import session_pool
+import session_discovery
+import figure_output
+import instrumentation
+import bootstrap
+
+#events needed to build phase 4 trials
+EVENT_NAMES = [
+    "Announce_TrialStart",
+    "Announce_TrialEnd",
+    "success",
+    "failure",
+    "ignore",
+    "stm_size",
+    "stm_rotation_in_depth"
+]
+
+#event names read into each trial and the trial table column each goes in
+TRIAL_VARIABLES = {
+    "stm_size": "stm_size",
+    "stm_rotation_in_depth": "stm_rotation"
+}
+
+#how stm_size and stm_rotation_in_depth are matched to trial starts, "asof" or
+#"neighbors" (see trial_segmentation.segment_trials_at_starts())
+STIMULUS_JOIN = "asof"
+
+#how error bars on percent correct are computed, one of
+#bootstrap.ERROR_MODELS (see phase2_analysis.py). The closed form by default
+#so exploring stays quick, --error-model bootstrap for final figures.
+ERROR_MODEL = "analytic"
+
+#bootstrap iterations per cell with error_model "bootstrap" or "validate"
+BOOTSTRAP_ITERATIONS = 10000
+
+#what get_summary_stats_data() uses of each animal's get_data_for_figure()
+#result (see phase3_analysis.py)
+SUMMARY_KEYS = ["pct_correct_data"]
 
 def get_animals_and_their_session_filenames(path):
     '''
     Returns a dict with animal names as keys (it gets their names from the
         folder names in 'input' folder--each animal should have its own
         folder with .mwk session files) and a list of .mwk filename strings as
-        values.
+        values, oldest session first (see session_discovery.py).
             e.g. {'V1': ['V1_140501.mwk', 'V1_140502.mwk']}
 
     :param path: a string of the directory name containing animals' folders
     '''
-    #TODO maybe make this better, it's slow as hell and ugly
-    result = {}
-    dirs_list = [each for each in os.walk(path)]
-    for each in dirs_list[1:]:
-        files_list = each[2]
-        animal_name = each[0].split("/")[len(each[0].split("/")) - 1]
-        result[animal_name] = [] #list of filenames
-        for filename in files_list:
-            if not filename.startswith('.'): #dont want hidden files
-                result[animal_name].append(filename)
+    result = session_discovery.get_animals_and_their_session_filenames(path)
     return result
 
-def analyze_sessions(animals_and_sessions, graph_summary_stats=False):
+def analyze_sessions(animals_and_sessions, graph_summary_stats=False,
+    error_model=ERROR_MODEL, figure_formats=None):
     '''
     This is basically the same as the eponymous function in phase3_analysis.py;
     see documentation there.
     '''
-    pool = multiprocessing.Pool(None)
-    results = []
-    for animal, sessions in animals_and_sessions.iteritems():
-        result = pool.apply_async(get_data_for_figure,
-            args=(animal, sessions))
-        results.append(result)
-    pool.close()
-    pool.join()
-
-    all_data = []
-    for each in results:
-        data_for_animal = each.get()
-        all_data.append(data_for_animal)
-        make_a_figure(data_for_animal)
+    pool = session_pool.start_pool()
+    summary_data = {} #animal name -> SUMMARY_KEYS of its data
+    figures = []
+    for animal, data_for_animal in session_pool.map_animals(pool,
+    animals_and_sessions, get_session_trials, get_data_for_figure,
+    get_session_path, (error_model,)):
+        figures.append(figure_output.start_figure(make_a_figure,
+            (data_for_animal,), "phase4", animal, figure_formats, pool))
+        summary_data[animal] = dict((key, data_for_animal[key]) for key in
+            SUMMARY_KEYS)
 
     if graph_summary_stats:
+        all_data = [summary_data[animal] for animal in animals_and_sessions]
         data = get_summary_stats_data(all_data)
-        make_summary_stats_figure(data)
+        figures.append(figure_output.start_figure(make_summary_stats_figure,
+            (data,), "phase4", None, figure_formats, pool))
+    pool.close()
+    figure_output.wait_for_figures(figures)
+    pool.join()
 
-def get_data_for_figure(animal_name, sessions):
-    all_trials = get_trials_from_all_sessions(animal_name, sessions)
-    #make a dict where keys are (size, rotation) tuples and vals are a list of "success", "failure", or "ignore" strings
+@instrumentation.timed("aggregation")
+def get_data_for_figure(animal_name, sessions, session_trials=None,
+    error_model=ERROR_MODEL):
+    all_trials = get_trials_from_all_sessions(animal_name, sessions,
+        session_trials)
+    #make a dict where keys are (size, rotation) tuples and vals are arrays of outcome codes (see trial_segmentation.OUTCOMES)
     trial_outcomes = make_list_of_behavior_outcomes_for_size_rot_grid(all_trials)
     pct_correct_data = get_pct_correct_for_animal(trial_outcomes)
+    #same keys, std dev of percent correct as values
+    pct_correct_std_devs = get_pct_correct_std_devs(trial_outcomes,
+        error_model)
 
     return {
         "animal_name": animal_name,
-        "pct_correct_data": pct_correct_data
+        "pct_correct_data": pct_correct_data,
+        "pct_correct_std_devs": pct_correct_std_devs
     }
 def get_summary_stats_data(list_of_animal_data):
     #sum up all the data then divide by the sample size (number of animals) to get average
@@ -77,6 +115,7 @@ def get_summary_stats_data(list_of_animal_data):
     return result
 
 def make_summary_stats_figure(data_for_all_animals):
+    import matplotlib.pyplot as plt #only when drawing, see figure_output.py
     x = [-60.0, -45.0, -30.0, -15.0, 0.0, 15.0, 30.0, 45.0, 60.0, 75.0] #rotations
     y = [15.0, 20.0, 25.0, 30.0, 35.0, 40.0, 45.0] #sizes
     X, Y = np.meshgrid(x, y)
@@ -130,9 +169,10 @@ def make_summary_stats_figure(data_for_all_animals):
     plt.title("All animals phase 4 performance")
     plt.xlabel("Stimulus rotation in depth (degrees)")
     plt.ylabel("Stimulus size (degrees visual angle)")
-    plt.show()
+    figure_output.show("summary_pct_correct_grid")
 
 def make_a_figure(data_for_animal):
+    import matplotlib.pyplot as plt #only when drawing, see figure_output.py
     x = [-60.0, -45.0, -30.0, -15.0, 0.0, 15.0, 30.0, 45.0, 60.0, 75.0] #rotations
     y = [15.0, 20.0, 25.0, 30.0, 35.0, 40.0, 45.0] #sizes
     X, Y = np.meshgrid(x, y)
@@ -186,7 +226,7 @@ def make_a_figure(data_for_animal):
     plt.title(data_for_animal["animal_name"] + " phase 4 performance")
     plt.xlabel("Stimulus rotation in depth (degrees)")
     plt.ylabel("Stimulus size (degrees visual angle)")
-    plt.show()
+    figure_output.show("pct_correct_grid")
 
 def get_pct_correct_for_animal(trial_outcomes):
     result = {}
@@ -195,117 +235,106 @@ def get_pct_correct_for_animal(trial_outcomes):
         result[(size, rotation)] = pct_correct
     return result
 
+def get_pct_correct_std_devs(trial_outcomes, error_model=ERROR_MODEL):
+    '''
+    Returns a dict with (size, rotation) tuples as keys and the std dev of
+    percent correct for that grid cell as values, computed the way
+    error_model says (see bootstrap.get_std_devs()).
+    '''
+    counts = dict((key, trial_segmentation.count_outcomes(outcome_list)) for
+        key, outcome_list in trial_outcomes.iteritems())
+    std_devs = bootstrap.get_std_devs(counts.values(), error_model,
+        BOOTSTRAP_ITERATIONS, ["pct_correct"]) #(std devs, iterations drawn)
+    return dict((key, std_devs[each][0]["pct_correct"]) for key, each in
+        counts.iteritems())
+
 def get_pct_correct_from_outcome_list(outcome_list):
-    success = 0
-    failure = 0
-    ignore = 0
-    for outcome in outcome_list:
-        if outcome == "success":
-            success += 1
-        elif outcome == "failure":
-            failure += 1
-        elif outcome == "ignore":
-            ignore += 1
-        else:
-            pass
+    success, failure, ignore = trial_segmentation.count_outcomes(outcome_list)
     total_trials = success + failure + ignore
     pct_correct = (float(success)/float(total_trials)) * 100
     return pct_correct
 
 def make_list_of_behavior_outcomes_for_size_rot_grid(all_trials):
-    sizes_and_rotations = {}
-    for trial in all_trials:
-        try:
-            sizes_and_rotations[(trial["stm_size"], trial["stm_rotation"])].append(trial["behavior_outcome"])
-        except KeyError:
-            sizes_and_rotations[(trial["stm_size"], trial["stm_rotation"])] = [trial["behavior_outcome"]]
-    return sizes_and_rotations
-
-def get_trials_from_all_sessions(animal_name, sessions):
+    return trial_segmentation.group_outcomes(all_trials,
+        ["stm_size", "stm_rotation"])
+
+def get_trials_from_all_sessions(animal_name, sessions, session_trials=None):
+    '''
+    Returns one trial table with the trials from all of an animal's sessions.
+
+    @param session_trials: optional list with the result of get_session_trials()
+        for each session, if they were already read (e.g. by analyze_sessions())
+    '''
     print "Starting analysis for ", animal_name
-    all_trials_all_sessions = []
-    for session in sessions:
-        trials = get_session_trials(animal_name, session)
-        all_trials_all_sessions += trials
-    return all_trials_all_sessions
+    if session_trials is None:
+        session_trials = [get_session_trials(animal_name, session) for
+            session in sessions]
+    return trial_segmentation.concatenate_tables(session_trials,
+        TRIAL_VARIABLES.values())
 
 def get_session_trials(animal_name, session_filename):
     '''
-    Returns a time-ordered list of dicts, where each dict is info about a trial.
-    e.g. [{"trial_num": 1,
-           "behavior_outcome": "failure",
-           "stm_size": 40.0,
-           },
-          {"trial_num": 2,
-           "behavior_outcome": "success",
-           "stm_size": 35.0
-           }]
+    Returns a time-ordered trial table, a NumPy structured array with one
+    record per trial (see trial_segmentation.make_trial_table()).
+    e.g. trials["trial_num"]: [1, 2]
+         trials["outcome"]: [FAILURE, SUCCESS]
+         trials["stm_size"]: [40.0, 30.0]
+         trials["stm_rotation"]: [0.0, 15.0]
+         trials["start_time"]: [...]
+
+    Trials come from the on-disk cache (see trial_cache.py) unless the session
+    file changed since it was last extracted.
 
     :param animal_name: name of the animal string
     :param session_filename: filename for the session (string)
     '''
 
+    path = get_session_path(animal_name, session_filename)
+    return trial_cache.get_cached_trials(path, EVENT_NAMES,
+        "phase4-" + STIMULUS_JOIN, extract_session_trials)
+
+def get_session_path(animal_name, session_filename):
     #TODO: unfuck this: hard coded paths not ideal for code reuse
-    path = 'input/' + 'phase4/' + animal_name + '/' + session_filename
-
-    df = pymworks.open_file(path)
-    events = df.get_events([
-        "Announce_TrialStart",
-        "Announce_TrialEnd",
-        "success",
-        "failure",
-        "ignore",
-        "stm_size",
-        "stm_rotation_in_depth"]
-    )
-
-    trials = []
-    trial_num = 1
-    for index, event in enumerate(events):
-        if (event.name == "Announce_TrialStart" and
-        event.value == 1):
-            trial = {
-                "trial_num": trial_num,
-                "stm_size": None,
-                "behavior_outcome": None,
-                "stm_rotation": None
-            }
+    return 'input/' + 'phase4/' + animal_name + '/' + session_filename
 
-            try:
-                if events[index - 1].name == "stm_size":
-                    trial["stm_size"] = events[index - 1].value
-            except IndexError:
-                print "stm_size out of range for session", session_filename, \
-                index
-            try:
-                if events[index - 1].name == "stm_rotation_in_depth":
-                    trial["stm_rotation"] = float(events[index - 1].value)
-            except IndexError:
-                print "stm_rotation_in_depth out of range for session", session_filename, index
-            try:
-                if events[index - 2].name == "stm_size":
-                    trial["stm_size"] = events[index - 2].value
-            except IndexError:
-                print "stm_size out of range for session", session_filename, index
-            try:
-                if events[index - 2].name == "stm_rotation_in_depth":
-                    trial["stm_rotation"] = float(events[index - 2].value)
-            except IndexError:
-                print "stm_rotation_in_depth out of range for session", session_filename, index
-            try:
-                if events[index + 1].name in ["success", "failure", "ignore"]:
-                    trial["behavior_outcome"] = events[index + 1].name
-            except IndexError:
-                print "beh_outcome out of range for session", session_filename,\
-                 index
-            if (trial["stm_size"] is not None and
-            trial["behavior_outcome"] is not None and
-            trial["stm_rotation"] is not None):
-                trials.append(trial)
-                trial_num += 1
-    return trials
+def extract_session_trials(path, event_names):
+    '''
+    Reads a session's events (see session_events.py) and returns its trials
+    (see get_session_trials() for the format). get_session_trials() only
+    calls this when there are no cached trials for the session.
+
+    :param path: path to the .mwk session file (string)
+    :param event_names: list of event names to read from the session
+    '''
+    if session_events.should_stream(path):
+        #too big to hold all of its events at once, build the trials as the
+        #events go by
+        events = session_events.iter_session_events(path, event_names)
+        return trial_segmentation.trials_to_table(
+            trial_segmentation.iter_trials_at_starts(events, event_names,
+                TRIAL_VARIABLES, join=STIMULUS_JOIN, lookback=2),
+            TRIAL_VARIABLES.values())
+    columns = session_events.get_session_columns(path, event_names)
+    return trial_segmentation.segment_trials_at_starts(columns, event_names,
+        TRIAL_VARIABLES, join=STIMULUS_JOIN, lookback=2)
 
 if __name__ == "__main__":
-    animals_and_sessions = get_animals_and_their_session_filenames('input/phase4')
-    analyze_sessions(animals_and_sessions, graph_summary_stats=True)
+    parser = argparse.ArgumentParser(
+        description="Analyze phase 4 sessions in input/phase4")
+    parser.add_argument("--error-model", choices=bootstrap.ERROR_MODELS,
+        default=ERROR_MODEL,
+        help="closed form (analytic) error bars, bootstrap ones (e.g. for "
+        "final figures), or both with a comparison printed (validate) "
+        "(default: %(default)s)")
+    parser.add_argument("--save-figures", nargs="+", metavar="FORMAT",
+        choices=figure_output.FORMATS,
+        help="save figures in these formats (%s) under output/phase4 "
+        "instead of showing them" % ", ".join(figure_output.FORMATS))
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args.report, args.profile)
 
+    animals_and_sessions = get_animals_and_their_session_filenames('input/phase4')
+    analyze_sessions(animals_and_sessions, graph_summary_stats=True,
+        error_model=args.error_model, figure_formats=args.save_figures)
+    instrumentation.write_report()
@@ -0,0 +1,151 @@
+import os
+import re
+import datetime
+import trial_cache
+import instrumentation
+
+try:
+    from os import scandir
+except ImportError: #before Python 3.5, use the scandir backport if it's there
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+#bump this whenever the format of the manifest changes
+MANIFEST_VERSION = 1
+
+#file in trial_cache.CACHE_DIR what's in every animal's folder is kept in
+#between runs. Set to None (or turn off the trial cache) to list and stat
+#every folder on every run.
+MANIFEST_FILE = "session_manifest.pkl"
+
+#session filenames end in the date they were run on, as YYMMDD, e.g.
+#AB1_140617.mwk was run on June 17, 2014
+SESSION_DATE = re.compile(r"_(\d{6})(?:\D|$)")
+
+def get_animals_and_their_session_filenames(path):
+    '''
+    Returns a dict with animal names as keys (from the names of the folders
+        in path, one per animal) and a list of their session filenames as
+        values, oldest session first (see get_session_manifest()).
+            e.g. {'V1': ['V1_140501.mwk', 'V1_140502.mwk']}
+
+    :param path: a string of the directory name containing animals' folders
+    '''
+    manifest = get_session_manifest(path)
+    return dict((animal, [session["filename"] for session in sessions]) for
+        animal, sessions in manifest.iteritems())
+
+@instrumentation.timed("discovery")
+def get_session_manifest(path, manifest_file=None):
+    '''
+    Returns a dict with animal names as keys and a list of dicts describing
+    their sessions as values, e.g.
+        {'AB1': [{'filename': 'AB1_140617.mwk', 'date': date(2014, 6, 17),
+                  'size': 1234567, 'mtime': 1403049600.0}, ...]}
+    Sessions are in chronological order (by the date in their filename, then
+    by filename), so session numbers and bins don't depend on the order the
+    filesystem lists them in. Sessions without a date in their filename go
+    last. Hidden files are skipped.
+
+    A folder is only listed again if its modification time changed since the
+    manifest was saved (i.e. sessions were added, removed or renamed), which
+    keeps re-scanning a big network mounted input folder cheap. Sessions
+    rewritten in place keep their old size and mtime in the manifest, that's
+    fine for the trial cache, which checks the files themselves.
+
+    :param path: a string of the directory name containing animals' folders
+    :param manifest_file: where the manifest is kept, MANIFEST_FILE in the
+        trial cache if None
+    '''
+    if manifest_file is None:
+        manifest_file = trial_cache.get_cache_path(MANIFEST_FILE)
+    saved = load_manifest(manifest_file)
+    folders = {}
+    changed = False
+    result = {}
+    for name, entry_path, is_dir, stat in list_folder(path):
+        if not is_dir or name.startswith("."):
+            continue
+        folder = saved.get(os.path.abspath(entry_path))
+        if folder is None or folder["mtime"] != stat.st_mtime:
+            folder = {
+                "mtime": stat.st_mtime,
+                "sessions": list_sessions(entry_path)
+            }
+            changed = True
+            instrumentation.count("folders_listed")
+        folders[os.path.abspath(entry_path)] = folder
+        result[name] = folder["sessions"]
+        instrumentation.count("sessions_found", len(folder["sessions"]))
+
+    if changed:
+        #keep other input folders' (e.g. other phases') entries
+        saved.update(folders)
+        save_manifest(saved, manifest_file)
+    return result
+
+def list_sessions(animal_path):
+    #every session in an animal's folder, in chronological order
+    sessions = []
+    for name, entry_path, is_dir, stat in list_folder(animal_path):
+        if is_dir or name.startswith("."): #dont want hidden files
+            continue
+        sessions.append({
+            "filename": name,
+            "date": parse_session_date(name),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime
+        })
+    sessions.sort(key=lambda session: (session["date"] is None,
+        session["date"], session["filename"]))
+    return sessions
+
+def parse_session_date(filename):
+    '''
+    Returns the date (datetime.date) in a session filename like
+    AB1_140617.mwk, or None if there isn't a valid one.
+    '''
+    match = SESSION_DATE.search(filename)
+    if match is None:
+        return None
+    try:
+        return datetime.datetime.strptime(match.group(1), "%y%m%d").date()
+    except ValueError:
+        return None
+
+def list_folder(path):
+    '''
+    Returns a list of (name, path, is_dir, stat) for every entry in a folder,
+    with os.scandir() (or the scandir backport) if there is one, which gets
+    is_dir from the directory listing itself, otherwise with os.listdir().
+    '''
+    result = []
+    if scandir is not None:
+        for entry in scandir(path):
+            is_dir = entry.is_dir()
+            result.append((entry.name, entry.path, is_dir, entry.stat()))
+        return result
+    for name in os.listdir(path):
+        entry_path = os.path.join(path, name)
+        stat = os.stat(entry_path)
+        result.append((name, entry_path, os.path.isdir(entry_path), stat))
+    return result
+
+def load_manifest(manifest_file):
+    '''
+    Returns the saved manifest, {folder path: {"mtime": ..., "sessions":
+    [...]}}, or an empty one if it's missing, unreadable or out of date.
+    '''
+    saved = trial_cache.load_pickle(manifest_file)
+    if saved is None or saved.get("version") != MANIFEST_VERSION:
+        return {}
+    return saved["folders"]
+
+def save_manifest(folders, manifest_file):
+    '''
+    Writes the manifest (see trial_cache.save_pickle()).
+    '''
+    trial_cache.save_pickle(manifest_file,
+        {"version": MANIFEST_VERSION, "folders": folders})
@@ -0,0 +1,177 @@
+import os
+import numpy as np
+import mwk_reader
+import trial_cache
+import trial_segmentation
+import instrumentation
+
+#bump this whenever the format of cached event columns changes
+EVENTS_VERSION = 1
+
+#every event any of the phase scripts reads. A session is always decoded
+#with all of them, so whichever analysis opens it first pays for the one
+#read and the others get their events from the cache.
+ANALYSIS_EVENT_NAMES = [
+    "Announce_TrialStart",
+    "Announce_TrialEnd",
+    "success",
+    "failure",
+    "ignore",
+    "stm_pos_x",
+    "stm_size",
+    "stm_rotation_in_depth"
+]
+
+#how sessions are decoded: "native" reads them straight into columns with
+#mwk_reader.py, "pymworks" goes through pymworks event objects. Files the
+#native reader can't handle are always handed to pymworks.
+READER = "native"
+
+#sessions bigger than this (in bytes) are streamed through
+#iter_session_events() instead of decoded into cached columns, so memory use
+#stays flat however long they are (e.g. sessions logging analog lick inputs).
+#None to never stream.
+STREAM_ABOVE_BYTES = 512 * 1024 * 1024
+
+def should_stream(path):
+    if STREAM_ABOVE_BYTES is None:
+        return False
+    return os.path.getsize(path) > STREAM_ABOVE_BYTES
+
+def get_session_columns(path, event_names, cache_dir=None):
+    '''
+    Returns the events called event_names in a session as columns (see
+    trial_segmentation.events_to_columns()), with codes indexing into
+    event_names.
+
+    The session is only decoded if no earlier read of it (by this or any
+    other analysis) decoded a superset of event_names; otherwise the columns
+    are projected out of what's cached. When it is decoded, it's decoded with
+    ANALYSIS_EVENT_NAMES and everything cached before too, so one decode per
+    file covers every phase.
+
+    :param path: path to the .mwk session file (string)
+    :param event_names: list of event names the analysis needs
+    :param cache_dir: directory with cache files, trial_cache.CACHE_DIR if
+        None (which always decodes if that's None too)
+    '''
+    entry = load_columns(path, cache_dir)
+    if entry is None or not set(event_names) <= set(entry["event_names"]):
+        decoded_names = union_of_names(ANALYSIS_EVENT_NAMES, event_names,
+            entry["event_names"] if entry is not None else [])
+        entry = {
+            "event_names": decoded_names,
+            "columns": read_columns(path, decoded_names)
+        }
+        save_columns(path, entry, cache_dir)
+    else:
+        instrumentation.count("event_cache_hits")
+    return project_columns(entry["columns"], entry["event_names"],
+        event_names)
+
+def union_of_names(*name_lists):
+    '''
+    Returns every name in name_lists once, in the order they first show up.
+    '''
+    result = []
+    for names in name_lists:
+        for name in names:
+            if name not in result:
+                result.append(name)
+    return result
+
+def read_columns(path, event_names):
+    #the one place a session is decoded
+    instrumentation.count("files_decoded")
+    instrumentation.count("bytes_decoded", os.path.getsize(path))
+    with instrumentation.stage("decode"):
+        if READER == "native":
+            try:
+                return mwk_reader.read_columns(path, event_names)
+            except mwk_reader.UnsupportedFileError:
+                instrumentation.count("pymworks_fallbacks")
+        return read_columns_with_pymworks(path, event_names)
+
+def read_columns_with_pymworks(path, event_names):
+    import pymworks #only imported for the sessions mwk_reader can't read
+    df = pymworks.open_file(path)
+    #names that aren't in the session's codec were never logged in it and
+    #would make get_events() raise, they just don't get any events
+    logged_names = [name for name in event_names if name in df.rcodec]
+    events = df.get_events(logged_names)
+    return trial_segmentation.events_to_columns(events, event_names)
+
+def iter_session_events(path, event_names):
+    '''
+    Yields (code, time, value) for the events called event_names in a
+    session, in file order (the order get_events() returns them in), with
+    codes indexing into event_names. Events are read one at a time and every
+    other event is dropped right away, so nothing builds up in memory; not
+    even the per event index pymworks.open_file() keeps for indexed reads.
+    Names come from the codec logged before each event, where pymworks uses
+    the session's last codec for every event; the two only differ for a
+    session whose codec changed partway through.
+
+    :param path: path to the .mwk session file (string)
+    :param event_names: list of event names to yield
+    '''
+    import pymworks
+    instrumentation.count("files_streamed")
+    name_index = dict((name, i) for i, name in enumerate(event_names))
+    codes = {} #MWorks event code -> index in event_names
+    df = pymworks.open_file(path, indexed=False)
+    try:
+        event = df.read_event()
+        while event is not None:
+            if event.code == 0: #codec, maps event codes to variable names
+                codes = dict((code, name_index[variable["tagname"]]) for
+                    code, variable in event.value.iteritems() if
+                    variable["tagname"] in name_index)
+            elif event.code in codes:
+                yield codes[event.code], event.time, event.value
+            event = df.read_event()
+    finally:
+        df.close()
+
+def project_columns(columns, from_names, to_names):
+    '''
+    Returns columns with only the events called to_names, in the same order,
+    with codes indexing into to_names instead of from_names.
+
+    :param columns: dict of event arrays with codes indexing into from_names
+    '''
+    lookup = np.empty(len(from_names), dtype=np.int16)
+    lookup.fill(-1)
+    for code, name in enumerate(from_names):
+        if name in to_names:
+            lookup[code] = to_names.index(name)
+    new_codes = lookup[columns["codes"]]
+    keep = new_codes >= 0
+    return {
+        "codes": new_codes[keep],
+        "times": columns["times"][keep],
+        "values": columns["values"][keep]
+    }
+
+def load_columns(path, cache_dir=None):
+    '''
+    Returns the cached {"event_names": [...], "columns": {...}} entry for a
+    session or None if there's no valid one (see trial_cache.load_trials()).
+    '''
+    entry = trial_cache.load_pickle(trial_cache.get_cache_filename(path, [],
+        "events", cache_dir))
+    if entry is None:
+        return None
+    if (entry.get("version") != EVENTS_VERSION or
+    entry.get("signature") != trial_cache.get_file_signature(path)):
+        return None
+    return entry
+
+def save_columns(path, entry, cache_dir=None):
+    '''
+    Writes a session's decoded event columns to the cache, the same way
+    trial_cache.save_trials() writes trials.
+    '''
+    trial_cache.save_pickle(trial_cache.get_cache_filename(path, [],
+        "events", cache_dir), dict(entry, version=EVENTS_VERSION,
+        signature=trial_cache.get_file_signature(path)))
@@ -0,0 +1,196 @@
+import os
+import Queue
+import functools
+import threading
+import multiprocessing
+import instrumentation
+
+#most session tasks map_animals() keeps queued in the pool per worker process.
+#Anything put in the pool after them (an animal's analysis, its figure,
+#bootstrap cells) only waits for these instead of every session in the cohort.
+SESSIONS_QUEUED_PER_PROCESS = 2
+
+def start_pool(processes=None):
+    '''
+    Returns a multiprocessing.Pool whose workers run warm_up() as they start,
+    so they're ready to read sessions before the first task comes in.
+
+    :param processes: number of worker processes, None for one per CPU core
+    '''
+    return multiprocessing.Pool(processes, initializer=warm_up,
+        initargs=(instrumentation.get_settings(),))
+
+def warm_up(instrumentation_settings):
+    #imports the session reader (and NumPy) in a new worker. Workers forked
+    #from a phase script already have it; nothing for plotting is imported,
+    #only workers that draw figures import matplotlib (see figure_output.py).
+    #Also starts collecting the worker's stage timings (see instrumentation.py)
+    import session_events
+    instrumentation.start_worker(instrumentation_settings)
+
+def get_file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def order_sessions_largest_first(animals_and_sessions, get_path_func):
+    '''
+    Returns a list of (animal_name, session_index, session_filename) tuples for
+    every session of every animal, biggest .mwk file first. Big sessions take
+    longest to read, so starting them first keeps the last few tasks in the
+    pool short and every core busy until the end.
+
+    :param animals_and_sessions: a dict with animal names as keys and
+        a list of their session filenames as values.
+    :param get_path_func: function(animal_name, session_filename) returning
+        the path to the session file
+    '''
+    tasks = []
+    for animal_name, sessions in animals_and_sessions.iteritems():
+        for index, session in enumerate(sessions):
+            size = get_file_size(get_path_func(animal_name, session))
+            tasks.append((size, animal_name, index, session))
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    return [(animal_name, index, session) for size, animal_name, index, session
+        in tasks]
+
+def order_sessions_by_animal(animals_and_sessions, get_path_func):
+    '''
+    Returns a list of (animal_name, session_index, session_filename) tuples for
+    every session of every animal, one animal after the other: the animal
+    with the least data first, and each animal's biggest .mwk files first.
+    Animals are then done one at a time, the first one as soon as possible,
+    and each animal ends with its quickest sessions (see
+    order_sessions_largest_first()).
+
+    :param animals_and_sessions: a dict with animal names as keys and
+        a list of their session filenames as values.
+    :param get_path_func: function(animal_name, session_filename) returning
+        the path to the session file
+    '''
+    animals = []
+    for animal_name, sessions in animals_and_sessions.iteritems():
+        tasks = order_sessions_largest_first({animal_name: sessions},
+            get_path_func)
+        size = sum(get_file_size(get_path_func(animal_name, session)) for
+            session in sessions)
+        animals.append((size, animal_name, tasks))
+    animals.sort(key=lambda animal: (animal[0], animal[1]))
+    return [task for size, animal_name, tasks in animals for task in tasks]
+
+def map_sessions(pool, animals_and_sessions, func, get_path_func):
+    '''
+    Runs func(animal_name, session_filename) for every session of every animal
+    as its own task in pool, largest session files first, and returns a dict
+    with animal names as keys and a list of func results (in the same order
+    as that animal's sessions) as values. Wall time is then bounded by total
+    work / cores instead of by the animal with the most sessions.
+        e.g. {'AB1': [trials_session_1, trials_session_2]}
+
+    :param pool: a multiprocessing.Pool
+    :param animals_and_sessions: a dict with animal names as keys and
+        a list of their session filenames as values.
+    :param func: module level function (so it can be pickled), e.g.
+        get_session_trials
+    :param get_path_func: function(animal_name, session_filename) returning
+        the path to the session file, used to size the tasks
+    '''
+    async_results = {}
+    for animal_name, index, session in order_sessions_largest_first(
+    animals_and_sessions, get_path_func):
+        async_results[(animal_name, index)] = pool.apply_async(func,
+            args=(animal_name, session))
+
+    result = {}
+    for animal_name, sessions in animals_and_sessions.iteritems():
+        result[animal_name] = [async_results[(animal_name, index)].get() for
+            index in xrange(len(sessions))]
+    return result
+
+def call_safely(task):
+    #runs one (func, args) task of map_animals() in a worker process. Returns
+    #(True, result), or (False, exception) if func raised one, since
+    #apply_async() only calls back with results.
+    func, args = task
+    try:
+        return True, func(*args)
+    except Exception as e:
+        return False, e
+
+def map_animals(pool, animals_and_sessions, session_func, animal_func,
+    get_path_func, animal_args=(), processes=None):
+    '''
+    Runs session_func(animal_name, session_filename) for every session of
+    every animal as its own task in pool, and as soon as all of an animal's
+    sessions are done, animal_func(animal_name, sessions, list of
+    session_func results, *animal_args) as another task. Returns an iterator
+    over (animal_name, animal_func result) in the order animals finish, so the
+    first animal's figure can be drawn while later animals' sessions are
+    still being read. Each animal's session results are handed on to its
+    task and let go, so they're never all held here at once.
+
+    Sessions are queued one animal after the other (see
+    order_sessions_by_animal()) and only SESSIONS_QUEUED_PER_PROCESS per
+    worker at a time, more as they finish, so animal_func tasks (and whatever
+    else is put in the pool meanwhile) don't wait behind every session of the
+    cohort. An exception in either function is raised when it comes up.
+
+    :param pool: a multiprocessing.Pool
+    :param animals_and_sessions: a dict with animal names as keys and
+        a list of their session filenames as values.
+    :param session_func: module level function (so it can be pickled), e.g.
+        get_session_trials
+    :param animal_func: module level function, e.g. get_data_for_figure
+    :param get_path_func: function(animal_name, session_filename) returning
+        the path to the session file, used to order the tasks
+    :param animal_args: tuple of more arguments for animal_func
+    :param processes: number of worker processes in pool, None for one per
+        CPU core
+    '''
+    tasks = iter(order_sessions_by_animal(animals_and_sessions, get_path_func))
+    tasks_lock = threading.Lock()
+    results = dict((animal_name, [None] * len(sessions)) for animal_name,
+        sessions in animals_and_sessions.iteritems())
+    remaining = dict((animal_name, len(sessions)) for animal_name, sessions in
+        animals_and_sessions.iteritems())
+    finished = Queue.Queue() #(animal_name, (succeeded, result)) of animals
+
+    def start_animal(animal_name):
+        args = (animal_name, animals_and_sessions[animal_name],
+            results.pop(animal_name)) + tuple(animal_args)
+        pool.apply_async(call_safely, ((animal_func, args),),
+            callback=lambda outcome: finished.put((animal_name, outcome)))
+
+    def start_next_session():
+        with tasks_lock: #called from here and the pool's result thread
+            task = next(tasks, None)
+        if task is not None:
+            animal_name, index, session = task
+            pool.apply_async(call_safely, ((session_func, (animal_name,
+                session)),), callback=functools.partial(session_done,
+                animal_name, index))
+
+    def session_done(animal_name, index, outcome):
+        #runs in the pool's result thread as each session finishes
+        succeeded, result = outcome
+        if not succeeded:
+            finished.put((animal_name, outcome))
+            return
+        results[animal_name][index] = result
+        remaining[animal_name] -= 1
+        if remaining[animal_name] == 0:
+            start_animal(animal_name)
+        start_next_session()
+
+    for animal_name, sessions in animals_and_sessions.iteritems():
+        if not sessions:
+            start_animal(animal_name)
+    for i in xrange(SESSIONS_QUEUED_PER_PROCESS *
+    (processes or multiprocessing.cpu_count())):
+        start_next_session()
+    for i in xrange(len(animals_and_sessions)):
+        animal_name, (succeeded, result) = finished.get()
+        if not succeeded:
+            raise result
+        yield animal_name, result
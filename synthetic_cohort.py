@@ -0,0 +1,221 @@
+import os
+import math
+import random
+import struct
+import argparse
+import datetime
+import multiprocessing
+import mwk_reader
+
+#writes a made up cohort of animals as .mwk session files laid out like
+#input (<output>/phaseN/<animal>/<animal>_YYMMDD.mwk), so the phase scripts
+#and benchmark.py can be run at any scale without real data. Sessions have
+#the event structure the scripts expect: a codec, the 2 outcomes of each kind
+#MWorks emits when a session starts, then for every trial the stimulus
+#variables, Announce_TrialStart, stm_pos_x, the outcome and
+#Announce_TrialEnd, with lick events in between. Everything is derived from
+#the seed, so the same arguments always give the same files.
+
+#every event written, in codec order. LickInput1 is noise none of the phase
+#scripts read, like the analog inputs in real sessions.
+EVENT_NAMES = ["Announce_TrialStart", "Announce_TrialEnd", "success",
+    "failure", "ignore", "stm_size", "stm_rotation_in_depth", "stm_pos_x",
+    "LickInput1"]
+
+#first code for EVENT_NAMES, 0-3 are reserved by MWorks
+FIRST_CODE = 4
+
+#stimulus values each phase's trials are drawn from, like its protocol
+PHASE_STIMULI = {
+    "phase1": {
+        "stm_size": [40.0],
+        "stm_rotation_in_depth": [0.0],
+        "stm_pos_x": [0.0, 0.0, -7.5, 7.5, -15.0, 15.0]
+    },
+    "phase2": {
+        "stm_size": [40.0, 35.0, 30.0, 25.0, 20.0, 15.0],
+        "stm_rotation_in_depth": [0.0],
+        "stm_pos_x": [0.0]
+    },
+    "phase3": {
+        "stm_size": [40.0, 30.0, 30.0, 30.0],
+        "stm_rotation_in_depth": [-60.0, -45.0, -30.0, -15.0, 0.0, 15.0,
+            30.0, 45.0, 60.0],
+        "stm_pos_x": [0.0]
+    },
+    "phase4": {
+        "stm_size": [15.0, 20.0, 25.0, 30.0, 35.0, 40.0, 45.0],
+        "stm_rotation_in_depth": [-60.0, -45.0, -30.0, -15.0, 0.0, 15.0,
+            30.0, 45.0, 60.0, 75.0],
+        "stm_pos_x": [0.0]
+    }
+}
+
+PHASES = sorted(PHASE_STIMULI)
+
+#sessions of an animal are run on consecutive days from this one
+FIRST_SESSION_DATE = datetime.date(2014, 6, 1)
+
+def write_cohort(output_dir, animals=7, sessions=10, trials=300, seed=0,
+    phases=PHASES, processes=None):
+    '''
+    Writes sessions for animals animals (AB1, AB2...) in each phase, sessions
+    sessions per animal with about trials trials each, under output_dir. Files
+    that already exist are left alone, so a cohort can be grown by asking for
+    more animals or sessions. Returns the number of sessions written.
+
+    :param processes: number of worker processes, None for one per CPU core
+    '''
+    tasks = []
+    for phase in phases:
+        for animal in xrange(animals):
+            animal_name = "AB%d" % (animal + 1)
+            animal_dir = os.path.join(output_dir, phase, animal_name)
+            if not os.path.isdir(animal_dir):
+                os.makedirs(animal_dir)
+            for session in xrange(sessions):
+                date = FIRST_SESSION_DATE + datetime.timedelta(days=session)
+                path = os.path.join(animal_dir, "%s_%s.mwk" % (animal_name,
+                    date.strftime("%y%m%d")))
+                if not os.path.exists(path):
+                    tasks.append((path, phase, trials, session, sessions,
+                        "%d:%s:%s:%d" % (seed, phase, animal_name, session)))
+    pool = multiprocessing.Pool(processes)
+    try:
+        for i, path in enumerate(pool.imap_unordered(write_session_task,
+        tasks, chunksize=8)):
+            if (i + 1) % 1000 == 0:
+                print "%d/%d sessions written" % (i + 1, len(tasks))
+    finally:
+        pool.close()
+        pool.join()
+    return len(tasks)
+
+def write_session_task(task):
+    #runs one task of write_cohort() in a worker process
+    path, phase, trials, session, sessions, seed = task
+    write_session(path, phase, trials, float(session) / max(sessions - 1, 1),
+        seed)
+    return path
+
+def write_session(path, phase, trials, progress, seed):
+    '''
+    Writes one session with about trials trials of phase's stimuli (see
+    PHASE_STIMULI). Animals get better over sessions: progress goes from 0.0
+    (first session) to 1.0 (last), and bigger, less rotated and centered
+    stimuli are easier.
+
+    :param seed: anything hashable to seed the session's random stream with
+    '''
+    rng = random.Random(seed)
+    stimuli = PHASE_STIMULI[phase]
+    codes = dict((name, FIRST_CODE + i) for i, name in enumerate(EVENT_NAMES))
+    codec = dict((code, {"tagname": name, "groups": []}) for name, code in
+        codes.iteritems())
+    chunks = [mwk_reader.MAGIC, "\x01", encode_ber(0), encode_ber(0)]
+    chunks.append(encode_event(0, 0, codec))
+    time = 1000
+    for outcome in ["success", "failure", "ignore"]:
+        for i in xrange(2):
+            chunks.append(encode_event(codes[outcome], time, 0))
+            time += 3
+
+    num_trials = max(1, int(rng.gauss(trials, trials * 0.1)))
+    for trial in xrange(num_trials):
+        size = rng.choice(stimuli["stm_size"])
+        rotation = rng.choice(stimuli["stm_rotation_in_depth"])
+        pos_x = rng.choice(stimuli["stm_pos_x"])
+        time += rng.randint(2000000, 6000000) #2-6 s between trials
+        variables = [("stm_size", size), ("stm_rotation_in_depth", rotation)]
+        rng.shuffle(variables)
+        for name, value in variables:
+            chunks.append(encode_event(codes[name], time, value))
+            time += rng.randint(5, 50)
+        chunks.append(encode_event(codes["Announce_TrialStart"], time, 1))
+        time += rng.randint(5, 50)
+        chunks.append(encode_event(codes["stm_pos_x"], time, pos_x))
+        for i in xrange(rng.randint(0, 3)):
+            time += rng.randint(1000, 100000)
+            chunks.append(encode_event(codes["LickInput1"], time,
+                rng.random()))
+        time += rng.randint(200000, 3000000)
+        chunks.append(encode_event(codes[get_outcome(rng, size, rotation,
+            pos_x, progress)], time, 1))
+        time += rng.randint(5, 50)
+        chunks.append(encode_event(codes["Announce_TrialEnd"], time, 1))
+
+    tmp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write("".join(chunks))
+    os.rename(tmp_path, path)
+
+def get_outcome(rng, size, rotation, pos_x, progress):
+    #draws a trial's outcome, more often right for easier stimuli
+    ease = (min(size, 40.0) / 40.0) * math.cos(math.radians(rotation) / 2.0)
+    ease *= 1.0 - abs(pos_x) / 60.0
+    pct_correct = 0.5 + 0.45 * ease * (0.4 + 0.6 * progress)
+    if rng.random() < 0.1:
+        return "ignore"
+    return "success" if rng.random() < pct_correct else "failure"
+
+def encode_event(code, time, value):
+    #one [code, time, value] event as LDO binary, like pymworks writes it
+    return (chr(mwk_reader.LIST) + encode_ber(3) + encode_item(code) +
+        encode_item(time) + encode_item(value))
+
+def encode_item(value):
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, long)):
+        if value >= 0:
+            return chr(mwk_reader.INTEGER_P) + encode_ber(value)
+        return chr(mwk_reader.INTEGER_N) + encode_ber(-value)
+    if isinstance(value, float):
+        return chr(mwk_reader.FLOAT_OPAQUE) + encode_ber(8) + \
+            struct.pack("d", value)
+    if isinstance(value, str):
+        value += "\x00" #MWorks expects null terminated strings
+        return chr(mwk_reader.OPAQUE) + encode_ber(len(value)) + value
+    if value is None:
+        return chr(mwk_reader.NULL)
+    if isinstance(value, (list, tuple)):
+        return chr(mwk_reader.LIST) + encode_ber(len(value)) + "".join(
+            encode_item(item) for item in value)
+    if isinstance(value, dict):
+        return chr(mwk_reader.DICTIONARY) + encode_ber(len(value)) + "".join(
+            encode_item(key) + encode_item(item) for key, item in
+            value.iteritems())
+    raise TypeError("can't write %r" % (value,))
+
+def encode_ber(value):
+    #BER compressed integer, the inverse of mwk_reader.decode_ber()
+    result = chr(value & 0x7F)
+    value >>= 7
+    while value:
+        result = chr((value & 0x7F) | 0x80) + result
+        value >>= 7
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic cohort of .mwk sessions")
+    parser.add_argument("output_dir",
+        help="where to write phaseN/<animal>/ folders, e.g. input")
+    parser.add_argument("--animals", type=int, default=7,
+        help="number of animals (default: %(default)s)")
+    parser.add_argument("--sessions", type=int, default=10,
+        help="sessions per animal in each phase (default: %(default)s)")
+    parser.add_argument("--trials", type=int, default=300,
+        help="average trials per session (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+        help="the same seed always writes the same files (default: "
+        "%(default)s)")
+    parser.add_argument("--phases", nargs="+", choices=PHASES,
+        default=PHASES, help="phases to write sessions for (default: all)")
+    parser.add_argument("--processes", type=int, default=None,
+        help="number of worker processes (default: one per CPU core)")
+    args = parser.parse_args()
+
+    written = write_cohort(args.output_dir, args.animals, args.sessions,
+        args.trials, args.seed, args.phases, args.processes)
+    print "Wrote %d sessions to %s" % (written, args.output_dir)
@@ -0,0 +1,140 @@
+import os
+import hashlib
+import cPickle
+import instrumentation
+
+#bump this whenever the format of cached trials (or how they're segmented)
+#changes so old cache files get re-extracted instead of handed to code that
+#doesn't expect them. Incremental runs read sessions again too.
+CACHE_VERSION = 3
+
+#cache lives next to the 'input' folder, in the directory the scripts are
+#run from (see README). Set to None to turn caching off, along with the
+#event cache, bootstrap memo, session manifest, trial store and incremental
+#state kept in it.
+CACHE_DIR = ".trial_cache"
+
+def get_cache_path(name, cache_dir=None):
+    '''
+    Returns the path of a file or folder called name in the cache directory,
+    or None if caching is off. CACHE_DIR is read when this is called, not
+    when a module is imported, so setting it to None turns off every cache.
+
+    :param name: file or folder name, None for nothing (returns None)
+    :param cache_dir: directory with cache files, CACHE_DIR if None
+    '''
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    if cache_dir is None or name is None:
+        return None
+    return os.path.join(cache_dir, name)
+
+def get_cache_filename(path, variables, namespace, cache_dir=None):
+    '''
+    Returns the name of the cache file for one session. There's one file per
+    (namespace, session path, extracted variables) so a changed session just
+    overwrites its old entry instead of leaving stale files around.
+
+    :param path: path to the .mwk session file (string)
+    :param variables: list of event names extracted from the session
+    :param namespace: string naming the extraction, e.g. "phase2". Two phases
+        can extract the same variables but build trials differently, so they
+        can't share cache entries.
+    :param cache_dir: directory with cache files, CACHE_DIR if None
+    '''
+    key = "\n".join([namespace, os.path.abspath(path)] + sorted(variables))
+    return get_cache_path(hashlib.md5(key).hexdigest() + ".pkl", cache_dir)
+
+def get_file_signature(path):
+    '''
+    Returns (size, mtime) for a file. If either one changes, the session was
+    rewritten and cached trials for it are no longer valid.
+    '''
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+def load_trials(path, variables, namespace, cache_dir=None):
+    '''
+    Returns the cached trials for a session or None if there's no valid cache
+    entry (missing, written by an older CACHE_VERSION, session file changed
+    since it was cached, or unreadable), or caching is off.
+    '''
+    entry = load_pickle(get_cache_filename(path, variables, namespace,
+        cache_dir))
+    if entry is None:
+        return None
+
+    if (entry.get("version") != CACHE_VERSION or
+    entry.get("signature") != get_file_signature(path) or
+    entry.get("variables") != sorted(variables)):
+        return None
+    return entry["trials"]
+
+def save_trials(path, variables, namespace, trials, cache_dir=None):
+    '''
+    Writes trials for a session to the cache (nothing if caching is off),
+    see save_pickle().
+    '''
+    save_pickle(get_cache_filename(path, variables, namespace, cache_dir), {
+        "version": CACHE_VERSION,
+        "signature": get_file_signature(path),
+        "variables": sorted(variables),
+        "trials": trials
+    })
+
+def load_pickle(filename):
+    '''
+    Returns what's pickled in filename, or None if filename is None or the
+    file is missing or unreadable. Whether what's in it is still valid (its
+    version, the signature of the file it came from) is up to the caller.
+    '''
+    if filename is None:
+        return None
+    try:
+        with open(filename, "rb") as f:
+            return cPickle.load(f)
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return None
+
+def save_pickle(filename, obj):
+    '''
+    Pickles obj to filename (nothing if filename is None), making its folder
+    if there isn't one. It's written to a temporary file and renamed into
+    place so another process reading it never sees a half written file.
+    '''
+    if filename is None:
+        return
+    folder = os.path.dirname(filename)
+    if folder and not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError: #another worker process made it first
+            pass
+    tmp_filename = filename + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        cPickle.dump(obj, f, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_filename, filename)
+
+def get_cached_trials(path, variables, namespace, extract_func,
+    cache_dir=None):
+    '''
+    Returns trials for a session, from the cache if the session hasn't changed
+    since it was last extracted, otherwise from extract_func(path, variables)
+    (which is then cached for next time).
+
+    :param path: path to the .mwk session file (string)
+    :param variables: list of event names extract_func reads from the session
+    :param namespace: string naming the extraction (see get_cache_filename())
+    :param extract_func: function that opens the session and returns its
+        trials, e.g. phase2_analysis.extract_session_trials
+    :param cache_dir: directory with cache files, CACHE_DIR if None (which
+        skips the cache if that's None too)
+    '''
+    trials = load_trials(path, variables, namespace, cache_dir)
+    if trials is None:
+        instrumentation.count("trial_cache_misses")
+        trials = extract_func(path, variables)
+        save_trials(path, variables, namespace, trials, cache_dir)
+    else:
+        instrumentation.count("trial_cache_hits")
+    return trials
@@ -0,0 +1,467 @@
+import collections
+import numpy as np
+import instrumentation
+
+OUTCOMES = ["success", "failure", "ignore"]
+
+#trial tables keep each trial's outcome as its index in OUTCOMES
+SUCCESS, FAILURE, IGNORE = range(len(OUTCOMES))
+
+#dtype of the stimulus variable columns. Every size, rotation and position
+#the protocols use (multiples of 2.5 degrees) is exact in float32.
+VARIABLE_DTYPE = np.float32
+
+def events_to_columns(events, event_names):
+    '''
+    Returns a dict of NumPy arrays with one entry per event, in the same order
+    as events:
+        {"codes": index of each event's name in event_names (int16),
+         "times": event timestamps in microseconds (int64),
+         "values": event values (float64, NaN if a value isn't a number)}
+
+    :param events: list of pymworks events, e.g. from df.get_events()
+    :param event_names: the list of event names passed to df.get_events()
+    '''
+    name_index = dict((name, i) for i, name in enumerate(event_names))
+    num_events = len(events)
+    codes = np.fromiter((name_index[e.name] for e in events), dtype=np.int16,
+        count=num_events)
+    times = np.fromiter((e.time for e in events), dtype=np.int64,
+        count=num_events)
+    try:
+        values = np.fromiter((e.value for e in events), dtype=np.float64,
+            count=num_events)
+    except (TypeError, ValueError): #a string or None somewhere in there
+        values = np.array([to_float(e.value) for e in events],
+            dtype=np.float64)
+    return {"codes": codes, "times": times, "values": values}
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def get_code(event_names, name):
+    '''
+    Returns the code events_to_columns() gave events called name, or -1 if
+    name wasn't extracted (so it never matches).
+    '''
+    try:
+        return event_names.index(name)
+    except ValueError:
+        return -1
+
+def get_outcome_lookup(event_names):
+    '''
+    Returns an array mapping event codes to an index in OUTCOMES, -1 for
+    events that aren't behavior outcomes.
+    '''
+    lookup = np.empty(len(event_names), dtype=np.int8)
+    lookup.fill(-1)
+    for i, outcome in enumerate(OUTCOMES):
+        code = get_code(event_names, outcome)
+        if code >= 0:
+            lookup[code] = i
+    return lookup
+
+def get_trial_dtype(column_names):
+    '''
+    Returns the dtype of a trial table with variable columns column_names,
+    17 bytes per trial plus 4 per variable (a trial dict takes about 400).
+    '''
+    return np.dtype([("trial_num", np.int32), ("outcome", np.int8),
+        ("start_time", np.int64)] + [(name, VARIABLE_DTYPE) for name in
+        sorted(column_names)])
+
+def make_trial_table(outcome_index, start_times, variable_columns):
+    '''
+    Puts the columns for trials that were kept into a trial table, a NumPy
+    structured array with one record per trial, the compact version of the
+    old list of trial dicts:
+        trial["trial_num"]: [1, 2, ...] (int32)
+        trial["outcome"]: [FAILURE, SUCCESS, ...] (int8, see OUTCOMES)
+        trial["start_time"]: [...] (int64)
+        trial["stm_size"]: [40.0, 35.0, ...] (VARIABLE_DTYPE)
+        ...
+    '''
+    num_trials = len(outcome_index)
+    table = np.empty(num_trials, dtype=get_trial_dtype(variable_columns))
+    table["trial_num"] = np.arange(1, num_trials + 1)
+    table["outcome"] = outcome_index
+    table["start_time"] = start_times
+    for name, column in variable_columns.iteritems():
+        table[name] = column
+    return table
+
+@instrumentation.timed("segmentation")
+def segment_trials_at_starts(columns, event_names, variables, join="asof",
+    lookback=1):
+    '''
+    Returns a trial table (see make_trial_table()) for trials found the way
+    phases 2-4 find them: each Announce_TrialStart event with value 1 starts a
+    trial and the behavior outcome is the event right after it. Trials missing
+    the outcome or any variable are dropped.
+
+    Variables are matched to trial starts one of two ways:
+        "asof": each variable's most recent value at or before the trial
+            start's timestamp, no matter how many other events came in between
+        "neighbors": the old way, only look at the lookback events right
+            before Announce_TrialStart (the farthest match wins). Trials where
+            some other event lands in between get dropped.
+
+    :param columns: dict of event arrays from events_to_columns()
+    :param event_names: the event names columns["codes"] index into
+    :param variables: dict with event names as keys and trial table column
+        names as values, e.g. {"stm_rotation_in_depth": "stm_rotation"}
+    :param join: "asof" or "neighbors"
+    :param lookback: how many events before Announce_TrialStart to look at
+        with join="neighbors"
+    '''
+    if join == "asof":
+        join_func = join_asof
+    elif join == "neighbors":
+        join_func = lambda columns, code, starts: \
+            join_neighbors(columns, code, starts, lookback)
+    else:
+        raise ValueError("unknown join: %s" % join)
+
+    codes = columns["codes"]
+    values = columns["values"]
+    num_events = len(codes)
+
+    starts = np.flatnonzero((codes == get_code(event_names,
+        "Announce_TrialStart")) & (values == 1))
+    keep = np.ones(len(starts), dtype=bool)
+
+    after = starts + 1
+    has_next = after < num_events
+    outcome_index = np.empty(len(starts), dtype=np.int8)
+    outcome_index.fill(-1)
+    outcome_index[has_next] = \
+        get_outcome_lookup(event_names)[codes[after[has_next]]]
+    keep &= outcome_index >= 0
+
+    variable_columns = {}
+    for event_name, column_name in variables.iteritems():
+        column = join_func(columns, get_code(event_names, event_name), starts)
+        keep &= ~np.isnan(column)
+        variable_columns[column_name] = column
+
+    for column_name in variable_columns:
+        variable_columns[column_name] = variable_columns[column_name][keep]
+    return make_trial_table(outcome_index[keep],
+        columns["times"][starts[keep]], variable_columns)
+
+def join_neighbors(columns, code, starts, lookback):
+    '''
+    Returns the value of the event with code among the lookback events before
+    each start position (farthest match wins), NaN where there's none.
+    '''
+    codes = columns["codes"]
+    column = np.empty(len(starts), dtype=np.float64)
+    column.fill(np.nan)
+    for offset in xrange(1, lookback + 1):
+        before = starts - offset
+        match = before >= 0
+        match[match] = codes[before[match]] == code
+        column[match] = columns["values"][before[match]]
+    return column
+
+def join_asof(columns, code, starts):
+    '''
+    Returns the most recent value of the event with code at or before each
+    start position's timestamp, NaN where it hadn't been set yet. One
+    searchsorted over the variable's (time sorted) events does all starts.
+    '''
+    times = columns["times"]
+    positions = np.flatnonzero(columns["codes"] == code)
+    last = np.searchsorted(times[positions], times[starts], side="right") - 1
+    column = np.empty(len(starts), dtype=np.float64)
+    column.fill(np.nan)
+    found = last >= 0
+    column[found] = columns["values"][positions[last[found]]]
+    return column
+
+@instrumentation.timed("segmentation")
+def segment_trials_by_window(columns, event_names, variables):
+    '''
+    Returns a trial table (see make_trial_table()) for trials found the way
+    phase 1 has always found them: a trial is an Announce_TrialStart followed
+    by an Announce_TrialEnd with no other announce event in between. The
+    behavior outcome is the last success, failure or ignore event with value 1
+    inside the trial and each variable is its last value inside the trial (NaN
+    if it wasn't set). Trials without an outcome are dropped.
+
+    :param columns: dict of event arrays from events_to_columns()
+    :param event_names: the event names columns["codes"] index into
+    :param variables: dict with event names as keys and trial table column
+        names as values
+    '''
+    codes = columns["codes"]
+    values = columns["values"]
+
+    start_code = get_code(event_names, "Announce_TrialStart")
+    end_code = get_code(event_names, "Announce_TrialEnd")
+    announces = np.flatnonzero((codes == start_code) | (codes == end_code))
+    is_end = codes[announces] == end_code
+    #a trial ends at each TrialEnd whose previous announce was a TrialStart
+    closes = np.flatnonzero(is_end[1:] & ~is_end[:-1]) + 1
+    window_starts = announces[closes - 1]
+    window_ends = announces[closes]
+
+    outcome_lookup = get_outcome_lookup(event_names)
+    outcome_positions = np.flatnonzero((outcome_lookup[codes] >= 0) &
+        (values == 1))
+    last = find_last_in_windows(outcome_positions, window_starts, window_ends)
+    keep = last >= 0
+    outcome_index = outcome_lookup[codes[outcome_positions[last[keep]]]]
+
+    variable_columns = {}
+    for event_name, column_name in variables.iteritems():
+        positions = np.flatnonzero(codes == get_code(event_names, event_name))
+        last = find_last_in_windows(positions, window_starts, window_ends)
+        column = np.empty(len(last), dtype=np.float64)
+        column.fill(np.nan)
+        column[last >= 0] = values[positions[last[last >= 0]]]
+        variable_columns[column_name] = column[keep]
+
+    return make_trial_table(outcome_index,
+        columns["times"][window_starts[keep]], variable_columns)
+
+def find_last_in_windows(positions, window_starts, window_ends):
+    '''
+    For each (start, end) window returns the index in positions of the last
+    position strictly inside it, or -1 if none is.
+
+    :param positions: sorted array of event positions
+    '''
+    last = np.searchsorted(positions, window_ends) - 1
+    inside = last >= 0
+    inside[inside] = positions[last[inside]] > window_starts[inside]
+    last[~inside] = -1
+    return last
+
+def concatenate_tables(tables, column_names=()):
+    '''
+    Returns one trial table with the trials from all tables, in order (e.g. all
+    sessions for an animal). trial_num still starts at 1 for each session.
+
+    :param column_names: variable columns of the empty table returned when
+        there are no tables
+    '''
+    if not tables:
+        return np.empty(0, dtype=get_trial_dtype(column_names))
+    return np.concatenate(tables)
+
+def count_trials(table):
+    return len(table)
+
+def count_outcomes(outcomes):
+    '''
+    Returns (successes, failures, ignores) in an array of outcome codes, e.g.
+    a trial table's trials["outcome"]: [SUCCESS, IGNORE, SUCCESS] -> (2, 0, 1).
+    '''
+    return tuple(np.bincount(outcomes, minlength=len(OUTCOMES)).tolist())
+
+def count_outcomes_by_index(index, outcomes, num_groups):
+    '''
+    Returns a num_groups x 3 array with the (successes, failures, ignores) of
+    each group of trials, index being each trial's group (0 to num_groups -
+    1), counted with one bincount over group and outcome together.
+    '''
+    num_outcomes = len(OUTCOMES)
+    return np.bincount(np.asarray(index, dtype=np.intp) * num_outcomes +
+        outcomes, minlength=num_groups * num_outcomes).reshape(num_groups,
+        num_outcomes)
+
+def group_outcomes(trials, columns):
+    '''
+    Returns a dict with the outcome codes of the trials (in trial order) for
+    every value of a column, or every combination of values of a list of
+    columns, that trials have, e.g.
+        group_outcomes(trials, "stm_rotation")
+            -> {-15.0: array([SUCCESS, FAILURE, ...]), 0.0: ...}
+        group_outcomes(trials, ["stm_size", "stm_rotation"])
+            -> {(30.0, -15.0): array([...]), ...}
+    '''
+    if len(trials) == 0:
+        return {}
+    names = [columns] if isinstance(columns, basestring) else columns
+    values = []
+    inverses = []
+    for name in names:
+        unique, inverse = np.unique(trials[name], return_inverse=True)
+        values.append(unique.tolist())
+        inverses.append(inverse)
+    cells, cell_index = np.unique(np.ravel_multi_index(inverses,
+        [len(unique) for unique in values]), return_inverse=True)
+    order = np.argsort(cell_index, kind="mergesort") #keeps trial order
+    ends = np.cumsum(np.bincount(cell_index))
+    groups = np.split(trials["outcome"][order], ends[:-1])
+    result = {}
+    for cell, group in zip(cells, groups):
+        key = tuple(column_values[i] for column_values, i in zip(values,
+            np.unravel_index(cell, [len(unique) for unique in values])))
+        result[key if len(names) > 1 else key[0]] = group
+    return result
+
+def iter_trials(trials):
+    '''
+    Yields one dict per trial in a trial table, with plain Python values, for
+    code that works trial by trial. trials can also already be an iterable of
+    trial dicts (e.g. from iter_trials_at_starts()), which is passed through,
+    so the same code can consume a table or a stream.
+    '''
+    if not isinstance(trials, np.ndarray):
+        for trial in trials:
+            yield trial
+        return
+    names = trials.dtype.names
+    for row in trials.tolist():
+        yield dict(zip(names, row))
+
+def as_table(trials, column_names):
+    '''
+    Returns trials as a trial table: a trial table is returned as is, an
+    iterable of trial dicts (e.g. from iter_trials_at_starts()) is packed into
+    one with trials_to_table(), a few bytes per trial, so the stats functions
+    can count a stream like a table.
+    '''
+    if isinstance(trials, np.ndarray):
+        return trials
+    return trials_to_table(trials, column_names)
+
+@instrumentation.timed("segmentation")
+def trials_to_table(trials, column_names):
+    '''
+    Returns a trial table (see make_trial_table()) built from an iterable of
+    trial dicts, e.g. from iter_trials_at_starts(), one trial at a time.
+
+    :param column_names: the variable column names in each trial dict
+    '''
+    outcome_index = []
+    start_times = []
+    variable_lists = dict((name, []) for name in column_names)
+    for trial in trials:
+        outcome_index.append(trial["outcome"])
+        start_times.append(trial["start_time"])
+        for name, values in variable_lists.iteritems():
+            values.append(trial[name])
+    variable_columns = dict((name, np.array(values, dtype=VARIABLE_DTYPE))
+        for name, values in variable_lists.iteritems())
+    return make_trial_table(np.array(outcome_index, dtype=np.int8),
+        np.array(start_times, dtype=np.int64), variable_columns)
+
+def iter_trials_at_starts(events, event_names, variables, join="asof",
+    lookback=1):
+    '''
+    Streaming version of segment_trials_at_starts(), same rules and same
+    trials. Takes (code, time, value) tuples one at a time (e.g. from
+    session_events.iter_session_events()) and yields each trial as a dict
+    (like iter_trials() does) as soon as it's complete, so memory doesn't grow
+    with the number of events in the session.
+
+    A trial is complete once its outcome (the event right after
+    Announce_TrialStart) is known and an event with a later timestamp comes
+    along, since with join="asof" variables logged at the same microsecond as
+    the trial start still count.
+    '''
+    if join not in ("asof", "neighbors"):
+        raise ValueError("unknown join: %s" % join)
+    start_code = get_code(event_names, "Announce_TrialStart")
+    outcome_lookup = get_outcome_lookup(event_names)
+    variable_codes = dict((get_code(event_names, event_name), column_name) for
+        event_name, column_name in variables.iteritems())
+    variable_codes.pop(-1, None)
+
+    latest = dict((column_name, np.nan) for column_name in variables.values())
+    recent = collections.deque(maxlen=lookback) #(code, value) of last events
+    pending = collections.deque() #trials waiting for later events
+    awaiting_outcome = False
+    trial_num = 0
+
+    for code, time, value in events:
+        value = to_float(value)
+        if awaiting_outcome:
+            outcome = outcome_lookup[code]
+            if outcome >= 0:
+                pending[-1]["outcome"] = int(outcome)
+            awaiting_outcome = False
+
+        while pending and pending[0]["start_time"] < time:
+            trial = finish_trial(pending.popleft(), latest, join)
+            if trial is not None:
+                trial_num += 1
+                trial["trial_num"] = trial_num
+                yield trial
+
+        if code in variable_codes:
+            latest[variable_codes[code]] = value
+        if code == start_code and value == 1:
+            trial = {"start_time": time, "outcome": None}
+            if join == "neighbors":
+                #farthest match among the lookback events before the start
+                for column_name in variables.values():
+                    trial[column_name] = np.nan
+                for recent_code, recent_value in reversed(recent):
+                    if recent_code in variable_codes:
+                        trial[variable_codes[recent_code]] = recent_value
+            pending.append(trial)
+            awaiting_outcome = True
+        recent.append((code, value))
+
+    while pending:
+        trial = finish_trial(pending.popleft(), latest, join)
+        if trial is not None:
+            trial_num += 1
+            trial["trial_num"] = trial_num
+            yield trial
+
+def finish_trial(trial, latest, join):
+    '''
+    Returns a pending trial from iter_trials_at_starts() with its variables
+    filled in, or None if it has to be dropped (no outcome or a variable
+    missing).
+    '''
+    if trial["outcome"] is None:
+        return None
+    if join == "asof":
+        trial.update(latest)
+    for key, value in trial.iteritems():
+        if isinstance(value, float) and np.isnan(value):
+            return None
+    return trial
+
+def iter_trials_by_window(events, event_names, variables):
+    '''
+    Streaming version of segment_trials_by_window(), same rules and same
+    trials. Takes (code, time, value) tuples one at a time and yields each
+    trial as a dict as soon as its Announce_TrialEnd comes along.
+    '''
+    start_code = get_code(event_names, "Announce_TrialStart")
+    end_code = get_code(event_names, "Announce_TrialEnd")
+    outcome_lookup = get_outcome_lookup(event_names)
+    variable_codes = dict((get_code(event_names, event_name), column_name) for
+        event_name, column_name in variables.iteritems())
+    variable_codes.pop(-1, None)
+
+    trial = None #the open trial, if there is one
+    trial_num = 0
+    for code, time, value in events:
+        value = to_float(value)
+        if code == start_code:
+            trial = {"start_time": time, "outcome": None}
+            for column_name in variables.values():
+                trial[column_name] = np.nan
+        elif code == end_code:
+            if trial is not None and trial["outcome"] is not None:
+                trial_num += 1
+                trial["trial_num"] = trial_num
+                yield trial
+            trial = None
+        elif trial is not None:
+            if outcome_lookup[code] >= 0 and value == 1:
+                trial["outcome"] = int(outcome_lookup[code])
+            elif code in variable_codes:
+                trial[variable_codes[code]] = value
@@ -0,0 +1,300 @@
+import os
+import argparse
+import numpy as np
+import trial_cache
+import trial_segmentation
+import session_pool
+
+#one consolidated, memory-mapped copy of every trial of every animal in every
+#phase: a .npy file per column with one row per trial, plus an index of which
+#rows belong to which (phase, animal) and session. Rows of a (phase, animal)
+#are contiguous, so slicing one out of the store is a view of the mapped
+#files, no copying and no .mwk files opened.
+
+#bump this whenever the columns or index change
+STORE_VERSION = 2
+
+#folder in trial_cache.CACHE_DIR the store is kept in
+STORE_DIR = "trial_store"
+
+#where the phase folders are, the phase scripts read sessions from here too
+INPUT_DIR = "input"
+
+#phase folder in input -> (module, its function returning a session's trial
+#table) for that phase
+PHASE_MODULES = {
+    "phase1": ("phase1_analysis", "get_session_statistics"),
+    "phase2": ("phase2_analysis", "get_session_trials"),
+    "phase3": ("phase3_analysis", "get_session_trials"),
+    "phase4": ("phase4_analysis", "get_session_trials")
+}
+
+#stimulus variables (event names) kept for every trial, NaN where a phase
+#doesn't have one
+STIMULUS_VARIABLES = ["stm_size", "stm_rotation_in_depth", "stm_pos_x"]
+
+#column name -> dtype of every column in the store. outcome indexes into
+#trial_segmentation.OUTCOMES, animal_id and phase_id into the index's
+#"animals" and "phases" lists, session_id into its "sessions" list.
+COLUMNS = [
+    ("animal_id", np.int16),
+    ("phase_id", np.int8),
+    ("session_id", np.int32),
+    ("trial_num", np.int32),
+    ("start_time", np.int64),
+    ("outcome", np.int8)
+] + [(variable, trial_segmentation.VARIABLE_DTYPE) for variable in
+    STIMULUS_VARIABLES]
+
+def get_store_dir(store_dir=None):
+    '''
+    Returns store_dir, or STORE_DIR in the trial cache if it's None (None if
+    the trial cache is off too).
+    '''
+    if store_dir is None:
+        store_dir = trial_cache.get_cache_path(STORE_DIR)
+    return store_dir
+
+def build_store(store_dir=None, processes=None):
+    '''
+    Reads every session of every animal in INPUT_DIR/phaseN (trials come
+    from the trial cache, so only new or changed sessions are read from their
+    .mwk files) and writes them all to the store. Returns the opened store
+    (see open_store()).
+
+    :param store_dir: directory the store is written to (see get_store_dir())
+    :param processes: number of worker processes, None for one per CPU core
+    '''
+    pool = session_pool.start_pool(processes)
+    animals, phases, sessions, tables = [], [], [], []
+    for phase in sorted(PHASE_MODULES):
+        phase_dir = os.path.join(INPUT_DIR, phase)
+        if not os.path.isdir(phase_dir):
+            continue
+        module_name, trials_func_name = PHASE_MODULES[phase]
+        module = __import__(module_name)
+        animals_and_sessions = \
+            module.get_animals_and_their_session_filenames(phase_dir)
+        trials_by_animal = session_pool.map_sessions(pool,
+            animals_and_sessions, getattr(module, trials_func_name),
+            module.get_session_path)
+        phases.append(phase)
+        for animal in sorted(animals_and_sessions):
+            if animal not in animals:
+                animals.append(animal)
+            for session, trials in zip(animals_and_sessions[animal],
+            trials_by_animal[animal]):
+                sessions.append({
+                    "phase": phase,
+                    "animal": animal,
+                    "filename": session,
+                    "signature": trial_cache.get_file_signature(
+                        module.get_session_path(animal, session))
+                })
+                tables.append(get_store_rows(trials,
+                    module.TRIAL_VARIABLES, animals.index(animal),
+                    len(phases) - 1, len(sessions) - 1))
+    pool.close()
+    pool.join()
+
+    columns = dict((name, np.concatenate([table[name] for table in tables])
+        if tables else np.zeros(0, dtype=dtype)) for name, dtype in COLUMNS)
+    start = 0
+    ranges = {}
+    for session, table in zip(sessions, tables):
+        stop = start + len(table["trial_num"])
+        session["start"], session["stop"] = start, stop
+        key = (session["phase"], session["animal"])
+        ranges[key] = (ranges.get(key, (start, stop))[0], stop)
+        start = stop
+    index = {
+        "version": STORE_VERSION,
+        "animals": animals,
+        "phases": phases,
+        "sessions": sessions,
+        "ranges": ranges
+    }
+    save_store(columns, index, store_dir)
+    return open_store(store_dir)
+
+def get_store_rows(trials, trial_variables, animal_id, phase_id, session_id):
+    '''
+    Returns a session's trial table (as the phase's get_session_trials()
+    returns it) as store columns (see COLUMNS).
+
+    :param trial_variables: the phase's TRIAL_VARIABLES, event name -> trial
+        table column
+    '''
+    num_trials = trial_segmentation.count_trials(trials)
+    rows = {}
+    for name, dtype in COLUMNS:
+        rows[name] = np.empty(num_trials, dtype=dtype)
+    rows["animal_id"].fill(animal_id)
+    rows["phase_id"].fill(phase_id)
+    rows["session_id"].fill(session_id)
+    if num_trials == 0:
+        return rows
+    rows["trial_num"][:] = trials["trial_num"]
+    rows["start_time"][:] = trials["start_time"]
+    rows["outcome"][:] = trials["outcome"]
+    for variable in STIMULUS_VARIABLES:
+        if variable in trial_variables:
+            rows[variable][:] = trials[trial_variables[variable]]
+        else:
+            rows[variable].fill(np.nan)
+    return rows
+
+def save_store(columns, index, store_dir=None):
+    '''
+    Writes the store's columns and then its index. Every file is written to a
+    temporary file and renamed into place, so a process that has the old
+    store mapped keeps seeing it whole.
+    '''
+    store_dir = get_store_dir(store_dir)
+    if store_dir is None:
+        raise ValueError("trial_cache.CACHE_DIR is None, pass a store_dir")
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    suffix = "." + str(os.getpid()) + ".tmp"
+    for name, column in columns.iteritems():
+        filename = os.path.join(store_dir, name + ".npy")
+        with open(filename + suffix, "wb") as f:
+            np.save(f, column)
+        os.rename(filename + suffix, filename)
+    trial_cache.save_pickle(os.path.join(store_dir, "index.pkl"), index)
+
+def open_store(store_dir=None):
+    '''
+    Returns {"index": {...}, "columns": {name: memory-mapped array}} for the
+    store in store_dir (see get_store_dir()), or None if there isn't one (or
+    it was written by another STORE_VERSION). Nothing is read from the
+    columns until it's sliced.
+    '''
+    store_dir = get_store_dir(store_dir)
+    if store_dir is None:
+        return None
+    index = trial_cache.load_pickle(os.path.join(store_dir, "index.pkl"))
+    if index is None or index.get("version") != STORE_VERSION:
+        return None
+    columns = {}
+    for name, dtype in COLUMNS:
+        columns[name] = np.load(os.path.join(store_dir, name + ".npy"),
+            mmap_mode="r")
+    return {"index": index, "columns": columns}
+
+def is_up_to_date(store):
+    '''
+    Returns whether the store has exactly the sessions in INPUT_DIR, none of
+    them changed since it was built.
+    '''
+    if store is None:
+        return False
+    stored = set((session["phase"], session["animal"], session["filename"],
+        session["signature"]) for session in store["index"]["sessions"])
+    current = set()
+    for phase in PHASE_MODULES:
+        phase_dir = os.path.join(INPUT_DIR, phase)
+        if not os.path.isdir(phase_dir):
+            continue
+        for animal in os.listdir(phase_dir):
+            animal_dir = os.path.join(phase_dir, animal)
+            if not os.path.isdir(animal_dir):
+                continue
+            for filename in os.listdir(animal_dir):
+                if not filename.startswith("."):
+                    current.add((phase, animal, filename,
+                        trial_cache.get_file_signature(
+                            os.path.join(animal_dir, filename))))
+    return stored == current
+
+def get_store(store_dir=None, processes=None):
+    '''
+    Returns the opened store, (re)building it first if sessions were added,
+    changed or removed since it was built.
+    '''
+    store = open_store(store_dir)
+    if not is_up_to_date(store):
+        store = build_store(store_dir, processes)
+    return store
+
+def get_row_ranges(store, animal=None, phase=None, session=None):
+    '''
+    Returns a list of (start, stop) row ranges in the store for an animal,
+    phase and/or session filename (None matches all of them), in store order.
+    '''
+    ranges = []
+    if session is None:
+        for (range_phase, range_animal), (start, stop) in sorted(
+        store["index"]["ranges"].iteritems(), key=lambda item: item[1]):
+            if ((animal is None or range_animal == animal) and
+            (phase is None or range_phase == phase)):
+                ranges.append((start, stop))
+        return ranges
+    for entry in store["index"]["sessions"]:
+        if (entry["filename"] == session and
+        (animal is None or entry["animal"] == animal) and
+        (phase is None or entry["phase"] == phase)):
+            ranges.append((entry["start"], entry["stop"]))
+    return ranges
+
+def query(store, animal=None, phase=None, session=None, **conditions):
+    '''
+    Returns a dict of columns (see COLUMNS) with the store's rows for an
+    animal, phase and/or session, keeping only rows that meet conditions,
+    e.g. AB3's phase 3 trials with size 30 and rotations from -60 to 60:
+        query(store, "AB3", "phase3", stm_size=30.0,
+            stm_rotation_in_depth=(-60.0, 60.0))
+    A condition is a column name with either a value rows have to equal or a
+    (low, high) range they have to be in (inclusive).
+
+    Rows of one (phase, animal) or session with no conditions are returned as
+    views of the memory-mapped columns, without copying anything.
+    '''
+    ranges = get_row_ranges(store, animal, phase, session)
+    columns = store["columns"]
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        rows = dict((name, column[start:stop]) for name, column in
+            columns.iteritems())
+    else:
+        rows = dict((name, np.concatenate([column[start:stop] for start, stop
+            in ranges]) if ranges else column[:0]) for name, column in
+            columns.iteritems())
+    if not conditions:
+        return rows
+    keep = np.ones(len(rows["trial_num"]), dtype=bool)
+    with np.errstate(invalid="ignore"): #NaN (not in the phase) never matches
+        for name, condition in conditions.iteritems():
+            if isinstance(condition, tuple):
+                low, high = condition
+                keep &= (rows[name] >= low) & (rows[name] <= high)
+            else:
+                keep &= rows[name] == condition
+    return dict((name, column[keep]) for name, column in rows.iteritems())
+
+def to_trial_table(rows, trial_variables):
+    '''
+    Returns store rows (e.g. from query()) as a trial table in the format the
+    phase scripts use (see trial_segmentation.make_trial_table()).
+
+    :param trial_variables: event name -> trial table column, e.g. a phase's
+        TRIAL_VARIABLES
+    '''
+    variable_columns = dict((column, np.asarray(rows[variable])) for
+        variable, column in trial_variables.iteritems())
+    table = trial_segmentation.make_trial_table(np.asarray(rows["outcome"]),
+        np.asarray(rows["start_time"]), variable_columns)
+    table["trial_num"] = np.asarray(rows["trial_num"])
+    return table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the trial store for every phase in input")
+    parser.add_argument("--processes", type=int, default=None,
+        help="number of worker processes (default: one per CPU core)")
+    args = parser.parse_args()
+
+    store = get_store(processes=args.processes)
+    print "%d trials from %d sessions in %s" % (
+        len(store["columns"]["trial_num"]), len(store["index"]["sessions"]),
+        get_store_dir())